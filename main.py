@@ -9,26 +9,136 @@ from collections import Counter
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
-import csv
 import os
 import json
+import asyncio
 from datetime import datetime, timedelta, timezone
-from collections import Counter, defaultdict
+from collections import Counter
 from discord import File
 
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import io
 from utils.timestamped_print import TimestampedPrint
-
-vc_sessions: dict[tuple[str, str], dict] = {}
+from utils.hyperloglog import DailySketches
+from utils.last_seen import LastSeenIndex
+from utils.ping_store import PingStore
+from utils.query import Concurrency, Count, Distinct, Overlap, Query, Sum, Top
+from utils.reaction_cache import ReactionCache
+from utils.reaction_log import ReactionLogs
+from utils.result_cache import ResultCache
+from utils.role_index import RoleIndex
+from utils.rollups import HourlyRollup
+from utils.spoiler_registry import SpoilerRegistry
+from utils.storage import open_storage
+from utils.timeutil import day_start, parse_ts
+from utils.voice_journal import VoiceJournal
+from utils.worker_pool import AnalyticsPool
 
 # Logging aktivieren
 logger = TimestampedPrint(log_file="bot.log", color=True)
 
 # Configuration
 CLEANUP_DAYS = 30  # Remove entries older than this many days
-TOKEN = os.environ['PING_COUNT_TOKEN']
+# Message/voice activity older than this many days is removed, 0 keeps it
+ACTIVITY_RETENTION_DAYS = int(
+    os.environ.get("PING_COUNT_ACTIVITY_RETENTION_DAYS", 0))
+# Memory budget for cached reactions, idle guilds are evicted beyond it
+REACTION_CACHE_MAX_BYTES = int(
+    os.environ.get("PING_COUNT_REACTION_CACHE_BYTES", 32 * 1024 * 1024))
+# Spoiler messages whose reactions are tracked (newest first, by age)
+SPOILER_MAX_MESSAGES = 100_000
+SPOILER_MAX_AGE_DAYS = 30
+SPOILER_REGISTRY_PATH = "data/reactions/spoiler_messages.csv"
+# discord.py message cache; reactions no longer depend on it
+MESSAGE_CACHE_SIZE = 100
+# Analytics results are reused for this many seconds even if new data
+# arrived, and for up to ANALYTICS_CACHE_MAX_AGE while nothing changed
+ANALYTICS_CACHE_TTL = 60
+ANALYTICS_CACHE_MAX_AGE = 15 * 60
+ANALYTICS_CACHE_ENTRIES = 256
+# Analytics run in a "thread" or "process" pool, at most
+# ANALYTICS_MAX_JOBS at a time; process workers read the raw rows
+ANALYTICS_POOL = os.environ.get("PING_COUNT_ANALYTICS_POOL", "thread")
+ANALYTICS_WORKERS = int(os.environ.get("PING_COUNT_ANALYTICS_WORKERS", 2))
+ANALYTICS_MAX_JOBS = 2
+# Distinct-user counts: "exact" (from the stored rows), "approx" (daily
+# HyperLogLog sketches) or "auto" (sketches from APPROX_MIN_MEMBERS on)
+DISTINCT_USERS_MODE = os.environ.get("PING_COUNT_DISTINCT_USERS", "auto")
+APPROX_MIN_MEMBERS = 10_000
+SKETCH_PRECISION = 11  # 2 KiB per guild, dataset and day, ~2.3% error
+# "csv" (day-partitioned segments), "sqlite" (data/activity.sqlite3) or
+# "binary" (fixed-width int64 records below data/binary, read with mmap)
+STORAGE_BACKEND = os.environ.get("PING_COUNT_STORAGE", "csv")
+
+# Single-file CSVs from before day partitioning, imported on startup
 CSV_PATH = "role_pings.csv"
+MESSAGES_CSV_PATH = "activity_messages.csv"
+VOICE_CSV_PATH = "activity_voice.csv"
+# Hourly message counts per channel and user, one CSV per day
+MESSAGE_ROLLUP_DIR = "data/rollups/messages"
+# Channels/users counted per guild and day for the top lists; beyond this
+# the counts of the least active ones are approximate
+TOP_CAPACITY = 256
+# HyperLogLog sketches of the active users per guild, dataset and day
+USER_SKETCH_DIR = "data/sketches/users"
+# Last message, voice or reaction activity per user, one CSV per guild
+LAST_SEEN_DIR = "data/last_seen"
+# Open voice sessions, replayed and reconciled on startup
+VOICE_JOURNAL_PATH = "data/voice_sessions.csv"
+# Sessions of users no longer in voice are dropped after this long
+VOICE_SESSION_STALE = timedelta(hours=1)
+
+# Pings, message activity and voice sessions; appends are buffered and
+# written in batches by the backend's write queue
+storage = open_storage(STORAGE_BACKEND)
+
+# In-memory copy of the role pings, loaded once and kept in sync by append_ping
+ping_store = PingStore()
+
+# Message counts per hour, channel and user for the /activity_* commands,
+# kept in sync by append_message_activity
+message_rollup = HourlyRollup(MESSAGE_ROLLUP_DIR, TOP_CAPACITY)
+
+# Distinct users per day of messages, pings, voice and reactions, kept in
+# sync by the append helpers and built from the stored history on first use
+user_sketches = DailySketches(USER_SKETCH_DIR, SKETCH_PRECISION,
+                              rebuild=lambda g: sketch_history(g))
+
+# Last activity per guild and user for /activity_inactive, updated by the
+# append helpers and checkpointed with the rollup
+last_seen = LastSeenIndex(LAST_SEEN_DIR,
+                          rebuild=lambda g: last_seen_history(g))
+
+# Voice sessions in progress, journaled so a restart does not lose them
+voice_journal = VoiceJournal(VOICE_JOURNAL_PATH)
+
+# Voice concurrency per (guild, day) for /activity_vc_peak, kept once no
+# open session can still add to the day
+vc_peak_days: dict[tuple, dict] = {}
+
+# Spoiler reactions, one append-only JSONL log per guild, served from an
+# LRU cache that writes new reactions back in batches
+reaction_logs = ReactionLogs("data/reactions/stats")
+reaction_cache = ReactionCache(reaction_logs, REACTION_CACHE_MAX_BYTES)
+
+# Results of the /activity_* commands, invalidated through the dataset
+# watermarks bumped by the append, reset and cleanup helpers
+analytics_cache = ResultCache(ANALYTICS_CACHE_ENTRIES, ANALYTICS_CACHE_TTL,
+                              ANALYTICS_CACHE_MAX_AGE)
+
+# Heavy queries and graphs are computed here instead of on the event loop
+analytics_pool = AnalyticsPool(ANALYTICS_POOL, ANALYTICS_WORKERS,
+                               ANALYTICS_MAX_JOBS)
+
+# Role -> member IDs per guild for the reaction role rankings, kept current
+# by the member and role events
+role_index = RoleIndex()
+
+# IDs of spoiler messages seen by on_message, checked by the raw reaction
+# events so reactions on uncached messages are still counted
+spoiler_messages = SpoilerRegistry(SPOILER_REGISTRY_PATH,
+                                   SPOILER_MAX_MESSAGES,
+                                   timedelta(days=SPOILER_MAX_AGE_DAYS))
 
 # Configure bot intents (permissions for what the bot can see/do)
 intents = discord.Intents.default()
@@ -42,84 +152,90 @@ intents.members = True  # Required to get member information
 async def daily_cleanup():
     """Automatically clean up old entries every 24 hours."""
     cleanup_old_entries()
+    cleanup_old_activity()
+    print(f"[WriteQueue] {storage.write_queue.stats()}")
+    print(f"[ReactionCache] {reaction_cache.stats()}")
+    print(f"[AnalyticsCache] {analytics_cache.stats()}")
+
+
+# Tombstone compaction - folds pending resets and reaction cleanups into the
+# data files
+@tasks.loop(minutes=10)
+async def compact_tombstones():
+    """Rewrite data files once enough resets have piled up."""
+    if storage.needs_compaction():
+        removed = await asyncio.to_thread(compact_storage)
+        print(f"✓ Compacted tombstones, removed {removed} rows")
+    if reaction_logs.needs_compaction():
+        dropped = await asyncio.to_thread(reaction_logs.compact)
+        print(f"✓ Compacted reaction logs, dropped {dropped} lines")
+
+
+# Rollup flush - writes the days whose message counts changed
+@tasks.loop(minutes=1)
+async def flush_rollups():
+    """Persist the hourly message rollup, user sketches and last seen."""
+    await asyncio.to_thread(message_rollup.flush)
+    await asyncio.to_thread(user_sketches.flush)
+    await asyncio.to_thread(last_seen.checkpoint)
+
+
+# Voice session sweep - drops sessions whose leave event was missed and
+# marks the bot as alive for the startup reconciliation
+@tasks.loop(minutes=5)
+async def sweep_voice_sessions():
+    """Forget stale voice sessions."""
+    active = [(guild.id, member.id) for guild in bot.guilds
+              for channel in guild.voice_channels + guild.stage_channels
+              for member in channel.members]
+    cutoff = datetime.now(timezone.utc) - VOICE_SESSION_STALE
+    dropped = await asyncio.to_thread(voice_journal.sweep, cutoff, active)
+    await asyncio.to_thread(voice_journal.heartbeat)
+    if dropped:
+        print(f"[VoiceJournal] Dropped {dropped} stale sessions")
 
 
 # Initialize the bot
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = commands.Bot(command_prefix="!",
+                   intents=intents,
+                   max_messages=MESSAGE_CACHE_SIZE)
 
 # ========== Spoiler Reaction JSON Management ==========
 
 
-def _reaction_json_path(guild_id):
-    return f"data/reactions/stats/{guild_id}.json"
+def reaction_stats_path(guild_id):
+    return reaction_logs.get(guild_id).path
 
 
 def ensure_reaction_json_exists(guild_id):
-    """Make sure the JSON file exists for the guild."""
-    path = _reaction_json_path(guild_id)
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-
-    if not os.path.exists(path):
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"reactions": []}, f, indent=4)
+    """Make sure the reaction log exists (imports an old <guild>.json)."""
+    reaction_logs.get(guild_id).ensure_exists()
 
 
 def append_spoiler_reaction_json(guild_id, message_id, user_id, emoji):
-    """Save a spoiler reaction into <guild>.json"""
-    ensure_reaction_json_exists(guild_id)
-    path = _reaction_json_path(guild_id)
-
-    with open(path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    entry = {
-        "message_id": str(message_id),
-        "user_id": str(user_id),
-        "emoji": str(emoji),
-        "timestamp": datetime.now(timezone.utc).isoformat()
-    }
-
-    data["reactions"].append(entry)
-
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+    """Append a spoiler reaction to <guild>.jsonl"""
+    record_reaction(guild_id, message_id, user_id, str(emoji))
 
 
 def read_reaction_json(guild_id):
-    """Read <guild>.json reactions."""
-    ensure_reaction_json_exists(guild_id)
-    path = _reaction_json_path(guild_id)
-
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)["reactions"]
-
-
-def reaction_stats_path(guild_id):
-    return f"data/reactions/stats/{guild_id}.json"
+    """Read <guild>.jsonl reactions."""
+    return reaction_cache.entries(guild_id)
 
 
 def load_reaction_stats(guild_id):
-    path = reaction_stats_path(guild_id)
-    if not os.path.exists(path):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "w") as f:
-            json.dump({"reactions": []}, f)
-        return {"reactions": []}
-
-    with open(path, "r") as f:
-        return json.load(f)
+    return {"reactions": reaction_cache.entries(guild_id)}
 
 
 def save_reaction_stats(guild_id, data):
-    path = reaction_stats_path(guild_id)
-    with open(path, "w") as f:
-        json.dump(data, f, indent=4)
+    reaction_cache.rewrite(guild_id, data["reactions"])
 
 
 def record_reaction(guild_id, message_id, user_id, emoji):
-    data = load_reaction_stats(guild_id)
-
-    data["reactions"].append({
+    now = datetime.now(timezone.utc)
+    user_sketches.add(guild_id, "reactions", str(user_id), now)
+    last_seen.touch(guild_id, user_id, now)
+    # Cached right away, appended to <guild>.jsonl by the next flush
+    reaction_cache.append(guild_id, {
         "message_id":
         str(message_id),
         "user_id":
@@ -127,10 +243,16 @@ def record_reaction(guild_id, message_id, user_id, emoji):
         "emoji":
         emoji,
         "timestamp":
-        datetime.now(timezone.utc).isoformat()
+        now.isoformat()
     })
 
-    save_reaction_stats(guild_id, data)
+
+def seed_spoiler_messages(guild_id):
+    """Register messages that already have recorded spoiler reactions."""
+    message_ids = {e["message_id"] for e in reaction_cache.entries(guild_id)}
+    for message_id in message_ids:
+        if message_id.isdigit():
+            spoiler_messages.add(guild_id, message_id)
 
 
 def load_reaction_config(guild_id):
@@ -144,26 +266,12 @@ async def build_role_ranking(guild, reaction_stats, reaction_config):
     # hole die rollen, die für dieses guild konfiguriert sind
     role_ids = reaction_config.get(str(guild.id), [])
 
-    # vorbereiten
-    role_totals = {role_id: 0 for role_id in role_ids}
-
     # Schritt 1: User → Reaktionsanzahl
-    user_reaction_count = {}
+    user_reaction_count = Counter(entry["user_id"]
+                                  for entry in reaction_stats["reactions"])
 
-    for entry in reaction_stats["reactions"]:
-        uid = entry["user_id"]
-        user_reaction_count[uid] = user_reaction_count.get(uid, 0) + 1
-
-    # Schritt 2: Für jeden User prüfen, welche der konfigurierten Rollen er hat
-    for user_id, reaction_count in user_reaction_count.items():
-        member = guild.get_member(int(user_id))
-        if not member:
-            continue
-
-        for role_id in role_ids:
-            role = guild.get_role(int(role_id))
-            if role and role in member.roles:
-                role_totals[str(role_id)] += reaction_count
+    # Schritt 2: Reaktionen der Mitglieder jeder Rolle summieren (Rollen-Index)
+    role_totals = role_index.totals(guild, role_ids, user_reaction_count)
 
     # sortieren nach Reaktionen
     sorted_roles = sorted(role_totals.items(),
@@ -177,22 +285,19 @@ async def build_role_ranking(guild, reaction_stats, reaction_config):
 
 
 def ensure_csv_exists():
-    """Create the CSV file with headers if it doesn't exist."""
-    print("Ensuring CSV exists...")
-    if not os.path.exists(CSV_PATH) or os.path.getsize(CSV_PATH) == 0:
+    """Import single-file CSVs and day segments from before guild shards."""
+    for dataset, legacy_path in (("pings", CSV_PATH),
+                                 ("messages", MESSAGES_CSV_PATH),
+                                 ("voice", VOICE_CSV_PATH)):
         try:
-            with open(CSV_PATH, "w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    "guild_id", "role_id", "user_id", "channel_id", "timestamp"
-                ])
+            storage.import_legacy(dataset, legacy_path)
         except Exception as e:
-            print(f"Error creating CSV: {e}")
+            print(f"Error importing {legacy_path}: {e}")
 
 
 def append_ping(guild_id, role_id, user_id, channel_id):
     """
-    Add a new role ping entry to the CSV file.
+    Queue a new role ping entry for storage.
     
     Args:
         guild_id: Discord server ID
@@ -200,90 +305,201 @@ def append_ping(guild_id, role_id, user_id, channel_id):
         user_id: User who pinged the role
         channel_id: Channel where the ping occurred
     """
-    print(f"Appending ping: {guild_id}, {role_id}, {user_id}, {channel_id}")
-    ensure_csv_exists()
-    try:
-        with open(CSV_PATH, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                guild_id, role_id, user_id, channel_id,
-                datetime.now(timezone.utc).isoformat()
-            ])
-    except Exception as e:
-        print(f"Error appending ping: {e}")
+    now = datetime.now(timezone.utc)
+    get_ping_store().append(guild_id, role_id, user_id, channel_id, now)
+    user_sketches.add(guild_id, "pings", user_id, now)
+    analytics_cache.bump("pings", guild_id)
+    storage.append(
+        "pings", {
+            "guild_id": guild_id,
+            "role_id": role_id,
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "timestamp": now.isoformat()
+        })
+
+
+def get_ping_store():
+    """
+    Return the in-memory ping store, loading it from storage on first use.
+    
+    Returns:
+        The PingStore mirroring the stored pings
+    """
+    if ping_store.path != storage.location:
+        storage.flush()
+        ping_store.load(storage.iter_rows("pings"), storage.location)
+    return ping_store
+
+
+def get_message_rollup():
+    """
+    Return the hourly message rollup, loading it on first use.
+
+    The rollup is rebuilt from the stored messages if its directory does
+    not exist yet, messages stored after its last flush are replayed.
+    
+    Returns:
+        The HourlyRollup for MESSAGE_ROLLUP_DIR
+    """
+    if message_rollup.location is None:
+        storage.flush()
+        message_rollup.load(
+            lambda start: storage.iter_rows("messages", start=start))
+    return message_rollup
+
+
+def sketch_history(guild_id):
+    """
+    Yield (dataset, user_id, timestamp) for every stored activity of a
+    guild, to build its user sketches.
+
+    Messages come from the hourly rollup instead of the raw rows.
+    """
+    by_day = get_message_rollup().count_by(guild_id, ("day", "user_id"))
+    for day, user_id in by_day:
+        yield "messages", user_id, datetime(day.year, day.month, day.day,
+                                            tzinfo=timezone.utc)
+    storage.flush()
+    for row in storage.iter_rows("pings", guild_id):
+        yield "pings", row["user_id"], parse_ts(row["timestamp"])
+    for row in storage.iter_rows("voice", guild_id):
+        yield "voice", row["user_id"], parse_ts(row["joined_at"])
+    for entry in reaction_cache.entries(guild_id):
+        yield "reactions", entry["user_id"], parse_ts(entry["timestamp"])
+
+
+def last_seen_history(guild_id):
+    """Yield (user_id, timestamp) for every stored activity of a guild."""
+    storage.flush()
+    for row in storage.iter_rows("messages", guild_id):
+        yield row["user_id"], parse_ts(row["timestamp"])
+    for row in storage.iter_rows("voice", guild_id):
+        yield row["user_id"], parse_ts(row["left_at"])
+    for entry in reaction_cache.entries(guild_id):
+        yield entry["user_id"], parse_ts(entry["timestamp"])
+
+
+def approximate_users(guild) -> bool:
+    """Whether distinct users of `guild` are estimated from sketches."""
+    if DISTINCT_USERS_MODE == "auto":
+        return (guild.member_count or 0) >= APPROX_MIN_MEMBERS
+    return DISTINCT_USERS_MODE == "approx"
+
+
+def distinct_users(guild, datasets, since: datetime, exact: int | None):
+    """
+    Format the number of distinct users for an embed.
+
+    Args:
+        guild: Discord guild
+        datasets: Datasets whose users count, e.g. ("voice", )
+        since: Start of the window
+        exact: Exact count, used unless the guild is estimated
+
+    Returns:
+        The count, or "~estimate (±error)" from the daily sketches
+    """
+    if exact is not None and not approximate_users(guild):
+        return str(exact)
+    estimate = user_sketches.estimate(guild.id, datasets, since)
+    return f"~{estimate} (±{user_sketches.error:.0%})"
+
+
+async def run_query(query: Query, command: str | None = None,
+                    *params) -> dict:
+    """
+    Compute a Query over the stored data in the analytics pool.
+
+    Message counts are served from the hourly rollup where possible.
+    
+    Args:
+        query: What to compute
+        command: Command name to cache the result under (None: no cache)
+        params: Command parameters the result depends on, e.g. days
+    
+    Returns:
+        Dictionary: {aggregation name: result}, shared with the cache
+    """
+    rollup = get_message_rollup()
+
+    async def compute():
+        return await analytics_pool.execute(query, storage, rollup)
+
+    if command is None:
+        return await compute()
+    return await analytics_cache.get_or_compute_async(
+        command, query.guild_id, (query.dataset, ) + params,
+        (query.dataset, ), compute)
 
 
 def read_all_pings():
     """
-    Read all ping entries from the CSV file.
+    Read all ping entries from storage.
     
     Returns:
         List of dictionaries containing ping data
     """
-    ensure_csv_exists()
-    with open(CSV_PATH, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        return list(reader)
+    storage.flush()
+    return list(storage.iter_rows("pings"))
 
 
 def write_all_pings(rows):
     """
-    Write all ping entries back to the CSV file (overwrites existing data).
+    Write all ping entries back to storage (overwrites existing data).
     
     Args:
-        rows: List of dictionaries to write to CSV
+        rows: List of dictionaries to write
     """
-    with open(CSV_PATH, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f,
-                                fieldnames=[
-                                    "guild_id", "role_id", "user_id",
-                                    "channel_id", "timestamp"
-                                ])
-        writer.writeheader()
-        writer.writerows(rows)
+    storage.rewrite("pings", rows)
+    analytics_cache.bump("pings")
 
 
 def cleanup_old_entries(days: int = CLEANUP_DAYS):
-    if not os.path.exists(CSV_PATH):
-        return
-
+    """
+    Apply ping retention. The CSV backend deletes whole day segments that
+    lie before the cutoff.
+    
+    Args:
+        days: Retention period in days
+    """
     cutoff = datetime.now(timezone.utc) - timedelta(days=days)
 
-    kept = []
-    removed = 0
-
-    with open(CSV_PATH, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                ts = datetime.fromisoformat(row["timestamp"])
-                # Handle naive timestamps (old data) by assuming UTC
-                if ts.tzinfo is None:
-                    ts = ts.replace(tzinfo=timezone.utc)
-                if ts >= cutoff:
-                    kept.append(row)
-                else:
-                    removed += 1
-            except Exception as e:
-                print(f"Error parsing timestamp: {e}")
-                continue
+    removed = storage.drop_before("pings", cutoff)
+    analytics_cache.bump("pings")
 
-    # 🚫 Wenn nichts gelöscht wurde: CSV NICHT anfassen
+    # 🚫 Wenn nichts gelöscht wurde: nichts anfassen
     if removed == 0:
         print("Cleanup: nichts zu löschen.")
         return
 
-    # 🟢 Nur überschreiben, wenn nötig
-    with open(CSV_PATH, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f,
-                                fieldnames=[
-                                    "guild_id", "role_id", "user_id",
-                                    "channel_id", "timestamp"
-                                ])
-        writer.writeheader()
-        writer.writerows(kept)
+    # Keep the in-memory store in line with what is left on disk
+    get_ping_store().remove_older_than(storage.retention_boundary(cutoff))
 
-    print(f"✓ Cleaned up {removed} old entries (> {days} days old)")
+    print(f"✓ Cleaned up old pings ({removed} removed, > {days} days old)")
+
+
+def cleanup_old_activity(days: int = ACTIVITY_RETENTION_DAYS):
+    """
+    Apply retention to message activity and voice sessions.
+
+    Args:
+        days: Retention period in days, 0 keeps everything
+    """
+    if days <= 0:
+        return
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    removed = (storage.drop_before("messages", cutoff) +
+               storage.drop_before("voice", cutoff))
+    get_message_rollup().drop_before(cutoff)
+    user_sketches.drop_before(cutoff)
+    for key in [k for k in vc_peak_days if k[1] < cutoff.date()]:
+        del vc_peak_days[key]
+    analytics_cache.bump("messages")
+    analytics_cache.bump("voice")
+    if removed:
+        print(f"✓ Cleaned up old activity ({removed} removed, "
+              f"> {days} days old)")
 
 
 # ========== Data Query Functions ==========
@@ -301,12 +517,7 @@ def get_top_for_role(guild_id, role_id, limit=10):
     Returns:
         List of tuples: [(user_id, count), ...]
     """
-    rows = read_all_pings()
-    counts = Counter()
-    for row in rows:
-        if row["guild_id"] == str(guild_id) and row["role_id"] == str(role_id):
-            counts[row["user_id"]] += 1
-    return counts.most_common(limit)
+    return get_ping_store().top_for_role(guild_id, role_id, limit)
 
 
 def get_counts_for_user(guild_id, user_id):
@@ -320,79 +531,108 @@ def get_counts_for_user(guild_id, user_id):
     Returns:
         List of tuples: [(role_id, count), ...]
     """
-    rows = read_all_pings()
-    counts = Counter()
-    for row in rows:
-        if row["guild_id"] == str(guild_id) and row["user_id"] == str(user_id):
-            counts[row["role_id"]] += 1
-    return counts.most_common()
+    return get_ping_store().counts_for_user(guild_id, user_id)
 
 
 def reset_role_counts(guild_id, role_id):
     """
     Reset all ping counts for a specific role.
     
+    With the CSV backend the reset is recorded as a tombstone and the
+    segments are rewritten later by compact_storage().
+    
     Args:
         guild_id: Discord server ID
         role_id: The role to reset
     """
-    rows = read_all_pings()
-    new_rows = [
-        r for r in rows if not (
-            r["guild_id"] == str(guild_id) and r["role_id"] == str(role_id))
-    ]
-    write_all_pings(new_rows)
+    if get_ping_store().remove_role(guild_id, role_id):
+        storage.delete("pings", guild_id, "role_id", role_id)
+        analytics_cache.bump("pings", guild_id)
 
 
 def reset_user_counts(guild_id, user_id):
     """
     Reset all ping counts for a specific user.
     
+    With the CSV backend the reset is recorded as a tombstone and the
+    segments are rewritten later by compact_storage().
+    
     Args:
         guild_id: Discord server ID
         user_id: The user to reset
     """
-    rows = read_all_pings()
-    new_rows = [
-        r for r in rows if not (
-            r["guild_id"] == str(guild_id) and r["user_id"] == str(user_id))
-    ]
-    write_all_pings(new_rows)
+    if get_ping_store().remove_user(guild_id, user_id):
+        storage.delete("pings", guild_id, "user_id", user_id)
+        analytics_cache.bump("pings", guild_id)
 
 
-# ========== general message activity ==========
+def compact_storage():
+    """
+    Fold pending reset tombstones into the data files.
+    
+    Returns:
+        Number of rows removed from disk
+    """
+    return storage.compact()
 
 
-def parse_ts(ts: str) -> datetime:
-    dt = datetime.fromisoformat(ts)
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=timezone.utc)
-    return dt.astimezone(timezone.utc)
+# ========== general message activity ==========
 
 
 def append_message_activity(guild_id, user_id, channel_id):
-    file_exists = os.path.isfile("activity_messages.csv")
-
-    with open("activity_messages.csv", "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-
-        if not file_exists:
-            writer.writerow(["guild_id", "user_id", "channel_id", "timestamp"])
-
-        writer.writerow(
-            [guild_id, user_id, channel_id,
-             datetime.utcnow().isoformat()])
-
-
-def ensure_voice_csv():
-    if not os.path.exists("activity_voice.csv"):
-        with open("activity_voice.csv", "w", encoding="utf-8",
-                  newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "guild_id", "user_id", "channel_id", "joined_at", "left_at",
-                "duration_seconds"
-            ])
+    now = datetime.now(timezone.utc)
+    # Before the append, so a rollup rebuilt here does not count it twice
+    get_message_rollup().add(guild_id, channel_id, user_id, now)
+    user_sketches.add(guild_id, "messages", user_id, now)
+    last_seen.touch(guild_id, user_id, now)
+    analytics_cache.bump("messages", guild_id)
+    storage.append(
+        "messages", {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "timestamp": now.isoformat()
+        })
+
+
+def end_voice_session(guild_id, user_id, channel_id, joined, left):
+    """Record a finished voice session unless it lasted no time."""
+    duration = int((left - joined).total_seconds())
+    if duration > 0:
+        append_voice_session(guild_id, user_id, channel_id, joined, left,
+                             duration)
+
+
+def reconcile_voice_sessions(guild):
+    """
+    Resume, close or open the journaled sessions of a guild to match its
+    voice channels after a restart.
+    """
+    in_voice = {
+        member.id: channel.id
+        for channel in guild.voice_channels + guild.stage_channels
+        for member in channel.members if not member.bot
+    }
+    closed = voice_journal.reconcile(guild.id, in_voice,
+                                     datetime.now(timezone.utc))
+    for user_id, channel_id, joined, left in closed:
+        end_voice_session(str(guild.id), user_id, channel_id, joined, left)
+
+
+def append_voice_session(guild_id, user_id, channel_id, joined, left,
+                         duration):
+    user_sketches.add(guild_id, "voice", user_id, joined)
+    last_seen.touch(guild_id, user_id, left)
+    analytics_cache.bump("voice", guild_id)
+    storage.append(
+        "voice", {
+            "guild_id": guild_id,
+            "user_id": user_id,
+            "channel_id": channel_id,
+            "joined_at": joined.isoformat(),
+            "left_at": left.isoformat(),
+            "duration_seconds": duration
+        })
 
 
 # ========== Bot Events ==========
@@ -402,10 +642,26 @@ def ensure_voice_csv():
 async def on_ready():
     """Called when the bot successfully connects to Discord."""
     ensure_csv_exists()
+    get_ping_store()  # Load role pings into memory once
+    get_message_rollup()  # Load (or build) the hourly message counts
+    storage.start()  # Start batching appends
+    reaction_cache.start()  # Start flushing cached reactions
+    spoiler_messages.start()  # Start flushing new spoiler IDs
+    seed_spoilers = len(spoiler_messages) == 0  # First start with a registry
     for guild in bot.guilds:
         ensure_reaction_json_exists(guild.id)
+        if seed_spoilers:
+            seed_spoiler_messages(guild.id)
+        reconcile_voice_sessions(guild)
+        # Build missing sketches and last-seen times here rather than
+        # on the first message
+        await asyncio.to_thread(user_sketches.warm, guild.id)
+        await asyncio.to_thread(last_seen.warm, guild.id)
     cleanup_old_entries()  # Clean up old entries on startup
     daily_cleanup.start()  # Start the daily cleanup task
+    compact_tombstones.start()  # Start the tombstone compactor
+    flush_rollups.start()  # Start persisting the message rollup
+    sweep_voice_sessions.start()  # Start sweeping stale voice sessions
     await bot.tree.sync()  # Sync slash commands with Discord
 
     # Loop through all servers (guilds) the bot is connected to
@@ -457,6 +713,7 @@ async def on_message(message: discord.Message):
     if is_spoiler:
         # We only need to record the message_id,
         # the reactions will populate the data later.
+        spoiler_messages.add(message.guild.id, message.id)
         print(
             f"[SpoilerTracker] Marked message {message.id} as spoiler content."
         )
@@ -469,41 +726,25 @@ async def on_voice_state_update(member, before, after):
 
     guild_id = str(member.guild.id)
     user_id = str(member.id)
-    key = (guild_id, user_id)
 
     now = datetime.now(timezone.utc)
 
-    # JOIN VC
-    if before.channel is None and after.channel is not None:
-        vc_sessions[key] = {
-            "joined_at": now,
-            "channel_id": str(after.channel.id)
-        }
+    # JOIN or MOVE VC - a move ends the session in the previous channel
+    if after.channel is not None and (before.channel is None or
+                                      before.channel.id != after.channel.id):
+        previous = voice_journal.open(guild_id, user_id, after.channel.id,
+                                      now)
+        if previous:
+            end_voice_session(guild_id, user_id, previous["channel_id"],
+                              previous["joined_at"], now)
         return
 
     # LEAVE VC
     if before.channel is not None and after.channel is None:
-        session = vc_sessions.pop(key, None)
-        if not session:
-            return
-
-        joined = session["joined_at"]
-        channel_id = session["channel_id"]
-        duration = int((now - joined).total_seconds())
-
-        if duration <= 0:
-            return
-
-        ensure_voice_csv()
-
-        with open("activity_voice.csv", "a", encoding="utf-8",
-                  newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                guild_id, user_id, channel_id,
-                joined.isoformat(),
-                now.isoformat(), duration
-            ])
+        session = voice_journal.close(guild_id, user_id, now)
+        if session:
+            end_voice_session(guild_id, user_id, session["channel_id"],
+                              session["joined_at"], now)
 
 
 # ========== Slash Commands ==========
@@ -574,40 +815,26 @@ async def leaderboard(interaction: discord.Interaction,
     """
     if role is None:
         # Show server-wide leaderboard with all roles
-        rows = read_all_pings()
-        guild_rows = [
-            r for r in rows if r["guild_id"] == str(interaction.guild.id)
-        ]
+        store = get_ping_store()
+        max_roles = 5  # Show top 5 roles
+        sorted_roles = store.top_roles(interaction.guild.id, max_roles)
 
-        if not guild_rows:
+        if not sorted_roles:
             await interaction.response.send_message(
                 "No data found for this server yet.", ephemeral=True)
             return
 
-        # Group pings by role
-        grouped = defaultdict(Counter)
-        for r in guild_rows:
-            grouped[r["role_id"]][r["user_id"]] += 1
-
-        # Sort roles by total ping count
-        sorted_roles = sorted(grouped.items(),
-                              key=lambda x: sum(x[1].values()),
-                              reverse=True)
-
         # Build embed with top roles
         embed = discord.Embed(title="🌍 Server Leaderboard — All Roles",
                               color=discord.Color.gold(),
                               description="")
 
-        max_roles = 5  # Show top 5 roles
-        for idx, (role_id, counter) in enumerate(sorted_roles[:max_roles],
-                                                 start=1):
+        for idx, (role_id, total_pings) in enumerate(sorted_roles, start=1):
             role_obj = interaction.guild.get_role(int(role_id))
             if role_obj is None:
                 continue  # Skip deleted roles
 
-            total_pings = sum(counter.values())
-            top_users = counter.most_common(3)
+            top_users = store.top_for_role(interaction.guild.id, role_id, 3)
 
             # Format top users for this role
             user_lines = []
@@ -691,38 +918,84 @@ async def cleanup(interaction: discord.Interaction, days: int | None = None):
 
 
 @bot.event
-async def on_reaction_add(reaction: discord.Reaction, user: discord.User):
-    if user.bot:
-        return
+async def on_member_join(member: discord.Member):
+    role_index.member_joined(member)
 
-    print(f"[SpoilerTracker] Reaction added: {reaction.emoji} by {user}")
-    message = reaction.message
-    guild = message.guild
-    if guild is None:
-        return
 
-    # Spoiler detection
-    is_spoiler = any(
-        att.filename.startswith("SPOILER_") for att in message.attachments)
-    if "||" in message.content:
-        is_spoiler = True
+@bot.event
+async def on_member_remove(member: discord.Member):
+    role_index.member_removed(member)
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    if before.roles != after.roles:
+        role_index.member_updated(before, after)
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    role_index.role_deleted(role)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    role_index.forget(guild.id)
+
 
-    if not is_spoiler:
+@bot.event
+async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
+    # Raw events also fire for messages that are no longer cached
+    if payload.guild_id is None or payload.message_id not in spoiler_messages:
         return
+    if payload.member is not None and payload.member.bot:
+        return
+
+    # Log entry in the reaction log
+    record_reaction(guild_id=payload.guild_id,
+                    message_id=payload.message_id,
+                    user_id=payload.user_id,
+                    emoji=str(payload.emoji))
 
-    # Log entry in JSON
-    record_reaction(guild_id=guild.id,
-                    message_id=message.id,
-                    user_id=user.id,
-                    emoji=str(reaction.emoji))
+    print(f"[SpoilerTracker] {payload.user_id} reacted with {payload.emoji} "
+          f"to spoiler message {payload.message_id}")
+
+
+@bot.event
+async def on_raw_reaction_remove(payload: discord.RawReactionActionEvent):
+    if payload.guild_id is None or payload.message_id not in spoiler_messages:
+        return
 
-    print(f"[SpoilerTracker] {user} reacted with {reaction.emoji} "
-          f"to spoiler message {message.id} in {guild.name}")
+    if reaction_cache.remove(payload.guild_id, payload.message_id,
+                             payload.user_id, str(payload.emoji)):
+        print(f"[SpoilerTracker] {payload.user_id} removed {payload.emoji} "
+              f"from spoiler message {payload.message_id}")
 
 
 # ========== ping_timeline Commands ==========
 
 
+def render_timeline(days, counts, title) -> bytes:
+    """
+    Draw the ping timeline as PNG.
+
+    Uses a Figure instead of pyplot, so it can run in the analytics pool.
+    """
+    fig = Figure(figsize=(10, 4))
+    ax = fig.add_subplot()
+    ax.plot(days, counts, marker="o")
+    ax.set_xlabel("Datum")
+    ax.set_ylabel("Anzahl der Roll-Pings")
+    ax.set_title(title)
+    ax.grid(True)
+    fig.tight_layout()
+
+    # Bild in Bytes speichern
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
 @app_commands.checks.has_permissions(manage_guild=True)
 @bot.tree.command(
     name="timeline",
@@ -735,36 +1008,12 @@ async def timeline(interaction: discord.Interaction,
     print(f"Generating timeline for {role.name if role else 'all roles'}...")
 
     guild_id = interaction.guild.id
-    csv_file = "role_pings.csv"
-
-    if not os.path.exists(csv_file):
-        return await interaction.followup.send(
-            "Noch keine Ping-Daten vorhanden.")
-
-    # --- CSV einlesen ---
-    timestamps = defaultdict(int)
-    role_id_filter = str(role.id) if role else None
-
-    with open(csv_file, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        #print(f"Reading CSV {reader}...")
-        for row in reader:
-            # nur dieses Guild
-            #print(f"Reading row {row}...")
-            if str(row["guild_id"]) != str(guild_id):
-                continue
 
-            # Optional Rolle filtern
-            if role_id_filter and row["role_id"] != role_id_filter:
-                continue
-
-            ts = datetime.fromisoformat(row["timestamp"])
-            # Handle naive timestamps (old data) by assuming UTC
-            if ts.tzinfo is None:
-                ts = ts.replace(tzinfo=timezone.utc)
-            day = ts.date()
-            timestamps[day] += 1
-            #print(f"loop timestamps {timestamps}...")
+    # --- Pings pro Tag zählen (optional nur eine Rolle) ---
+    filters = {"role_id": role.id} if role else None
+    timestamps = (await run_query(
+        Query("pings", guild_id, [Count("days", "day")], filters=filters),
+        "timeline", role.id if role else None))["days"]
 
     if not timestamps:
         return await interaction.followup.send(
@@ -775,19 +1024,10 @@ async def timeline(interaction: discord.Interaction,
     counts = [timestamps[d] for d in days]
 
     # --- Graph erstellen ---
-    plt.figure(figsize=(10, 4))
-    plt.plot(days, counts, marker="o")
-    plt.xlabel("Datum")
-    plt.ylabel("Anzahl der Roll-Pings")
-    plt.title(f"Ping-Verlauf{' für ' + role.name if role else ''}")
-    plt.grid(True)
-    plt.tight_layout()
-
-    # Bild in Bytes speichern
-    buffer = io.BytesIO()
-    plt.savefig(buffer, format="png")
-    buffer.seek(0)
-    plt.close()
+    png = await analytics_pool.run(
+        render_timeline, days, counts,
+        f"Ping-Verlauf{' für ' + role.name if role else ''}")
+    buffer = io.BytesIO(png)
 
     # --- Graph senden ---
     try:
@@ -807,18 +1047,13 @@ async def reactionstats(interaction: discord.Interaction):
     print(f"Generating reaction stats for {interaction.guild.name}...")
     guild_id = str(interaction.guild.id)
 
-    stats = load_reaction_stats(guild_id)
-    reactions = stats["reactions"]
+    # Counts total - User Ranking (counted on the cached columns)
+    counter = reaction_cache.user_counts(guild_id)
 
-    if not reactions:
+    if not counter:
         return await interaction.response.send_message(
             "Keine Reaktionen gespeichert.", ephemeral=True)
 
-    # Counts total - User Ranking
-    counter = Counter()
-    for r in reactions:
-        counter[r["user_id"]] += 1
-
     top10 = counter.most_common(10)
 
     embed = discord.Embed(title="📸 Spoiler Reaction Leaderboard (Top 10)",
@@ -842,23 +1077,11 @@ async def reactionstats(interaction: discord.Interaction):
         embed.add_field(name="— — — — —", value=" ", inline=False)
 
         # (1) Count reactions per user
-        user_reaction_count = Counter()
-        for r in reactions:
-            user_reaction_count[r["user_id"]] += 1
-
-        # (2) Prepare role totals
-        role_totals = {rid: 0 for rid in rank_roles}
+        user_reaction_count = counter
 
-        # (3) Add reactions per user to all roles they have
-        for user_id, count in user_reaction_count.items():
-            member = interaction.guild.get_member(int(user_id))
-            if not member:
-                continue
-
-            for rid in rank_roles:
-                role = interaction.guild.get_role(int(rid))
-                if role and role in member.roles:
-                    role_totals[rid] += count
+        # (2)+(3) Add reactions of each role's members (role index lookup)
+        role_totals = role_index.totals(interaction.guild, rank_roles,
+                                        user_reaction_count)
 
         # (4) Sort roles by total reactions
         sorted_roles = sorted(role_totals.items(),
@@ -916,10 +1139,7 @@ async def reaction_set_roles(interaction: discord.Interaction,
 @app_commands.checks.has_permissions(administrator=True)
 async def reaction_reset(interaction: discord.Interaction):
     guild_id = str(interaction.guild.id)
-    path = reaction_stats_path(guild_id)
-
-    if os.path.exists(path):
-        os.remove(path)
+    reaction_cache.clear(guild_id)
 
     await interaction.response.send_message(
         "🗑 Alle Reaction-Daten wurden gelöscht.", ephemeral=True)
@@ -931,28 +1151,13 @@ async def reaction_reset(interaction: discord.Interaction):
 @app_commands.checks.has_permissions(administrator=True)
 async def reaction_cleanup(interaction: discord.Interaction, days: int = 30):
     guild_id = str(interaction.guild.id)
-    stats = load_reaction_stats(guild_id)
-
     cutoff = datetime.now(timezone.utc) - timedelta(days=days)
 
-    before = len(stats["reactions"])
-
-    def parse_timestamp_aware(ts_str):
-        ts = datetime.fromisoformat(ts_str)
-        if ts.tzinfo is None:
-            ts = ts.replace(tzinfo=timezone.utc)
-        return ts
-
-    stats["reactions"] = [
-        r for r in stats["reactions"]
-        if parse_timestamp_aware(r["timestamp"]) >= cutoff
-    ]
-    after = len(stats["reactions"])
-
-    save_reaction_stats(guild_id, stats)
+    # Appends a prune marker, the log is rewritten by compact_tombstones
+    removed, after = reaction_cache.prune_before(guild_id, cutoff)
 
     await interaction.response.send_message(
-        f"🧹 {before-after} Einträge gelöscht, {after} verbleiben.",
+        f"🧹 {removed} Einträge gelöscht, {after} verbleiben.",
         ephemeral=True)
 
 
@@ -971,7 +1176,8 @@ async def privacy(interaction: discord.Interaction):
         "• Message content\n"
         "• Private messages (DMs)\n"
         "• Attachments\n\n"
-        "Data is automatically cleaned after a configurable retention period (default: 30 days)."
+        "Role pings are automatically cleaned after a configurable retention period (default: 30 days). "
+        "Message and voice activity is kept unless the bot owner configures a retention period for it."
     ),
                                             ephemeral=True)
 
@@ -980,58 +1186,42 @@ async def privacy(interaction: discord.Interaction):
                   description="Shows general server activity (admin only)")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def activity_overview(interaction: discord.Interaction):
+    await interaction.response.defer()
+
     guild_id = str(interaction.guild.id)
     now = datetime.now(timezone.utc)
 
-    # Read the CSV data for messages and role pings
-    message_rows = []
-    role_ping_rows = []
-
-    # Read the message activity log
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            message_rows = [
-                row for row in reader if row["guild_id"] == guild_id
-            ]
-    except FileNotFoundError:
-        pass  # No data yet, that's fine.
-
-    # Read the role ping activity log
-    try:
-        with open("role_pings.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            role_ping_rows = [
-                row for row in reader if row["guild_id"] == guild_id
-            ]
-    except FileNotFoundError:
-        pass  # No data yet, that's fine.
-
-    # Calculate total messages in the last 7 and 30 days
-    def count_messages_in_period(rows, days):
-        cutoff = now - timedelta(days=days)
-        return sum(1 for row in rows if parse_ts(row["timestamp"]) >= cutoff)
-
-    total_messages_7d = count_messages_in_period(message_rows, 7)
-    total_messages_30d = count_messages_in_period(message_rows, 30)
-
-    # Calculate total role pings in the last 7 and 30 days
-    total_role_pings_7d = count_messages_in_period(role_ping_rows, 7)
-    total_role_pings_30d = count_messages_in_period(role_ping_rows, 30)
-
-    # Find the most active channel
-    channel_counter = Counter(row["channel_id"] for row in message_rows)
-    most_active_channel = channel_counter.most_common(1)
-
-    # Find the most active user
-    user_counter = Counter(row["user_id"] for row in message_rows)
-    most_active_user = user_counter.most_common(1)
-
-    # Calculate peak hours (last 7 days)
-    hour_counter = Counter(
-        parse_ts(row["timestamp"]).hour for row in message_rows
-        if parse_ts(row["timestamp"]) >= now - timedelta(days=7))
-    peak_hour = hour_counter.most_common(1)
+    week_ago = now - timedelta(days=7)
+    month_ago = now - timedelta(days=30)
+
+    # Message totals, most active channel and user, peak hour (7 days)
+    messages = await run_query(
+        Query("messages", guild_id, [
+            Count("7d", since=week_ago),
+            Count("30d", since=month_ago),
+            Top("channels", "channel_id", 1),
+            Top("users", "user_id", 1),
+            Count("hours", "hour", since=week_ago),
+            Distinct("senders_7d", "user_id", since=week_ago),
+            Distinct("senders_30d", "user_id", since=month_ago),
+        ]),
+        "activity_overview")
+
+    # Role pings in the last 7 and 30 days
+    pings = await run_query(
+        Query("pings",
+              guild_id, [Count("7d", since=week_ago),
+                         Count("30d")],
+              start=month_ago),
+        "activity_overview")
+
+    total_messages_7d = messages["7d"]
+    total_messages_30d = messages["30d"]
+    total_role_pings_7d = pings["7d"]
+    total_role_pings_30d = pings["30d"]
+    most_active_channel = messages["channels"]
+    most_active_user = messages["users"]
+    peak_hour = messages["hours"].most_common(1)
 
     # Prepare the embed response
     embed = discord.Embed(title="📊 Server Activity Overview",
@@ -1042,6 +1232,12 @@ async def activity_overview(interaction: discord.Interaction):
         value=
         f"Last 7 days: **{total_messages_7d}**\nLast 30 days: **{total_messages_30d}**",
         inline=False)
+    embed.add_field(
+        name="👥 Active Users",
+        value=
+        f"Last 7 days: **{distinct_users(interaction.guild, ('messages', ), week_ago, messages['senders_7d'])}**\n"
+        f"Last 30 days: **{distinct_users(interaction.guild, ('messages', ), month_ago, messages['senders_30d'])}**",
+        inline=False)
     embed.add_field(
         name="🔔 Total Role Pings",
         value=
@@ -1073,7 +1269,7 @@ async def activity_overview(interaction: discord.Interaction):
             f"**{peak_hour[0][0]}:00** with **{peak_hour[0][1]}** messages",
             inline=False)
 
-    await interaction.response.send_message(embed=embed)
+    await interaction.followup.send(embed=embed)
 
 
 @bot.tree.command(name="activity_hours",
@@ -1087,30 +1283,11 @@ async def activity_hours(interaction: discord.Interaction, days: int = 7):
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    rows = []
-
-    # Read CSV safely
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") == guild_id:
-                    rows.append(row)
-    except FileNotFoundError:
-        pass
-
-    if not rows:
-        await interaction.followup.send("ℹ No activity data available.",
-                                        ephemeral=True)
-        return
-
     # Count per hour
-    hour_counter = Counter()
-
-    for row in rows:
-        ts = parse_ts(row["timestamp"])
-        if ts >= cutoff:
-            hour_counter[ts.hour] += 1
+    hour_counter = (await run_query(
+        Query("messages", guild_id, [Count("hours", "hour")],
+              start=cutoff),
+        "activity_hours", days))["hours"]
 
     if not hour_counter:
         await interaction.followup.send(
@@ -1148,39 +1325,20 @@ async def activity_channels(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    rows = []
-
-    # Read CSV
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") == guild_id:
-                    rows.append(row)
-    except FileNotFoundError:
-        pass
-
-    if not rows:
-        await interaction.followup.send("ℹ No activity data available.",
-                                        ephemeral=True)
-        return
-
-    # Count messages per channel
-    channel_counter = Counter()
+    # Channels with the most messages
+    top_channels = (await run_query(
+        Query("messages", guild_id, [Top("channels", "channel_id", limit)],
+              start=cutoff),
+        "activity_channels", days, limit))["channels"]
 
-    for row in rows:
-        ts = parse_ts(row["timestamp"])
-        if ts >= cutoff:
-            channel_counter[row["channel_id"]] += 1
-
-    if not channel_counter:
+    if not top_channels:
         await interaction.followup.send(
             f"ℹ No activity in the last {days} days.", ephemeral=True)
         return
 
     # Build output
     lines = []
-    for channel_id, count in channel_counter.most_common(limit):
+    for channel_id, count in top_channels:
         channel = interaction.guild.get_channel(int(channel_id))
         name = f"#{channel.name}" if channel else "*deleted-channel*"
         lines.append(f"{name:<25} — **{count}** messages")
@@ -1205,23 +1363,15 @@ async def activity_channel_heatmap(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    rows: list[dict] = []
-
     # -----------------------------
-    # Read CSV
+    # Count messages per channel and hour
     # -----------------------------
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") == guild_id:
-                    rows.append(row)
-    except FileNotFoundError:
-        await interaction.followup.send("ℹ No activity data available.",
-                                        ephemeral=True)
-        return
+    counts = (await run_query(
+        Query("messages", guild_id, [Count("cells", ("channel_id", "hour"))],
+              start=cutoff),
+        "activity_channel_heatmap", days))["cells"]
 
-    if not rows:
+    if not counts:
         await interaction.followup.send("ℹ No activity data available.",
                                         ephemeral=True)
         return
@@ -1234,23 +1384,9 @@ async def activity_channel_heatmap(interaction: discord.Interaction,
         for channel in interaction.guild.text_channels
     }
 
-    # -----------------------------
-    # Count messages
-    # -----------------------------
-    for row in rows:
-        try:
-            ts = parse_ts(row["timestamp"])  # MUST return UTC-aware datetime
-        except Exception:
-            continue
-
-        if ts < cutoff:
-            continue
-
-        channel_id = row.get("channel_id")
-        if channel_id not in channel_activity:
-            continue
-
-        channel_activity[channel_id][ts.hour] += 1
+    for (channel_id, hour), count in counts.items():
+        if channel_id in channel_activity:
+            channel_activity[channel_id][hour] += count
 
     # -----------------------------
     # Rank channels by activity
@@ -1335,31 +1471,17 @@ async def activity_user(interaction: discord.Interaction, days: int = 7):
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    user_counter = Counter()
-
-    # Read CSV
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                if ts >= cutoff:
-                    user_counter[row["user_id"]] += 1
-
-    except FileNotFoundError:
-        pass
+    # Top 15 users (safe for embeds)
+    top_users = (await run_query(
+        Query("messages", guild_id, [Top("users", "user_id", 15)],
+              start=cutoff),
+        "activity_user", days))["users"]
 
-    if not user_counter:
+    if not top_users:
         await interaction.followup.send("ℹ No activity data available.",
                                         ephemeral=True)
         return
 
-    # Top 15 users (safe for embeds)
-    top_users = user_counter.most_common(15)
-
     lines = []
     for user_id, count in top_users:
         member = interaction.guild.get_member(int(user_id))
@@ -1387,23 +1509,11 @@ async def activity_user_distribution(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    user_counter = Counter()
-    total_messages = 0
-
-    # Read CSV
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                if ts >= cutoff:
-                    user_counter[row["user_id"]] += 1
-                    total_messages += 1
-    except FileNotFoundError:
-        pass
+    user_counter = (await run_query(
+        Query("messages", guild_id, [Count("users", "user_id")],
+              start=cutoff),
+        "activity_user_distribution", days))["users"]
+    total_messages = sum(user_counter.values())
 
     if not user_counter:
         await interaction.followup.send("ℹ No activity data available.",
@@ -1467,24 +1577,16 @@ async def activity_user_role(interaction: discord.Interaction,
             ephemeral=True)
         return
 
-    user_counter = Counter()
-
-    # Read CSV
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                if row["user_id"] not in role_member_ids:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                if ts >= cutoff:
-                    user_counter[row["user_id"]] += 1
-    except FileNotFoundError:
-        pass
+    # Count messages per user, then keep the role members
+    message_counts = (await run_query(
+        Query("messages", guild_id, [Count("users", "user_id")],
+              start=cutoff),
+        "activity_user_role", days))["users"]
+    user_counter = Counter({
+        user_id: count
+        for user_id, count in message_counts.items()
+        if user_id in role_member_ids
+    })
 
     if not user_counter:
         await interaction.followup.send(
@@ -1519,50 +1621,20 @@ async def activity_inactive(interaction: discord.Interaction, days: int = 30):
     await interaction.response.defer(ephemeral=True)
 
     guild = interaction.guild
-    guild_id = str(guild.id)
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    # Track last activity per user
-    last_seen: dict[str, datetime] = {}
-
-    # Read CSV
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                user_id = row["user_id"]
-
-                if user_id not in last_seen or ts > last_seen[user_id]:
-                    last_seen[user_id] = ts
-    except FileNotFoundError:
-        pass
-
-    inactive_users = []
-
-    for member in guild.members:
-        if member.bot:
-            continue
-
-        uid = str(member.id)
-        last = last_seen.get(uid)
-
-        if last is None or last < cutoff:
-            inactive_users.append((member, last))
+    # Last activity from the index, never seen / longest inactive first
+    members = {str(m.id): m for m in guild.members if not m.bot}
+    inactive_users = [(members[user_id], last)
+                      for user_id, last in await asyncio.to_thread(
+                          last_seen.inactive, guild.id, members, cutoff)]
 
     if not inactive_users:
         await interaction.followup.send("ℹ No inactive users found.",
                                         ephemeral=True)
         return
 
-    # Sort by longest inactivity first
-    inactive_users.sort(
-        key=lambda x: x[1] or datetime.min.replace(tzinfo=timezone.utc))
-
     lines = []
     for member, last in inactive_users[:15]:
         if last:
@@ -1597,36 +1669,15 @@ async def activity_user_ping_ratio(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    message_counter = Counter()
-    ping_counter = Counter()
-
-    # Read message activity
-    try:
-        with open("activity_messages.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                if ts >= cutoff:
-                    message_counter[row["user_id"]] += 1
-    except FileNotFoundError:
-        pass
-
-    # Read role ping activity
-    try:
-        with open("role_pings.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                if row.get("guild_id") != guild_id:
-                    continue
-
-                ts = parse_ts(row["timestamp"])
-                if ts >= cutoff:
-                    ping_counter[row["user_id"]] += 1
-    except FileNotFoundError:
-        pass
+    # Count message and role ping activity per user
+    message_counter = (await run_query(
+        Query("messages", guild_id, [Count("users", "user_id")],
+              start=cutoff),
+        "activity_user_ping_ratio", days))["users"]
+    ping_counter = (await run_query(
+        Query("pings", guild_id, [Count("users", "user_id")],
+              start=cutoff),
+        "activity_user_ping_ratio", days))["users"]
 
     users = set(message_counter) | set(ping_counter)
 
@@ -1689,25 +1740,24 @@ async def activity_vc_overview(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    total_sessions = 0
-    total_seconds = 0
-    users = set()
-
-    try:
-        with open("activity_voice.csv", "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                g_id, user_id, _channel_id, joined_at, _left_at, duration = row
-                if g_id != guild_id:
-                    continue
-
-                joined = parse_ts(joined_at)
-                if joined >= cutoff:
-                    total_sessions += 1
-                    total_seconds += int(duration)
-                    users.add(user_id)
-    except FileNotFoundError:
-        pass
+    # Sessions that started inside the period
+    result = await run_query(
+        Query("voice",
+              guild_id, [
+                  Count("sessions", since=cutoff, since_field="joined_at"),
+                  Sum("seconds",
+                      "duration_seconds",
+                      since=cutoff,
+                      since_field="joined_at"),
+                  Distinct("users",
+                           "user_id",
+                           since=cutoff,
+                           since_field="joined_at"),
+              ],
+              start=cutoff),
+        "activity_vc_overview", days)
+    total_sessions = result["sessions"]
+    total_seconds = result["seconds"]
 
     if total_sessions == 0:
         await interaction.followup.send("ℹ No voice activity recorded.",
@@ -1722,7 +1772,10 @@ async def activity_vc_overview(interaction: discord.Interaction,
 
     embed.add_field(name="Sessions", value=str(total_sessions), inline=True)
 
-    embed.add_field(name="Active users", value=str(len(users)), inline=True)
+    embed.add_field(name="Active users",
+                    value=distinct_users(interaction.guild, ("voice", ),
+                                         cutoff, result["users"]),
+                    inline=True)
 
     embed.add_field(name="Total time",
                     value=f"{hours}h {minutes}m",
@@ -1745,24 +1798,24 @@ async def activity_vc_users(interaction: discord.Interaction, days: int = 7):
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    user_seconds = Counter()
-    user_sessions = Counter()
-
-    try:
-        with open("activity_voice.csv", "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            for row in reader:
-                g_id, user_id, _channel_id, joined_at, _left_at, duration = row
-                if g_id != guild_id:
-                    continue
-
-                joined = parse_ts(joined_at)
-                if joined >= cutoff:
-                    secs = int(duration)
-                    user_seconds[user_id] += secs
-                    user_sessions[user_id] += 1
-    except FileNotFoundError:
-        pass
+    # Sessions that started inside the period, per user
+    result = await run_query(
+        Query("voice",
+              guild_id, [
+                  Sum("seconds",
+                      "duration_seconds",
+                      "user_id",
+                      since=cutoff,
+                      since_field="joined_at"),
+                  Count("sessions",
+                        "user_id",
+                        since=cutoff,
+                        since_field="joined_at"),
+              ],
+              start=cutoff),
+        "activity_vc_users", days)
+    user_seconds = result["seconds"]
+    user_sessions = result["sessions"]
 
     if not user_seconds:
         await interaction.followup.send("ℹ No voice activity recorded.",
@@ -1805,38 +1858,14 @@ async def activity_vc_hours(interaction: discord.Interaction, days: int = 7):
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    hour_seconds = [0] * 24
-
-    try:
-        with open("activity_voice.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-
-            for row in reader:
-                if row["guild_id"] != guild_id:
-                    continue
-
-                joined = parse_ts(row["joined_at"])
-                left = parse_ts(row["left_at"])
-
-                if left < cutoff:
-                    continue
-
-                start = max(joined, cutoff)
-                current = start
-
-                while current < left:
-                    next_hour = (current + timedelta(hours=1)).replace(
-                        minute=0, second=0, microsecond=0)
-                    segment_end = min(next_hour, left)
-                    seconds = int((segment_end - current).total_seconds())
-
-                    hour_seconds[current.hour] += seconds
-                    current = segment_end
-
-    except FileNotFoundError:
-        await interaction.followup.send("ℹ No VC activity data available.",
-                                        ephemeral=True)
-        return
+    # Session time per hour of the day and weekday, clipped to the period
+    result = await run_query(
+        Query("voice", guild_id, [
+            Overlap("hours", "hour"),
+            Overlap("weekdays", "weekday"),
+        ], start=cutoff),
+        "activity_vc_hours", days)
+    hour_seconds = [result["hours"][hour] for hour in range(24)]
 
     if not any(hour_seconds):
         await interaction.followup.send(
@@ -1855,6 +1884,13 @@ async def activity_vc_hours(interaction: discord.Interaction, days: int = 7):
     embed = discord.Embed(title="🎧 Voice Activity by Hour",
                           description="\n".join(lines),
                           color=discord.Color.green())
+    weekdays = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+    embed.add_field(name="By weekday",
+                    value="\n".join(
+                        f"`{name}` {result['weekdays'][day] // 3600}h "
+                        f"{result['weekdays'][day] % 3600 // 60}m"
+                        for day, name in enumerate(weekdays)),
+                    inline=False)
     embed.set_footer(text=f"Last {days} days")
 
     await interaction.followup.send(embed=embed, ephemeral=True)
@@ -1872,36 +1908,11 @@ async def activity_vc_channels(interaction: discord.Interaction,
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=days)
 
-    channel_seconds: dict[str, int] = {}
-
-    try:
-        with open("activity_voice.csv", "r", encoding="utf-8") as f:
-            reader = csv.DictReader(f)
-
-            for row in reader:
-                if row["guild_id"] != guild_id:
-                    continue
-
-                joined = parse_ts(row["joined_at"])
-                left = parse_ts(row["left_at"])
-
-                if left < cutoff:
-                    continue
-
-                start = max(joined, cutoff)
-                seconds = int((left - start).total_seconds())
-
-                if seconds <= 0:
-                    continue
-
-                channel_id = row["channel_id"]
-                channel_seconds[channel_id] = (
-                    channel_seconds.get(channel_id, 0) + seconds)
-
-    except FileNotFoundError:
-        await interaction.followup.send("ℹ No VC activity data available.",
-                                        ephemeral=True)
-        return
+    # Session time per channel, clipped to the period
+    channel_seconds = (await run_query(
+        Query("voice", guild_id, [Overlap("channels", "channel_id")],
+              start=cutoff),
+        "activity_vc_channels", days))["channels"]
 
     if not channel_seconds:
         await interaction.followup.send(
@@ -1932,8 +1943,138 @@ async def activity_vc_channels(interaction: discord.Interaction,
     await interaction.followup.send(embed=embed, ephemeral=True)
 
 
+async def voice_concurrency(guild_id: str, days: list) -> dict:
+    """
+    Voice concurrency profiles of a guild for the given UTC days.
+
+    Days missing from vc_peak_days are computed with one sweep over the
+    sessions; they are kept once they ended before the guild's oldest
+    open session, since only open sessions can still add to a day.
+
+    Returns:
+        Dictionary: {day: {"all": hours, "channels": {channel_id: hours}}}
+        with hours a list of (peak, seconds) per UTC hour
+    """
+    missing = [day for day in days if (guild_id, day) not in vc_peak_days]
+    profiles = {}
+    if missing:
+        now = datetime.now(timezone.utc)
+        start = day_start(min(missing))
+        result = await run_query(
+            Query("voice", guild_id, [
+                Concurrency("all", start, now),
+                Concurrency("channels", start, now, "channel_id"),
+            ], start=start))
+        settled = min(voice_journal.oldest_open(guild_id) or now, now)
+        empty = [(0, 0)] * 24
+        for day in missing:
+            profile = {
+                "all": result["all"].get(None, {}).get(day, empty),
+                "channels": {
+                    channel_id: by_day[day]
+                    for channel_id, by_day in result["channels"].items()
+                    if any(seconds for _, seconds in by_day.get(day, []))
+                }
+            }
+            profiles[day] = profile
+            if day_start(day) + timedelta(days=1) <= settled:
+                vc_peak_days[(guild_id, day)] = profile
+
+    return {
+        day: profiles.get(day) or vc_peak_days[(guild_id, day)]
+        for day in days
+    }
+
+
+@bot.tree.command(
+    name="activity_vc_peak",
+    description="Show peak concurrent voice users (admin only)")
+@app_commands.describe(days="How many days to analyze (default: 7)")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def activity_vc_peak(interaction: discord.Interaction, days: int = 7):
+    await interaction.response.defer(ephemeral=True)
+
+    guild_id = str(interaction.guild.id)
+    now = datetime.now(timezone.utc)
+    today = now.date()
+    window = [today - timedelta(days=i) for i in range(days - 1, -1, -1)]
+    profiles = await voice_concurrency(guild_id, window)
+
+    # Peak and seconds per hour of the day, and per channel
+    hour_peaks = [0] * 24
+    hour_seconds = [0] * 24
+    peak, peak_at = 0, None
+    channel_peaks: Counter = Counter()
+    channel_seconds: Counter = Counter()
+    for day, profile in profiles.items():
+        for hour, (hour_peak, seconds) in enumerate(profile["all"]):
+            hour_peaks[hour] = max(hour_peaks[hour], hour_peak)
+            hour_seconds[hour] += seconds
+            if hour_peak > peak:
+                peak, peak_at = hour_peak, day_start(day) + timedelta(
+                    hours=hour)
+        for channel_id, hours in profile["channels"].items():
+            channel_peaks[channel_id] = max(channel_peaks[channel_id],
+                                            max(p for p, _ in hours))
+            channel_seconds[channel_id] += sum(s for _, s in hours)
+
+    if peak == 0:
+        await interaction.followup.send(
+            "ℹ No VC activity found in this period.", ephemeral=True)
+        return
+
+    # Averages over the time elapsed, today only counts up to now
+    elapsed = (now - day_start(window[0])).total_seconds()
+    hour_elapsed = [
+        sum(1 for day in window if day_start(day) + timedelta(hours=hour) < now)
+        * 3600 for hour in range(24)
+    ]
+
+    lines = []
+    for hour in range(24):
+        average = (hour_seconds[hour] / hour_elapsed[hour]
+                   if hour_elapsed[hour] else 0)
+        lines.append(f"`{hour:02d}:00` peak **{hour_peaks[hour]}** · "
+                     f"avg {average:.1f}")
+
+    embed = discord.Embed(title="📈 Concurrent Voice Users",
+                          description="\n".join(lines),
+                          color=discord.Color.green())
+    embed.add_field(
+        name="Peak",
+        value=(f"**{peak}** users at {peak_at:%Y-%m-%d %H}:00 UTC\n"
+               f"Average: **{sum(hour_seconds) / elapsed:.1f}** users"),
+        inline=False)
+
+    channel_lines = []
+    for channel_id, channel_peak in channel_peaks.most_common(10):
+        channel = interaction.guild.get_channel(int(channel_id))
+        name = channel.name if channel else f"Unknown ({channel_id})"
+        channel_lines.append(
+            f"**{name}** — peak {channel_peak}, "
+            f"avg {channel_seconds[channel_id] / elapsed:.1f}")
+    embed.add_field(name="By channel",
+                    value="\n".join(channel_lines),
+                    inline=False)
+    embed.set_footer(text=f"Last {days} days (UTC) • hours in UTC")
+
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+
 # ========== Run the Bot ==========
 
 if __name__ == "__main__":
+    # Read here so tests and offline tools can import this module without it
+    TOKEN = os.environ['PING_COUNT_TOKEN']
     ensure_csv_exists()
-    bot.run(TOKEN)
+    try:
+        bot.run(TOKEN)
+    finally:
+        # Drain rows that were still buffered when the bot stopped
+        storage.flush()
+        reaction_cache.flush()
+        spoiler_messages.flush()
+        message_rollup.flush()
+        user_sketches.flush()
+        last_seen.checkpoint()
+        analytics_pool.shutdown()
@@ -1,11 +1,37 @@
-
 import pytest
 import os
 import sys
+from datetime import timedelta
 
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from utils.hyperloglog import DailySketches
+from utils.last_seen import LastSeenIndex
+from utils.rollups import HourlyRollup
+from utils.spoiler_registry import SpoilerRegistry
+from utils.storage import open_storage
+from utils.voice_journal import VoiceJournal
+
+
+def fresh_bot_state(main, monkeypatch):
+    """Replace the bot's stores, which resolve their paths when created"""
+    monkeypatch.setattr(main, "storage", open_storage(main.STORAGE_BACKEND))
+    monkeypatch.setattr(main, "message_rollup",
+                        HourlyRollup(main.MESSAGE_ROLLUP_DIR, main.TOP_CAPACITY))
+    monkeypatch.setattr(main, "user_sketches",
+                        DailySketches(main.USER_SKETCH_DIR, main.SKETCH_PRECISION,
+                                      rebuild=main.user_sketches.rebuild))
+    monkeypatch.setattr(main, "last_seen",
+                        LastSeenIndex(main.LAST_SEEN_DIR,
+                                      rebuild=main.last_seen.rebuild))
+    monkeypatch.setattr(main, "voice_journal",
+                        VoiceJournal(main.VOICE_JOURNAL_PATH))
+    monkeypatch.setattr(main, "spoiler_messages",
+                        SpoilerRegistry(main.SPOILER_REGISTRY_PATH,
+                                        main.SPOILER_MAX_MESSAGES,
+                                        timedelta(days=main.SPOILER_MAX_AGE_DAYS)))
+
 
 @pytest.fixture(autouse=True)
 def setup_test_environment(tmp_path, monkeypatch):
@@ -16,6 +42,10 @@ def setup_test_environment(tmp_path, monkeypatch):
     # Create necessary directories
     os.makedirs("data/reactions/stats", exist_ok=True)
     os.makedirs("data/reactions/configs", exist_ok=True)
+
+    # main was imported in another directory, e.g. while collecting tests
+    if "main" in sys.modules:
+        fresh_bot_state(sys.modules["main"], monkeypatch)
     
     yield
     
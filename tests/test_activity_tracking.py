@@ -68,3 +68,62 @@ def test_append_message_activity(monkeypatch, tmp_path):
         rows = list(reader)
         assert len(rows) == 1
         assert rows[0]["guild_id"] == guild_id
+
+
+@pytest.mark.asyncio
+async def test_activity_commands_answer_from_queries(tmp_path, monkeypatch):
+    """The activity commands await their queries and send an embed"""
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+    import main
+    from utils.storage import CsvBackend
+
+    monkeypatch.setattr(main, "storage", CsvBackend(str(tmp_path / "data_store")))
+    main.analytics_cache.clear()
+    append_message_activity("42", "7", "9")
+
+    channel = SimpleNamespace(name="general")
+    member = SimpleNamespace(id=7, bot=False, display_name="Seven")
+    idle = SimpleNamespace(id=8, bot=False, display_name="Eight")
+    interaction = SimpleNamespace(
+        guild=SimpleNamespace(id=42, members=[member, idle], member_count=2,
+                              get_channel=lambda _id: channel,
+                              get_member=lambda _id: member),
+        response=SimpleNamespace(defer=AsyncMock()),
+        followup=SimpleNamespace(send=AsyncMock()))
+
+    for command in (main.activity_hours, main.activity_channels,
+                    main.activity_user, main.activity_inactive,
+                    main.activity_overview):
+        interaction.followup.send.reset_mock()
+        await command.callback(interaction)
+        assert "embed" in interaction.followup.send.call_args.kwargs
+
+
+@pytest.mark.asyncio
+async def test_vc_peak_caches_settled_days(tmp_path, monkeypatch):
+    """Peak concurrency comes from one sweep, finished days are kept"""
+    from types import SimpleNamespace
+    from unittest.mock import AsyncMock
+    import main
+    from utils.storage import CsvBackend
+
+    monkeypatch.setattr(main, "storage", CsvBackend(str(tmp_path / "data_store")))
+    monkeypatch.setattr(main, "vc_peak_days", {})
+    main.analytics_cache.clear()
+    yesterday = datetime.now(timezone.utc).replace(
+        hour=10, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    for user, minutes in (("1", 60), ("2", 30), ("3", 90)):
+        main.end_voice_session("43", user, "5", yesterday,
+                               yesterday + timedelta(minutes=minutes))
+
+    interaction = SimpleNamespace(
+        guild=SimpleNamespace(id=43, get_channel=lambda _id: None),
+        response=SimpleNamespace(defer=AsyncMock()),
+        followup=SimpleNamespace(send=AsyncMock()))
+    await main.activity_vc_peak.callback(interaction, days=2)
+
+    embed = interaction.followup.send.call_args.kwargs["embed"]
+    assert "**3** users at" in embed.fields[0].value
+    assert ("43", yesterday.date()) in main.vc_peak_days
+    assert ("43", yesterday.date() + timedelta(days=1)) not in main.vc_peak_days
@@ -24,25 +24,43 @@ from main import (
 
 @pytest.fixture
 def test_csv_path(tmp_path):
-    """Create a temporary CSV file for testing"""
-    test_file = tmp_path / "test_role_pings.csv"
-    # Patch the CSV_PATH in main module
+    """Create a temporary CSV storage backend for testing"""
+    # Patch the storage backend in main module
     import main
-    original_path = main.CSV_PATH
-    main.CSV_PATH = str(test_file)
-    yield str(test_file)
-    main.CSV_PATH = original_path
+    from utils.storage import CsvBackend
+    original_storage = main.storage
+    main.storage = CsvBackend(str(tmp_path / "test_data"))
+    yield main.storage.segments["pings"].directory
+    main.storage = original_storage
 
 
 def test_ensure_csv_exists(test_csv_path):
-    """Test CSV file creation"""
+    """Test segment directory creation"""
     ensure_csv_exists()
-    assert os.path.exists(test_csv_path)
+    assert os.path.isdir(test_csv_path)
+
+
+def test_ensure_csv_exists_imports_legacy_file(test_csv_path):
+    """Test that a single-file CSV is split into guild shards and day segments"""
+    import main
+    with open(main.CSV_PATH, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(["guild_id", "role_id", "user_id", "channel_id", "timestamp"])
+        writer.writerow(["1", "2", "3", "4", "2026-01-01T10:00:00+00:00"])
+        writer.writerow(["1", "2", "3", "4", "2026-01-02T10:00:00"])
+
+    ensure_csv_exists()
+
+    assert not os.path.exists(main.CSV_PATH)
+    assert os.listdir(test_csv_path) == ["1"]
+    assert sorted(os.listdir(os.path.join(test_csv_path, "1"))) == [
+        "2026-01-01.csv", "2026-01-01.idx", "2026-01-02.csv", "2026-01-02.idx"]
     
-    with open(test_csv_path, 'r', encoding='utf-8') as f:
+    with open(os.path.join(test_csv_path, "1", "2026-01-01.csv"), 'r', encoding='utf-8') as f:
         reader = csv.reader(f)
         headers = next(reader)
         assert headers == ["guild_id", "role_id", "user_id", "channel_id", "timestamp"]
+    assert len(read_all_pings()) == 2
 
 
 def test_append_ping(test_csv_path):
@@ -158,6 +176,24 @@ def test_reset_user_counts(test_csv_path):
     assert rows[0]["user_id"] == "user2"
 
 
+def test_reset_is_compacted_into_segments(test_csv_path):
+    """Test that tombstones are folded into the segment files"""
+    import main
+    ensure_csv_exists()
+    
+    append_ping("1000", "role1", "user1", "channel1")
+    append_ping("1000", "role2", "user1", "channel1")
+    reset_role_counts("1000", "role1")
+    
+    assert os.path.exists(os.path.join(test_csv_path, "tombstones.csv"))
+    
+    assert main.compact_storage() == 1
+    
+    assert not os.path.exists(os.path.join(test_csv_path, "tombstones.csv"))
+    rows = read_all_pings()
+    assert [r["role_id"] for r in rows] == ["role2"]
+
+
 def test_cleanup_old_entries(test_csv_path):
     """Test cleanup of old entries"""
     ensure_csv_exists()
@@ -167,14 +203,18 @@ def test_cleanup_old_entries(test_csv_path):
     # Add a recent entry
     append_ping(guild_id, "role1", "user1", "channel1")
     
-    # Add an old entry manually
-    old_timestamp = (datetime.now(timezone.utc) - timedelta(days=40)).isoformat()
-    with open(test_csv_path, 'a', newline='', encoding='utf-8') as f:
+    # Add an old entry manually into its day segment
+    old_ts = datetime.now(timezone.utc) - timedelta(days=40)
+    old_segment = os.path.join(test_csv_path, guild_id, f"{old_ts.date().isoformat()}.csv")
+    with open(old_segment, 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        writer.writerow([guild_id, "role2", "user2", "channel2", old_timestamp])
+        writer.writerow(["guild_id", "role_id", "user_id", "channel_id", "timestamp"])
+        writer.writerow([guild_id, "role2", "user2", "channel2", old_ts.isoformat()])
     
     cleanup_old_entries(days=30)
     
+    assert not os.path.exists(old_segment)
+    
     rows = read_all_pings()
     assert len(rows) == 1
     assert rows[0]["role_id"] == "role1"
@@ -0,0 +1,57 @@
+import pytest
+import os
+import sys
+import random
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.heavy_hitters import SpaceSaving
+
+
+def skewed(n, seed):
+    rng = random.Random(seed)
+    return [str(int(rng.paretovariate(1.2))) for _ in range(n)]
+
+
+def test_exact_below_capacity():
+    summary = SpaceSaving(10)
+    for key in "abcabca":
+        summary.add(key)
+    assert dict(summary.most_common()) == {"a": 3, "b": 2, "c": 2}
+    assert summary.error("a") == 0
+    assert summary.floor() == 0
+
+
+def test_heavy_hitters_and_bounds():
+    """Counts are upper bounds within `error`, heavy keys are kept"""
+    stream = skewed(20_000, 1)
+    exact = Counter(stream)
+    summary = SpaceSaving(32)
+    for key in stream:
+        summary.add(key)
+
+    assert len(summary) == 32
+    assert summary.total == len(stream)
+    for key, count in summary.most_common():
+        assert exact[key] <= count <= exact[key] + summary.error(key)
+    assert [k for k, _ in summary.most_common(5)] == \
+        [k for k, _ in exact.most_common(5)]
+
+
+def test_merge():
+    stream = skewed(20_000, 2)
+    a, b = SpaceSaving(32), SpaceSaving(32)
+    for i, key in enumerate(stream):
+        (a if i % 3 else b).add(key)
+    a.update(b)
+
+    exact = Counter(stream)
+    assert a.total == len(stream)
+    assert len(a) == 32
+    for key, count in a.most_common():
+        assert exact[key] <= count <= exact[key] + a.error(key)
+    assert a.most_common(3) == exact.most_common(3)
+
+    with pytest.raises(ValueError):
+        SpaceSaving(0)
@@ -0,0 +1,82 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.hyperloglog import DailySketches, HyperLogLog
+
+T0 = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("n", [50, 20_000])
+def test_estimate_within_error(n):
+    sketch = HyperLogLog(11)
+    for i in range(n):
+        sketch.add(str(i))
+        sketch.add(str(i))  # Duplicates do not count
+    assert abs(sketch.count() - n) <= 3 * sketch.error * n + 2
+
+
+def test_merge_equals_union():
+    a, b, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(3000):
+        (a if i % 2 else b).add(i)
+        union.add(i)
+    a.update(b)
+    assert bytes(a) == bytes(union)
+
+    with pytest.raises(ValueError):
+        a.update(HyperLogLog(10))
+
+
+def test_daily_sketches_persist_and_expire(tmp_path):
+    directory = str(tmp_path / "sketches")
+    sketches = DailySketches(directory)
+    for day in range(5):
+        for user in range(100):
+            sketches.add("1", "messages", user + day * 10, T0 + timedelta(days=day))
+    sketches.add("1", "voice", "999", T0)
+
+    assert sketches.flush() == 6
+    assert os.path.exists(os.path.join(directory, "1", "messages.2026-03-01.hll"))
+
+    def rebuild(guild_id):
+        raise AssertionError("guild is on disk")
+
+    reloaded = DailySketches(directory, rebuild=rebuild)
+    everything = reloaded.estimate("1", ("messages", ), T0, T0 + timedelta(days=4))
+    assert abs(everything - 140) <= 5
+    assert abs(reloaded.estimate("1", ("messages", "voice"), T0, T0) - 101) <= 3
+
+    assert reloaded.drop_before(T0 + timedelta(days=3)) == 4
+    assert abs(reloaded.estimate("1", ("messages", ), T0, T0 + timedelta(days=4)) - 110) <= 4
+    assert sorted(os.listdir(os.path.join(directory, "1"))) == [
+        "messages.2026-03-04.hll", "messages.2026-03-05.hll"]
+
+
+def test_daily_sketches_rebuild(tmp_path):
+    rows = [("pings", str(u), T0) for u in range(30)]
+    sketches = DailySketches(str(tmp_path / "sketches"), rebuild=lambda g: iter(rows))
+    assert sketches.estimate("7", ("pings", ), T0) == 30
+
+    with pytest.raises(ValueError):
+        sketches.add("../7", "pings", "1", T0)
+
+
+def test_add_leaves_rebuild_to_warm(tmp_path):
+    calls = []
+
+    def rebuild(guild_id):
+        calls.append(guild_id)
+        return iter([("pings", str(u), T0) for u in range(30)])
+
+    sketches = DailySketches(str(tmp_path / "sketches"), rebuild=rebuild)
+    sketches.add("7", "pings", "new", T0)
+    assert calls == []
+
+    assert sketches.warm("7")
+    assert not sketches.warm("7")
+    assert calls == ["7"]
+    assert sketches.estimate("7", ("pings", ), T0) == 31
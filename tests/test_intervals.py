@@ -0,0 +1,73 @@
+import pytest
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import intervals
+from utils.intervals import DAY, hour_seconds, weekday_seconds
+
+# 2026-03-02 00:00 UTC, a Monday
+MONDAY = 1772409600
+
+
+def brute_force(starts, ends, bin_of):
+    totals = {}
+    for start, end in zip(starts, ends):
+        t = start
+        while t < end:
+            # Step to the next minute boundary at most
+            step = min(end, (t // 60 + 1) * 60)
+            totals[bin_of(t)] = totals.get(bin_of(t), 0) + step - t
+            t = step
+    return totals
+
+
+def sessions(seed):
+    rng = random.Random(seed)
+    starts = [MONDAY + rng.randrange(14 * DAY) for _ in range(40)]
+    ends = [s + rng.choice([1, 59, 3601, rng.randrange(3 * DAY)])
+            for s in starts]
+    return starts, ends
+
+
+@pytest.mark.parametrize("numpy", [True, False])
+def test_matches_brute_force(monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(intervals, "np", None)
+    elif intervals.np is None:
+        pytest.skip("numpy not installed")
+
+    starts, ends = sessions(1)
+    hours = brute_force(starts, ends, lambda t: t % DAY // 3600)
+    assert hour_seconds(starts, ends) == [hours.get(h, 0) for h in range(24)]
+
+    days = brute_force(starts, ends, lambda t: (t - MONDAY) % (7 * DAY) // DAY)
+    assert weekday_seconds(starts, ends) == [days.get(d, 0) for d in range(7)]
+
+
+def test_long_session_is_uniform():
+    week = weekday_seconds([MONDAY + 600], [MONDAY + 600 + 14 * DAY])
+    assert week == [2 * DAY] * 7
+    assert hour_seconds([], []) == [0] * 24
+
+
+def test_concurrency_sweep():
+    starts, ends = sessions(2)
+    start, end = MONDAY + DAY, MONDAY + 2 * DAY
+    bins = intervals.concurrency(starts, ends, start, end)
+    assert len(bins) == 24
+    assert max(peak for peak, _ in bins) > 1
+
+    for b, (peak, seconds) in enumerate(bins):
+        lo, hi = start + b * 3600, start + (b + 1) * 3600
+        open_at = [sum(s <= t < e for s, e in zip(starts, ends))
+                   for t in range(lo, hi, 1)]
+        assert peak == max(open_at)
+        assert seconds == sum(open_at)
+
+
+def test_back_to_back_sessions_do_not_overlap():
+    bins = intervals.concurrency([0, 600], [600, 1200], 0, 3600)
+    assert bins == [(1, 1200)]
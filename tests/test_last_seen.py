@@ -0,0 +1,60 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.last_seen import LastSeenIndex
+
+T0 = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_touch_keeps_latest_and_checkpoints(tmp_path):
+    directory = str(tmp_path / "last_seen")
+    index = LastSeenIndex(directory)
+    index.touch("1", "7", T0)
+    index.touch("1", "7", T0 - timedelta(days=3))  # Older, ignored
+    index.touch(1, 8, T0 - timedelta(days=40))
+    index.touch("2", "7", T0 - timedelta(days=40))
+
+    assert index.get("1", 7) == T0
+    assert index.checkpoint() == 2
+    assert index.checkpoint() == 0
+
+    def rebuild(guild_id):
+        raise AssertionError("guild is on disk")
+
+    reloaded = LastSeenIndex(directory, rebuild=rebuild)
+    assert reloaded.get(1, 8) == T0 - timedelta(days=40)
+    assert reloaded.inactive("1", ["7", "8", "9"], T0 - timedelta(days=30)) == [
+        ("9", None), ("8", T0 - timedelta(days=40))]
+
+
+def test_rebuild_missing_guild(tmp_path):
+    history = [("7", T0 - timedelta(days=2)), ("7", T0), ("8", T0)]
+    index = LastSeenIndex(str(tmp_path / "last_seen"),
+                          rebuild=lambda g: iter(history))
+    assert index.get("5", "7") == T0
+    assert index.checkpoint() == 1
+
+    with pytest.raises(ValueError):
+        index.touch("../5", "7", T0)
+
+
+def test_touch_leaves_rebuild_to_warm(tmp_path):
+    calls = []
+
+    def rebuild(guild_id):
+        calls.append(guild_id)
+        return iter([("7", T0 - timedelta(days=2)), ("8", T0)])
+
+    index = LastSeenIndex(str(tmp_path / "last_seen"), rebuild=rebuild)
+    index.touch("5", "7", T0 - timedelta(days=1))
+    assert calls == []
+
+    assert index.warm("5")
+    assert not index.warm("5")
+    assert calls == ["5"]
+    assert index.get("5", "7") == T0 - timedelta(days=1)
+    assert index.get("5", "8") == T0
@@ -0,0 +1,53 @@
+import os
+import io
+import csv
+import json
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.migrate import main
+from utils.reaction_log import iter_json_array
+from utils.storage import SqliteBackend
+
+
+def test_iter_json_array_streams_small_chunks():
+    """Items are decoded even when they span chunk boundaries"""
+    entries = [{"user_id": str(i), "emoji": "🔥"} for i in range(50)]
+    text = json.dumps({"reactions": entries}, indent=4)
+
+    assert list(iter_json_array(io.StringIO(text), "reactions", chunk_size=7)) == entries
+    assert list(iter_json_array(io.StringIO('{"reactions": []}'), "reactions")) == []
+
+
+def test_migrate_legacy_csv_to_sqlite():
+    """Legacy rows are normalised, verified and the source is marked"""
+    with open("role_pings.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["guild_id", "role_id", "user_id", "channel_id", "timestamp"])
+        writer.writerow(["1", "2", "3", "4", "2026-01-01T10:00:00"])
+        writer.writerow(["1", "2", "3", "4", "not a timestamp"])
+
+    assert main(["migrate", "--to", "sqlite", "--target", "out.sqlite3",
+                 "--datasets", "pings"]) == 0
+
+    assert os.path.exists("role_pings.csv.migrated")
+    storage = SqliteBackend("out.sqlite3")
+    rows = list(storage.iter_rows("pings"))
+    storage.close()
+    assert [r["timestamp"] for r in rows] == ["2026-01-01T10:00:00+00:00"]
+
+
+def test_migrate_reactions_to_jsonl():
+    """Reaction stats JSON is converted to one entry per line"""
+    entries = [{"message_id": "1", "user_id": str(i), "emoji": "x",
+                "timestamp": "2025-11-20T12:31:56+00:00"} for i in range(3)]
+    with open("data/reactions/stats/1.json", "w", encoding="utf-8") as f:
+        json.dump({"reactions": entries}, f, indent=4)
+
+    assert main(["migrate", "--to", "csv", "--target", "out",
+                 "--datasets", "reactions"]) == 0
+
+    with open("data/reactions/stats/1.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == entries
+    assert os.path.exists("data/reactions/stats/1.json.migrated")
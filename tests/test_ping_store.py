@@ -0,0 +1,72 @@
+import os
+import csv
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ping_store import PingStore, to_epoch_us, from_epoch_us
+
+
+def test_epoch_roundtrip():
+    """Timestamps survive the conversion to epoch microseconds"""
+    ts = datetime(2026, 2, 2, 15, 14, 26, 716692, tzinfo=timezone.utc)
+    assert from_epoch_us(to_epoch_us(ts)) == ts
+
+    naive = datetime(2026, 2, 2, 15, 14, 26)
+    assert from_epoch_us(to_epoch_us(naive)) == naive.replace(
+        tzinfo=timezone.utc)
+
+
+def test_id_encoding():
+    """Snowflakes are stored as integers, other IDs are interned"""
+    store = PingStore()
+    assert store.encode_id(1399126688943570974) == 1399126688943570974
+    code = store.encode_id("user1")
+    assert code < 0
+    assert store.decode_id(code) == "user1"
+    assert store.lookup_id("unknown") is None
+
+
+def test_load_and_query(tmp_path):
+    """Store answers role and user queries from a loaded CSV"""
+    path = tmp_path / "role_pings.csv"
+    now = datetime.now(timezone.utc).isoformat()
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["guild_id", "role_id", "user_id", "channel_id", "timestamp"])
+        writer.writerow(["1", "10", "100", "5", now])
+        writer.writerow(["1", "10", "100", "5", now])
+        writer.writerow(["1", "10", "200", "5", now])
+        writer.writerow(["1", "20", "100", "5", now])
+        writer.writerow(["2", "10", "100", "5", "not-a-date"])
+
+    store = PingStore()
+    with open(path, "r", encoding="utf-8") as f:
+        store.load(csv.DictReader(f), str(path))
+
+    assert len(store) == 4
+    assert store.top_for_role("1", "10") == [("100", 2), ("200", 1)]
+    assert store.counts_for_user("1", "100") == [("10", 2), ("20", 1)]
+    assert store.top_for_role("2", "10") == []
+    assert store.top_roles("1") == [("10", 3), ("20", 1)]
+
+
+def test_remove_rows():
+    """Role, user and age based removal"""
+    store = PingStore()
+    now = datetime.now(timezone.utc)
+    store.append("1", "10", "100", "5", now)
+    store.append("1", "20", "100", "5", now)
+    store.append("1", "20", "200", "5", now - timedelta(days=40))
+
+    assert store.remove_older_than(now - timedelta(days=30)) == 1
+    assert store.remove_role("1", "10") == 1
+    rows = list(store.rows())
+    assert len(rows) == 1
+    assert rows[0]["role_id"] == "20"
+    assert store.remove_user("1", "100") == 1
+    assert len(store) == 0
+    assert store.top_roles("1") == []
+    assert store.counts_for_user("1", "200") == []
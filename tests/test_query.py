@@ -0,0 +1,110 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.query import (Concurrency, Count, Distinct, Overlap, Query, Sum, Top,
+                         execute)
+from utils.rollups import HourlyRollup
+from utils.storage import LOCATION_ARGS, CsvBackend, open_storage
+
+T0 = datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = CsvBackend(str(tmp_path / "raw"))
+    for i in range(48):
+        storage.append("messages", {
+            "guild_id": "1", "user_id": str(i % 4), "channel_id": str(i % 2),
+            "timestamp": (T0 + timedelta(hours=i)).isoformat()})
+    return storage
+
+
+def test_single_pass_matches_rollup(storage, tmp_path):
+    """Streaming and rollup answers agree on hour-aligned windows"""
+    rollup = HourlyRollup(str(tmp_path / "rollup"))
+    rollup.load(lambda start: storage.iter_rows("messages", start=start))
+    query = Query("messages", "1", [
+        Count("total"),
+        Count("recent", since=T0 + timedelta(days=1)),
+        Count("users", "user_id"),
+        Count("cells", ("channel_id", "hour")),
+        Distinct("channels", "channel_id", since=T0 + timedelta(days=1)),
+        Top("top", "user_id", 4),
+    ], start=T0 + timedelta(hours=6))
+
+    streamed = execute(query, storage)
+    assert streamed["total"] == 42
+    assert streamed["recent"] == 24
+    assert streamed["channels"] == 2
+    from_rollup = execute(query, storage, rollup)
+    assert dict(from_rollup.pop("top")) == dict(streamed.pop("top"))
+    assert from_rollup == streamed
+
+
+@pytest.mark.parametrize("kind", ["sqlite", "binary"])
+def test_counts_pushed_to_backend(storage, tmp_path, kind, monkeypatch):
+    """Counts on the SQLite and binary backends skip decoding rows"""
+    native = open_storage(kind, **{LOCATION_ARGS[kind]: str(tmp_path / kind)})
+    native.rewrite("messages", storage.iter_rows("messages"))
+    query = Query("messages", "1", [
+        Count("total"),
+        Count("recent", since=T0 + timedelta(days=1)),
+        Count("cells", ("channel_id", "hour")),
+        Count("days", "day"),
+        Distinct("users", "user_id"),
+    ], start=T0 + timedelta(hours=6))
+    expected = execute(query, storage)
+
+    def iter_rows(*args):
+        raise AssertionError("rows were decoded")
+
+    monkeypatch.setattr(native, "iter_rows", iter_rows)
+    assert execute(query, native) == expected
+
+
+def test_filters(storage):
+    result = execute(
+        Query("messages", "1", [Count("n"), Count("users", "user_id")],
+              filters={"channel_id": 1}), storage)
+    assert result["n"] == 24
+    assert result["users"] == {"1": 12, "3": 12}
+
+
+def test_voice_aggregations(tmp_path):
+    """Session time is clipped to the window and split by hour"""
+    storage = CsvBackend(str(tmp_path / "raw"))
+    sessions = [("5", T0 - timedelta(minutes=30), T0 + timedelta(minutes=90)),
+                ("6", T0 + timedelta(hours=2), T0 + timedelta(hours=2, minutes=10))]
+    for user, joined, left in sessions:
+        storage.append("voice", {
+            "guild_id": "1", "user_id": user, "channel_id": "9",
+            "joined_at": joined.isoformat(), "left_at": left.isoformat(),
+            "duration_seconds": str(int((left - joined).total_seconds()))})
+
+    result = execute(
+        Query("voice", "1", [
+            Overlap("hours", "hour"),
+            Overlap("channels", "channel_id"),
+            Overlap("weekdays", "weekday"),
+            Overlap("cells", ("channel_id", "hour")),
+            Sum("started", "duration_seconds", since=T0, since_field="joined_at"),
+            Distinct("users", "user_id"),
+            Concurrency("peak", T0, T0 + timedelta(hours=3), "channel_id"),
+        ], start=T0), storage)
+
+    assert result["hours"] == {10: 3600, 11: 1800, 12: 600}
+    assert result["channels"] == {"9": 6000}
+    assert result["weekdays"] == {6: 6000}  # A Sunday
+    assert result["cells"] == {("9", 10): 3600, ("9", 11): 1800, ("9", 12): 600}
+    assert result["started"] == 600
+    assert result["users"] == 2
+    hours = result["peak"]["9"][T0.date()]
+    assert len(hours) == 24
+    assert hours[9:13] == [(1, 1800), (1, 3600), (1, 1800), (1, 600)]
+
+    with pytest.raises(ValueError):
+        execute(Query("voice", "1", [Count("x", "role_id")]), storage)
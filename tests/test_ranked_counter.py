@@ -0,0 +1,62 @@
+import os
+import sys
+import random
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ranked_counter import RankedCounter
+
+
+def test_increment_and_most_common():
+    """Keys are returned ordered by count"""
+    counter = RankedCounter()
+    for key in ["a", "b", "a", "c", "a", "b"]:
+        counter.increment(key)
+
+    assert counter.most_common() == [("a", 3), ("b", 2), ("c", 1)]
+    assert counter.most_common(2) == [("a", 3), ("b", 2)]
+    assert counter.total == 6
+    assert counter["a"] == 3
+    assert counter["missing"] == 0
+
+
+def test_decrement_and_pop():
+    """Counts can be lowered and keys removed"""
+    counter = RankedCounter()
+    counter.increment("a", 5)
+    counter.increment("b", 2)
+
+    counter.decrement("a", 4)
+    assert counter.most_common() == [("b", 2), ("a", 1)]
+
+    counter.decrement("a")
+    assert "a" not in counter
+    assert counter.pop("b") == 2
+    assert len(counter) == 0
+    assert counter.total == 0
+    assert counter.most_common() == []
+
+
+def test_matches_collections_counter():
+    """Random updates keep the same counts as collections.Counter"""
+    rng = random.Random(42)
+    counter = RankedCounter()
+    reference = Counter()
+
+    for _ in range(2000):
+        key = rng.randrange(30)
+        n = rng.randint(1, 3)
+        if rng.random() < 0.7:
+            counter.increment(key, n)
+            reference[key] += n
+        else:
+            counter.decrement(key, n)
+            reference[key] = max(reference[key] - n, 0)
+            if reference[key] == 0:
+                del reference[key]
+
+    assert dict(counter.items()) == dict(reference)
+    counts = [n for _, n in counter.most_common()]
+    assert counts == sorted(reference.values(), reverse=True)
+    assert counter.total == sum(reference.values())
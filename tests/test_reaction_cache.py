@@ -0,0 +1,65 @@
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.reaction_cache import ReactionCache
+from utils.reaction_log import ReactionLogs
+
+
+def entry(user_id, ts=None):
+    ts = ts or datetime(2026, 10, 1, tzinfo=timezone.utc)
+    return {"message_id": "1441043350407872616", "user_id": user_id,
+            "emoji": "🔥", "timestamp": ts.isoformat()}
+
+
+def test_entries_round_trip_through_log(tmp_path):
+    """Cached entries match what a fresh cache reads back from the log"""
+    logs = ReactionLogs(str(tmp_path))
+    cache = ReactionCache(logs)
+    cache.append("1", entry("927772413717004298"))
+    cache.append("1", entry("user-a"))
+
+    assert cache.user_counts("1") == {"927772413717004298": 1, "user-a": 1}
+    assert ReactionCache(logs).entries("1") == cache.entries("1")
+    assert cache.entries("1")[1] == entry("user-a")
+
+
+def test_idle_guilds_are_evicted(tmp_path):
+    """Least recently used guilds are dropped beyond the memory budget"""
+    cache = ReactionCache(ReactionLogs(str(tmp_path)), max_bytes=1)
+    cache.append("1", entry("2"))
+    cache.append("3", entry("4"))
+
+    assert cache.stats()["guilds"] == 1
+    assert cache.evictions == 1
+    # Evicted guilds are reloaded from their log
+    assert cache.user_counts("1") == {"2": 1}
+
+
+def test_prune_updates_cache_and_log(tmp_path):
+    """Cleanup drops entries from memory and marks them in the log"""
+    logs = ReactionLogs(str(tmp_path))
+    cache = ReactionCache(logs)
+    now = datetime.now(timezone.utc)
+    cache.append("1", entry("old", now - timedelta(days=40)))
+    cache.append("1", entry("new", now))
+
+    assert cache.prune_before("1", now - timedelta(days=30)) == (1, 1)
+    assert list(cache.user_counts("1")) == ["new"]
+    assert [e["user_id"] for e in logs.get("1").entries()] == ["new"]
+
+
+def test_removed_reaction_is_logged(tmp_path):
+    """Taking a reaction back removes it from the cache and the log"""
+    logs = ReactionLogs(str(tmp_path))
+    cache = ReactionCache(logs)
+    cache.append("1", entry("2"))
+    cache.append("1", entry("3"))
+
+    assert cache.remove("1", "1441043350407872616", "2", "🔥")
+    assert not cache.remove("1", "1441043350407872616", "2", "🔥")
+    assert list(cache.user_counts("1")) == ["3"]
+    assert [e["user_id"] for e in logs.get("1").entries()] == ["3"]
+    assert logs.get("1").needs_compaction()
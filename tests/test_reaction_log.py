@@ -0,0 +1,41 @@
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.reaction_log import ReactionLog
+
+
+def entry(user_id, ts):
+    return {"message_id": "1", "user_id": user_id, "emoji": "x",
+            "timestamp": ts.isoformat()}
+
+
+def test_prune_is_replayed_and_compacted(tmp_path):
+    """Prune markers hide old entries until compaction drops them"""
+    log = ReactionLog(str(tmp_path / "1.jsonl"))
+    now = datetime.now(timezone.utc)
+    log.append(entry("old", now - timedelta(days=40)))
+    log.append(entry("new", now))
+
+    assert log.prune_before(now - timedelta(days=30)) == (1, 1)
+    assert [e["user_id"] for e in log.entries()] == ["new"]
+    assert log.needs_compaction()
+
+    # Dropped: the old entry and the prune marker
+    assert log.compact() == 2
+    assert not log.needs_compaction()
+    with open(log.path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+    assert [e["user_id"] for e in log.entries()] == ["new"]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    """A half-written line does not hide the rest of the log"""
+    log = ReactionLog(str(tmp_path / "1.jsonl"))
+    log.append(entry("a", datetime.now(timezone.utc)))
+    with open(log.path, "a", encoding="utf-8") as f:
+        f.write('{"message_id": "1", "us')
+
+    assert [e["user_id"] for e in log.entries()] == ["a"]
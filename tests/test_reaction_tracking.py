@@ -26,24 +26,43 @@ def test_guild_id():
 @pytest.fixture
 def cleanup_test_files(test_guild_id):
     """Clean up test files after tests"""
+    # Fresh reaction cache so no guild stays cached between tests
+    import main
+    from utils.reaction_cache import ReactionCache
+    from utils.reaction_log import ReactionLogs
+    original_cache = main.reaction_cache
+    main.reaction_cache = ReactionCache(ReactionLogs("data/reactions/stats"))
     yield
+    main.reaction_cache = original_cache
     # Cleanup after test
-    stats_path = f"data/reactions/stats/{test_guild_id}.json"
+    stats_path = f"data/reactions/stats/{test_guild_id}.jsonl"
     if os.path.exists(stats_path):
         os.remove(stats_path)
 
 
 def test_ensure_reaction_json_exists(test_guild_id, cleanup_test_files):
-    """Test reaction JSON file creation"""
+    """Test reaction log file creation"""
     ensure_reaction_json_exists(test_guild_id)
     
-    path = f"data/reactions/stats/{test_guild_id}.json"
+    path = f"data/reactions/stats/{test_guild_id}.jsonl"
     assert os.path.exists(path)
+    assert read_reaction_json(test_guild_id) == []
+
+
+def test_legacy_reaction_json_is_imported(test_guild_id, cleanup_test_files):
+    """Test that an old <guild>.json is converted into the log"""
+    entry = {"message_id": "1", "user_id": "2", "emoji": "🔥",
+             "timestamp": "2025-11-20T12:31:56+00:00"}
+    path = f"data/reactions/stats/{test_guild_id}.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"reactions": [entry]}, f, indent=4)
+    
+    record_reaction(test_guild_id, "3", "4", "👍")
     
-    with open(path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        assert "reactions" in data
-        assert data["reactions"] == []
+    reactions = load_reaction_stats(test_guild_id)["reactions"]
+    assert [r["message_id"] for r in reactions] == ["1", "3"]
+    assert not os.path.exists(path)
+    assert os.path.exists(path + ".migrated")
 
 
 def test_append_spoiler_reaction(test_guild_id, cleanup_test_files):
@@ -84,3 +103,7 @@ def test_multiple_reactions(test_guild_id, cleanup_test_files):
     
     stats = load_reaction_stats(test_guild_id)
     assert len(stats["reactions"]) == 5
+    
+    # Every reaction is a single appended line
+    with open(f"data/reactions/stats/{test_guild_id}.jsonl", encoding='utf-8') as f:
+        assert len(f.readlines()) == 5
@@ -0,0 +1,56 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.result_cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_watermark_and_ttl():
+    """New data invalidates a result only once the TTL has passed"""
+    clock = Clock()
+    cache = ResultCache(ttl=60, max_age=900, clock=clock)
+    calls = []
+
+    def get():
+        return cache.get_or_compute("activity_hours", 1, (7, ), ["messages"],
+                                    lambda: calls.append(1) or len(calls))
+
+    assert get() == 1
+    clock.now = 30
+    cache.bump("messages", 1)
+    assert get() == 1  # Within the TTL
+
+    clock.now = 100
+    assert get() == 2  # Watermark moved and TTL expired
+
+    clock.now = 500
+    cache.bump("messages", 2)  # Other guild
+    cache.bump("voice")  # Other dataset
+    assert get() == 2
+
+    clock.now = 1500
+    assert get() == 3  # Too old even without new data
+
+    clock.now = 1600
+    cache.bump("messages")  # All guilds
+    assert get() == 4
+    assert cache.stats()["hits"] == 2
+
+
+def test_lru_eviction():
+    cache = ResultCache(max_entries=2)
+    for days in (1, 2, 1, 3):
+        cache.get_or_compute("activity_hours", 1, (days, ), [], lambda: days)
+
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_or_compute("activity_hours", 1, (1, ), [], lambda: None) == 1
+    assert cache.get_or_compute("activity_hours", 1, (2, ), [], lambda: None) is None
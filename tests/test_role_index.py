@@ -0,0 +1,47 @@
+import os
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.role_index import RoleIndex
+
+
+def make_guild():
+    guild = SimpleNamespace(id=1, members=[])
+    roles = {rid: SimpleNamespace(id=rid, guild=guild) for rid in (10, 20)}
+    for member_id, role_ids in ((100, [10]), (200, [10, 20]), (300, [])):
+        guild.members.append(SimpleNamespace(
+            id=member_id, guild=guild, roles=[roles[r] for r in role_ids]))
+    return guild, roles
+
+
+def test_totals_sum_member_counts():
+    """Role totals add up the counts of each role's members"""
+    guild, _roles = make_guild()
+    index = RoleIndex()
+    counts = Counter({"100": 3, "200": 2, "300": 7, "999": 1})
+
+    assert index.totals(guild, ["10", "20"], counts) == {"10": 5, "20": 2}
+
+
+def test_events_keep_index_current():
+    """Member and role events update an already built index"""
+    guild, roles = make_guild()
+    index = RoleIndex()
+    assert index.members(guild, 20) == {200}
+
+    before = guild.members[2]
+    after = SimpleNamespace(id=300, guild=guild, roles=[roles[20]])
+    index.member_updated(before, after)
+    assert index.members(guild, 20) == {200, 300}
+
+    index.member_removed(guild.members[1])
+    assert index.members(guild, 10) == {100}
+
+    index.member_joined(SimpleNamespace(id=400, guild=guild, roles=[roles[10]]))
+    assert index.members(guild, 10) == {100, 400}
+
+    index.role_deleted(roles[20])
+    assert index.members(guild, 20) == set()
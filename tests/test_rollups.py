@@ -0,0 +1,117 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rollups import HourlyRollup
+from utils.storage import CsvBackend
+
+T0 = datetime(2026, 3, 1, 10, 15, tzinfo=timezone.utc)
+
+
+def message(guild, channel, user, ts):
+    return {"guild_id": guild, "user_id": user, "channel_id": channel,
+            "timestamp": ts.isoformat()}
+
+
+def test_rollup_matches_storage_counts(tmp_path):
+    """Rollup groups agree with count_by over the raw messages"""
+    storage = CsvBackend(str(tmp_path / "raw"))
+    rows = [message("1", str(i % 3), str(i % 5), T0 + timedelta(minutes=37 * i))
+            for i in range(200)]
+    rows.append(message("2", "9", "9", T0))
+    for row in rows:
+        storage.append("messages", row)
+
+    rollup = HourlyRollup(str(tmp_path / "rollup"))
+    rollup.load(lambda start: storage.iter_rows("messages", start=start))
+
+    assert rollup.count("1") == 200
+    for key in ("hour", "day", "channel_id", "user_id", ("channel_id", "hour")):
+        assert rollup.count_by("1", key) == storage.count_by("messages", "1", key)
+
+    # Whole-hour windows match exactly
+    start, end = T0.replace(minute=0) + timedelta(hours=5), T0.replace(minute=0) + timedelta(days=2)
+    assert rollup.count_by("1", "user_id", start, end) == \
+        storage.count_by("messages", "1", "user_id", start, end)
+
+
+def test_rollup_is_persisted_per_day(tmp_path):
+    """Flushed counts survive a reload, old days are dropped"""
+    directory = str(tmp_path / "rollup")
+    rollup = HourlyRollup(directory)
+    rollup.load(lambda start: [])
+    rollup.add("1", "5", "7", T0)
+    rollup.add("1", "5", "7", T0 + timedelta(minutes=1))
+    rollup.add("1", "6", "7", T0 + timedelta(days=1))
+    assert rollup.flush() == 2
+    assert rollup.flush() == 0
+
+    def replay(start):
+        assert start == T0 + timedelta(days=1)  # Only after the watermark
+        return []
+
+    reloaded = HourlyRollup(directory)
+    reloaded.load(replay)
+    assert reloaded.count_by("1", "channel_id") == {"5": 2, "6": 1}
+
+    assert reloaded.drop_before(T0 + timedelta(days=1)) == 1
+    assert sorted(os.listdir(directory)) == ["2026-03-02.csv", "watermark"]
+    assert reloaded.count("1") == 1
+
+
+def test_rollup_replays_messages_after_watermark(tmp_path):
+    """Messages added after the last flush are recovered from raw rows"""
+    storage = CsvBackend(str(tmp_path / "raw"))
+    directory = str(tmp_path / "rollup")
+    rollup = HourlyRollup(directory)
+    rollup.load(lambda start: storage.iter_rows("messages", start=start))
+    for i in range(10):
+        ts = T0 + timedelta(seconds=10 * i)
+        storage.append("messages", message("1", "5", str(i), ts))
+        rollup.add("1", "5", str(i), ts)
+        if i == 5:
+            rollup.flush()
+    # No flush after the last messages, as in a crash
+
+    reloaded = HourlyRollup(directory)
+    reloaded.load(lambda start: storage.iter_rows("messages", start=start))
+    assert reloaded.count("1") == 10
+    assert reloaded.count_by("1", "user_id") == storage.count_by(
+        "messages", "1", "user_id")
+
+
+def test_rollup_rejects_unknown_keys(tmp_path):
+    rollup = HourlyRollup(str(tmp_path / "rollup"))
+    with pytest.raises(ValueError):
+        rollup.count_by("1", "timestamp")
+
+
+def test_top_is_bounded_and_windowed(tmp_path):
+    """Daily summaries keep the heavy hitters in a fixed number of counters"""
+    rollup = HourlyRollup(str(tmp_path / "rollup"), top_capacity=8)
+    rollup.load(lambda start: [])
+    day = T0.replace(hour=0, minute=0)
+    for d in range(3):
+        for i in range(300):
+            # Users 0-2 are heavy, the rest post once a day
+            user = str(i % 3) if i % 2 else f"once-{d}-{i}"
+            rollup.add("1", "5", user, day + timedelta(days=d, minutes=i))
+    rollup.add("1", "6", "late", day + timedelta(days=2, hours=20), n=500)
+
+    top = rollup.top("1", "user_id", 4)
+    assert top[0][0] == "late" and top[0][1] >= 500
+    assert {user for user, _ in top[1:]} == {"0", "1", "2"}
+    assert all(count >= 150 for _, count in top[1:])  # Upper bounds
+    assert all(len(s) <= 8 for s in rollup._top["1"].values())
+
+    # A window starting mid-day counts those hours exactly
+    start = day + timedelta(days=2, hours=12)
+    assert rollup.top("1", "user_id", 2, start) == [("late", 500)]
+    assert rollup.top("1", "channel_id", 5, start) == [("6", 500)]
+    assert dict(rollup.top("1", "channel_id", 5)) == {"5": 900, "6": 500}
+
+    with pytest.raises(ValueError):
+        rollup.top("1", "hour", 3)
@@ -0,0 +1,172 @@
+import pytest
+import os
+import sys
+from datetime import date, datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.segments import SegmentedCsv
+from utils.timeutil import parse_ts
+
+FIELDS = ["guild_id", "user_id", "channel_id", "timestamp"]
+
+
+def make_row(ts):
+    return {"guild_id": "1", "user_id": "2", "channel_id": "3",
+            "timestamp": ts.isoformat()}
+
+
+def test_rows_go_to_day_segments(tmp_path):
+    """Each row lands in the segment of its UTC day"""
+    segments = SegmentedCsv(str(tmp_path / "data"), FIELDS, "timestamp")
+    day1 = datetime(2026, 10, 15, 23, 30, tzinfo=timezone.utc)
+    day2 = datetime(2026, 10, 16, 0, 30, tzinfo=timezone.utc)
+
+    assert segments.append_rows([make_row(day1), make_row(day2),
+                                 make_row(day2)]) == 3
+
+    assert [d for d, _ in segments.segments()] == [date(2026, 10, 15),
+                                                   date(2026, 10, 16)]
+    assert len(list(segments.iter_rows())) == 3
+    assert len(list(segments.iter_rows(start=day2))) == 2
+    assert len(list(segments.iter_rows(end=day1))) == 0
+    assert len(list(segments.iter_rows(end=day2))) == 1
+
+
+def test_windowed_reads_cut_inside_segments(tmp_path):
+    """Boundary segments are cut exactly at start and end"""
+    segments = SegmentedCsv(str(tmp_path / "data"), FIELDS, "timestamp")
+    base = datetime(2026, 10, 15, tzinfo=timezone.utc)
+    stamps = [base + timedelta(minutes=7 * i) for i in range(400)]
+    segments.append_rows([make_row(ts) for ts in stamps])
+
+    for start, end in ((stamps[0], stamps[-1]), (stamps[13], stamps[250]),
+                       (stamps[100] + timedelta(seconds=1), stamps[101]),
+                       (base - timedelta(days=1), base + timedelta(days=9)),
+                       (stamps[5], stamps[5])):
+        rows = list(segments.iter_rows(start, end))
+        expected = [ts for ts in stamps if start <= ts < end]
+        assert [parse_ts(r["timestamp"]) for r in rows] == expected
+
+
+def test_drop_before_removes_whole_days(tmp_path):
+    """Retention deletes segment files without touching newer ones"""
+    segments = SegmentedCsv(str(tmp_path / "data"), FIELDS, "timestamp")
+    now = datetime.now(timezone.utc)
+    segments.append_rows([make_row(now - timedelta(days=d))
+                          for d in (0, 1, 40, 41)])
+
+    assert segments.drop_before(now - timedelta(days=30)) == 2
+    assert len(list(segments.iter_rows())) == 2
+
+
+def test_rewrite_replaces_dataset(tmp_path):
+    """Rewrite keeps only the given rows and removes empty segments"""
+    segments = SegmentedCsv(str(tmp_path / "data"), FIELDS, "timestamp")
+    now = datetime.now(timezone.utc)
+    segments.append_rows([make_row(now), make_row(now - timedelta(days=3))])
+
+    segments.rewrite([make_row(now)])
+
+    assert len(segments.segments()) == 1
+    rows = list(segments.iter_rows())
+    assert parse_ts(rows[0]["timestamp"]) == now
+
+
+def test_tombstones_hide_rows_until_compaction(tmp_path):
+    """Tombstoned rows are filtered on read and removed by compact()"""
+    from utils.tombstones import TombstoneLog
+
+    tombstones = TombstoneLog(str(tmp_path / "data" / "tombstones.csv"))
+    segments = SegmentedCsv(str(tmp_path / "data"), FIELDS, "timestamp",
+                            tombstones)
+    now = datetime.now(timezone.utc)
+    row = make_row(now - timedelta(minutes=1))
+    other = dict(row, user_id="9")
+    segments.append_rows([row, other])
+
+    tombstones.add("1", "user_id", "2", now)
+    segment_file = segments.segments()[0][1]
+    size_before = os.path.getsize(segment_file)
+
+    assert [r["user_id"] for r in segments.iter_rows()] == ["9"]
+    assert os.path.getsize(segment_file) == size_before
+
+    # Rows newer than the tombstone stay visible
+    segments.append_rows([make_row(now + timedelta(seconds=1))])
+    assert len(list(segments.iter_rows())) == 2
+
+    assert segments.compact() == 1
+    assert len(tombstones) == 0
+    assert len(list(segments.iter_rows())) == 2
+
+
+def test_guild_shards(tmp_path):
+    """Each guild reads only its own shard; full scans stay in time order"""
+    from utils.segments import GuildShards
+    from utils.tombstones import TombstoneLog
+
+    directory = str(tmp_path / "pings")
+    base = datetime(2026, 10, 15, tzinfo=timezone.utc)
+    shards = GuildShards(directory, FIELDS, "timestamp",
+                         TombstoneLog(os.path.join(directory, "tombstones.csv")))
+    rows = [dict(make_row(base + timedelta(hours=i)), guild_id=str(i % 3 + 1))
+            for i in range(30)]
+    assert shards.append_rows(rows) == 30
+
+    assert shards.guilds() == ["1", "2", "3"]
+    assert len(list(shards.iter_rows("2"))) == 10
+    assert list(shards.iter_rows()) == rows
+
+    shards.tombstones.add("2", "user_id", "2", base + timedelta(days=2))
+    assert len(list(shards.iter_rows("2"))) == 0
+    assert shards.compact() == 10
+    assert len(list(shards.iter_rows())) == 20
+
+    assert shards.drop_guild("3")
+    assert shards.guilds() == ["1", "2"]
+    assert not shards.drop_guild("3")
+    with pytest.raises(ValueError):
+        shards.shard("../1")
+
+
+def test_guild_shards_import_unsharded_segments(tmp_path):
+    """Day segments from before sharding are split per guild"""
+    from utils.segments import GuildShards
+
+    directory = str(tmp_path / "pings")
+    day = datetime(2026, 10, 15, tzinfo=timezone.utc)
+    SegmentedCsv(directory, FIELDS, "timestamp").append_rows(
+        [dict(make_row(day), guild_id=g) for g in ("1", "2", "2")])
+
+    shards = GuildShards(directory, FIELDS, "timestamp")
+    assert shards.import_legacy(str(tmp_path / "missing.csv")) == 3
+    assert sorted(os.listdir(directory)) == ["1", "2"]
+    assert len(list(shards.iter_rows("2"))) == 2
+
+
+def test_hour_index_sidecar(tmp_path):
+    """The hour index is extended on append and rebuilt when missing"""
+    from utils.segments import hour_index, index_path
+
+    segments = SegmentedCsv(str(tmp_path / "pings"), FIELDS, "timestamp")
+    base = datetime(2026, 10, 15, 3, 0, tzinfo=timezone.utc)
+    segments.append_rows([make_row(base + timedelta(minutes=20 * i)) for i in range(6)])
+    path = segments.segment_path(base.date())
+
+    with open(path, "rb") as f:
+        lines = f.readlines()
+    offsets = [sum(len(line) for line in lines[:i]) for i in range(len(lines))]
+    assert hour_index(path, "timestamp") == {3: offsets[1], 4: offsets[4]}
+
+    segments.append_rows([make_row(base + timedelta(hours=5))])
+    assert sorted(hour_index(path, "timestamp")) == [3, 4, 8]
+
+    os.remove(index_path(path))
+    assert sorted(hour_index(path, "timestamp")) == [3, 4, 8]
+    assert not os.path.exists(index_path(path))  # Readers never write it
+
+    rows = list(segments.iter_rows(base + timedelta(minutes=50), base + timedelta(hours=5)))
+    assert [parse_ts(r["timestamp"]) for r in rows] == [
+        base + timedelta(minutes=60), base + timedelta(minutes=80),
+        base + timedelta(minutes=100)]
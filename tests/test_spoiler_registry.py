@@ -0,0 +1,73 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.spoiler_registry import DISCORD_EPOCH_MS, SpoilerRegistry
+
+
+def snowflake(ts):
+    return (int(ts.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22
+
+
+def test_registry_is_persisted(tmp_path):
+    """Spoiler message IDs survive a restart"""
+    path = str(tmp_path / "spoilers.csv")
+    message_id = snowflake(datetime.now(timezone.utc))
+    SpoilerRegistry(path).add(1, message_id)
+
+    registry = SpoilerRegistry(path)
+    assert message_id in registry
+    assert str(message_id) in registry
+    assert message_id + 1 not in registry
+
+
+def test_registry_is_bounded(tmp_path):
+    """The oldest and expired IDs are dropped"""
+    registry = SpoilerRegistry(str(tmp_path / "spoilers.csv"), max_entries=2,
+                               max_age=timedelta(days=30))
+    now = datetime.now(timezone.utc)
+    expired = snowflake(now - timedelta(days=31))
+    recent = [snowflake(now - timedelta(minutes=m)) for m in (3, 2, 1)]
+
+    registry.add(1, expired)
+    assert expired not in registry
+
+    for message_id in recent:
+        registry.add(1, message_id)
+    assert len(registry) == 2
+    assert recent[0] not in registry
+    assert recent[2] in registry
+
+
+@pytest.mark.asyncio
+async def test_registry_batches_appends(tmp_path):
+    """New IDs are queued while running and written on flush"""
+    path = str(tmp_path / "spoilers.csv")
+    registry = SpoilerRegistry(path, flush_interval=60)
+    registry.start()
+    message_id = snowflake(datetime.now(timezone.utc))
+    registry.add(1, message_id)
+
+    assert message_id in registry
+    assert not os.path.exists(path)
+
+    await registry.stop()
+    assert message_id in SpoilerRegistry(path)
+
+
+def test_registry_is_compacted_while_running(tmp_path):
+    """Lines of dropped IDs are removed without a restart"""
+    path = str(tmp_path / "spoilers.csv")
+    registry = SpoilerRegistry(path, max_entries=5, compact_lines=20)
+    now = datetime.now(timezone.utc)
+    message_ids = [snowflake(now - timedelta(seconds=100 - i)) for i in range(100)]
+    for message_id in message_ids:
+        registry.add(1, message_id)
+
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) <= 21
+    reloaded = SpoilerRegistry(path)
+    assert all(message_id in reloaded for message_id in message_ids[-5:])
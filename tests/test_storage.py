@@ -0,0 +1,113 @@
+import pytest
+import os
+import sys
+from datetime import date, datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.storage import BinaryBackend, CsvBackend, SqliteBackend
+
+
+@pytest.fixture(params=["csv", "sqlite", "binary"])
+def backend(request, tmp_path):
+    if request.param == "csv":
+        storage = CsvBackend(str(tmp_path / "data"))
+    elif request.param == "binary":
+        storage = BinaryBackend(str(tmp_path / "data"))
+    else:
+        storage = SqliteBackend(str(tmp_path / "data" / "activity.sqlite3"))
+    yield storage
+    if request.param == "sqlite":
+        storage.close()
+
+
+def ping(guild, role, user, ts):
+    return {"guild_id": guild, "role_id": role, "user_id": user,
+            "channel_id": "9", "timestamp": ts.isoformat()}
+
+
+def test_window_is_half_open(backend):
+    """Rows at `end` are excluded, rows at `start` included"""
+    start = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    for hours in (0, 5, 24, 48):
+        backend.append("pings", ping("1", "2", "3", start + timedelta(hours=hours)))
+    backend.append("pings", ping("5", "2", "3", start))
+
+    rows = list(backend.iter_rows("pings", "1", start, start + timedelta(days=1)))
+    assert len(rows) == 2
+    assert all(r["guild_id"] == "1" for r in rows)
+    assert backend.count("pings", "1") == 4
+
+
+def test_count_by_fields_and_time_keys(backend):
+    """count_by groups by fields, hour and day"""
+    day = datetime(2026, 10, 1, 14, tzinfo=timezone.utc)
+    backend.append("pings", ping("1", "11", "21", day))
+    backend.append("pings", ping("1", "11", "22", day))
+    backend.append("pings", ping("1", "12", "21", day + timedelta(days=1)))
+
+    assert backend.count_by("pings", "1", "user_id") == {"21": 2, "22": 1}
+    assert backend.count_by("pings", "1", "hour") == {14: 3}
+    assert backend.count_by("pings", "1", ("role_id", "day")) == {
+        ("11", date(2026, 10, 1)): 2,
+        ("12", date(2026, 10, 2)): 1,
+    }
+
+
+def test_delete_and_rewrite(backend):
+    """Deleted rows disappear, rewrite replaces the dataset"""
+    ts = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    backend.append("pings", ping("1", "11", "21", ts))
+    backend.append("pings", ping("1", "12", "21", ts))
+
+    backend.delete("pings", "1", "role_id", "11")
+    assert [r["role_id"] for r in backend.iter_rows("pings")] == ["12"]
+
+    backend.rewrite("pings", [ping("1", "13", "24", ts)])
+    assert [r["role_id"] for r in backend.iter_rows("pings")] == ["13"]
+
+
+def test_drop_before(backend):
+    """Retention keeps everything from the boundary on"""
+    now = datetime(2026, 10, 16, 12, tzinfo=timezone.utc)
+    backend.append("pings", ping("1", "11", "21", now - timedelta(days=40)))
+    backend.append("pings", ping("1", "12", "21", now))
+
+    cutoff = now - timedelta(days=30)
+    backend.drop_before("pings", cutoff)
+
+    rows = list(backend.iter_rows("pings"))
+    assert [r["role_id"] for r in rows] == ["12"]
+    assert backend.retention_boundary(cutoff) <= cutoff
+
+
+def test_binary_records_are_fixed_width(tmp_path):
+    """Binary segments hold 8 bytes per field and ignore a torn tail"""
+    storage = BinaryBackend(str(tmp_path / "data"))
+    ts = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    storage.append("pings", ping("1", "11", "21", ts))
+    storage.append("pings", ping("1", "not-a-snowflake", "21", ts))
+
+    segments = storage.segments["pings"]
+    path = segments.segment_path(ts.date())
+    assert os.path.getsize(path) == 5 * 8
+
+    with open(path, "ab") as f:
+        f.write(b"\x00" * 12)
+
+    assert list(storage.iter_rows("pings", "1")) == [ping("1", "11", "21", ts)]
+
+
+def test_sqlite_rows_are_read_in_batches(tmp_path):
+    """iter_rows streams the cursor and lets writes in between batches"""
+    storage = SqliteBackend(str(tmp_path / "activity.sqlite3"))
+    storage.fetch_rows = 2
+    start = datetime(2026, 10, 1, tzinfo=timezone.utc)
+    for i in range(5):
+        storage.append("pings", ping("1", "2", str(i), start + timedelta(hours=i)))
+
+    rows = storage.iter_rows("pings", "1")
+    assert next(rows)["user_id"] == "0"
+    storage.append("pings", ping("7", "2", "3", start))
+    assert [r["user_id"] for r in rows] == ["1", "2", "3", "4"]
+    storage.close()
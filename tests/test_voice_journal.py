@@ -0,0 +1,96 @@
+import pytest
+import os
+import sys
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.voice_journal import VoiceJournal
+
+T0 = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def test_sessions_survive_restart(tmp_path):
+    path = str(tmp_path / "voice_sessions.csv")
+    journal = VoiceJournal(path, compact_lines=4)
+    journal.open("1", "7", "100", T0)
+    assert journal.open("1", "7", "101", T0 + timedelta(minutes=5)) == {
+        "channel_id": "100", "joined_at": T0}
+    journal.open("1", "8", "100", T0)
+    assert journal.close("1", "8", T0 + timedelta(minutes=1))["channel_id"] == "100"
+    assert journal.close("1", "8", T0) is None
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("open,1,9,10")  # Torn line of a crash
+
+    restarted = VoiceJournal(path)
+    assert len(restarted) == 1
+    assert restarted.get("1", "7") == {"channel_id": "101",
+                                       "joined_at": T0 + timedelta(minutes=5)}
+    # Compacted to the open sessions on load
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2
+
+
+def test_reconcile_and_sweep(tmp_path):
+    path = str(tmp_path / "voice_sessions.csv")
+    journal = VoiceJournal(path)
+    journal.open("1", "7", "100", T0)  # Still there
+    journal.open("1", "8", "100", T0)  # Left while offline
+    journal.open("1", "9", "100", T0)  # Moved while offline
+    journal.open("2", "7", "200", T0)  # Other guild
+    alive = (T0 + timedelta(hours=1)).timestamp()
+    os.utime(path, (alive, alive))
+
+    now = T0 + timedelta(hours=3)
+    restarted = VoiceJournal(path)
+    closed = restarted.reconcile(1, {7: 100, 9: 101, 10: 100}, now)
+
+    assert sorted(closed) == [("8", "100", T0, T0 + timedelta(hours=1)),
+                              ("9", "100", T0, T0 + timedelta(hours=1))]
+    assert restarted.get("1", "7")["joined_at"] == T0
+    assert restarted.get("1", "9") == {"channel_id": "101", "joined_at": now}
+    assert restarted.get("1", "10")["joined_at"] == now
+
+    # Guild 2 is gone, guild 1's users are still in voice
+    active = [("1", "7"), ("1", "9"), ("1", "10")]
+    assert restarted.sweep(now, active) == 1
+    assert restarted.get("2", "7") is None
+    assert len(VoiceJournal(path)) == 3
+
+
+def test_reconcile_after_reconnect(tmp_path):
+    """Sessions of the running process are closed at its last write"""
+    path = str(tmp_path / "voice_sessions.csv")
+    VoiceJournal(path).open("1", "8", "100", T0)
+    old = T0.timestamp()
+    os.utime(path, (old, old))
+
+    journal = VoiceJournal(path)
+    joined = datetime.now(timezone.utc) - timedelta(minutes=30)
+    before = datetime.now(timezone.utc)
+    journal.open("1", "7", "100", joined)
+    closed = journal.reconcile(1, {8: 100}, before + timedelta(hours=1))
+
+    [(user_id, _channel, joined_at, left)] = closed
+    assert (user_id, joined_at) == ("7", joined)
+    assert before <= left <= datetime.now(timezone.utc)
+
+
+@pytest.mark.asyncio
+async def test_channel_move_credits_previous_channel():
+    import main
+
+    guild = SimpleNamespace(id=42)
+    member = SimpleNamespace(id=7, bot=False, guild=guild)
+    a, b = SimpleNamespace(id=100), SimpleNamespace(id=101)
+    state = lambda channel: SimpleNamespace(channel=channel)
+
+    with patch.object(main, "end_voice_session") as ended:
+        await main.on_voice_state_update(member, state(None), state(a))
+        await main.on_voice_state_update(member, state(a), state(a))  # Mute
+        await main.on_voice_state_update(member, state(a), state(b))
+        await main.on_voice_state_update(member, state(b), state(None))
+
+    assert [call.args[2] for call in ended.call_args_list] == ["100", "101"]
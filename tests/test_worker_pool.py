@@ -0,0 +1,82 @@
+import pytest
+import os
+import sys
+import asyncio
+import threading
+from datetime import datetime, timezone, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.query import Count, Query
+from utils.storage import CsvBackend
+from utils.worker_pool import AnalyticsPool
+
+T0 = datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+
+
+def fill(storage):
+    for i in range(10):
+        storage.append("pings", {
+            "guild_id": "1", "role_id": str(i % 2), "user_id": "3",
+            "channel_id": "4", "timestamp": (T0 + timedelta(days=i)).isoformat()})
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_pool_executes_queries(tmp_path, kind):
+    """Thread and process workers give the same answers"""
+    storage = CsvBackend(str(tmp_path / "raw"))
+    fill(storage)
+    pool = AnalyticsPool(kind, workers=1)
+    try:
+        result = await pool.execute(
+            Query("pings", "1", [Count("n"), Count("roles", "role_id")],
+                  filters={"user_id": 3}), storage)
+    finally:
+        pool.shutdown()
+
+    assert result == {"n": 10, "roles": {"0": 5, "1": 5}}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("kind", ["thread", "process"])
+async def test_pool_sees_later_resets(tmp_path, kind):
+    """Workers pick up tombstones written after they opened the storage"""
+    storage = CsvBackend(str(tmp_path / "raw"))
+    fill(storage)
+    pool = AnalyticsPool(kind, workers=1)
+    query = Query("pings", "1", [Count("n")])
+    try:
+        assert (await pool.execute(query, storage))["n"] == 10
+        storage.delete("pings", "1", "role_id", "0")
+        assert (await pool.execute(query, storage))["n"] == 5
+    finally:
+        pool.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_pool_caps_concurrent_jobs():
+    pool = AnalyticsPool("thread", workers=4, max_jobs=2)
+    running = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def job():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        threading.Event().wait(0.05)
+        with lock:
+            running -= 1
+
+    try:
+        await asyncio.gather(*(pool.run(job) for _ in range(6)))
+    finally:
+        pool.shutdown()
+    assert peak == 2
+
+
+def test_pool_rejects_unknown_kind():
+    with pytest.raises(ValueError):
+        AnalyticsPool("gpu")
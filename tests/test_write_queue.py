@@ -0,0 +1,65 @@
+import pytest
+import os
+import csv
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.write_queue import WriteBehindQueue
+
+HEADER = ["guild_id", "user_id", "channel_id", "timestamp"]
+
+
+def read_rows(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+def test_write_through_without_running_task(tmp_path):
+    """Without a background task rows are written immediately"""
+    path = str(tmp_path / "out.csv")
+    queue = WriteBehindQueue()
+
+    queue.enqueue(path, HEADER, ["1", "2", "3", "ts"])
+
+    assert queue.depth == 0
+    assert read_rows(path) == [HEADER, ["1", "2", "3", "ts"]]
+
+
+def test_flush_groups_rows_per_file(tmp_path):
+    """One flush writes the header once and all rows per file"""
+    path_a = str(tmp_path / "a.csv")
+    path_b = str(tmp_path / "sub" / "b.csv")
+    queue = WriteBehindQueue()
+
+    # Simulate a running task so rows stay buffered
+    queue._pending.extend([
+        (path_a, HEADER, ["a1"]),
+        (path_b, HEADER, ["b1"]),
+        (path_a, HEADER, ["a2"]),
+    ])
+    assert queue.flush() == 3
+
+    assert read_rows(path_a) == [HEADER, ["a1"], ["a2"]]
+    assert read_rows(path_b) == [HEADER, ["b1"]]
+    assert queue.stats()["flushes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_background_flush_and_drain(tmp_path):
+    """Rows are buffered while running and drained on stop"""
+    path = str(tmp_path / "out.csv")
+    queue = WriteBehindQueue(max_batch=1000, flush_interval=60)
+    queue.start()
+
+    for i in range(5):
+        queue.enqueue(path, HEADER, [str(i)])
+
+    assert queue.depth == 5
+    assert not os.path.exists(path)
+
+    await queue.stop()
+
+    assert queue.depth == 0
+    assert len(read_rows(path)) == 6
+    assert queue.stats()["written"] == 5
@@ -0,0 +1,302 @@
+import mmap
+import os
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+
+from utils.ping_store import EPOCH, MAX_SNOWFLAKE, to_epoch_us
+from utils.timeutil import parse_ts
+
+DAY_US = 86_400_000_000
+
+
+def encode_snowflake(value) -> int:
+    """Parse a Discord ID, raises ValueError for anything that is not one."""
+    text = str(value)
+    if not text.isdigit() or int(text) > MAX_SNOWFLAKE:
+        raise ValueError(f"Not a snowflake: {value!r}")
+    return int(text)
+
+
+def append_records(path: str, _header, records: list):
+    """Append int64 records to a segment file (WriteBehindQueue writer)."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    flat = array("q")
+    for record in records:
+        flat.extend(record)
+    with open(path, "ab") as f:
+        f.write(flat.tobytes())
+
+
+class BinarySegments:
+    """
+    A dataset stored as fixed-width binary records, one file per UTC day.
+
+    Every field is a signed 64-bit integer in host byte order: snowflakes
+    as-is (they fit below 2**63), timestamps as epoch microseconds and
+    durations as whole seconds. Segments are `<directory>/<YYYY-MM-DD>.bin`
+    without a header, so record `i` starts at byte `i * record_size`.
+
+    Readers map each segment with `mmap` and cast it to a `memoryview` of
+    int64, so a scan only touches integers and never parses text.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 fields: list[str],
+                 ts_field: str,
+                 ts_fields: tuple[str, ...],
+                 tombstones=None):
+        self.directory = directory
+        self.fields = fields
+        self.ts_field = ts_field
+        self.ts_fields = ts_fields
+        self.tombstones = tombstones
+
+        self.width = len(fields)
+        self.record_size = self.width * array("q").itemsize
+        self.ts_index = fields.index(ts_field)
+        self.guild_index = fields.index("guild_id")
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.directory)
+
+    def ensure_exists(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ---------- Encoding ----------
+
+    def encode(self, row: dict) -> tuple:
+        """Turn a CSV-style row into a tuple of ints."""
+        values = []
+        for field in self.fields:
+            value = row[field]
+            if field in self.ts_fields:
+                if not isinstance(value, datetime):
+                    value = parse_ts(value)
+                values.append(to_epoch_us(value))
+            elif field.endswith("_id"):
+                values.append(encode_snowflake(value))
+            else:
+                values.append(int(value))
+        return tuple(values)
+
+    def decode(self, record) -> dict:
+        """Turn a record back into a CSV-style row."""
+        row = {}
+        for field, value in zip(self.fields, record):
+            if field in self.ts_fields:
+                row[field] = (EPOCH + timedelta(microseconds=value)).isoformat()
+            else:
+                row[field] = str(value)
+        return row
+
+    # ---------- Paths ----------
+
+    def segment_path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.bin")
+
+    def segment_for(self, ts_us: int) -> str:
+        """Path of the segment a record with timestamp `ts_us` belongs to."""
+        return self.segment_path(EPOCH.date() + timedelta(days=ts_us // DAY_US))
+
+    def segments(self,
+                 start: datetime | None = None,
+                 end: datetime | None = None) -> list[tuple[date, str]]:
+        """
+        List segments overlapping [start, end], oldest first.
+
+        Returns:
+            List of tuples: [(day, path), ...]
+        """
+        if not self.exists():
+            return []
+
+        first = start.astimezone(timezone.utc).date() if start else None
+        last = end.astimezone(timezone.utc).date() if end else None
+
+        found = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext != ".bin":
+                continue
+            try:
+                day = date.fromisoformat(stem)
+            except ValueError:
+                continue
+            if first and day < first:
+                continue
+            if last and day > last:
+                continue
+            found.append((day, os.path.join(self.directory, name)))
+
+        found.sort()
+        return found
+
+    # ---------- Reading ----------
+
+    def _deleted(self) -> dict:
+        """Tombstones as {(guild, field, value): epoch_us} on integer IDs."""
+        if self.tombstones is None:
+            return {}
+
+        deleted = {}
+        for (guild_id, field, value), ts in self.tombstones.snapshot().items():
+            if field not in self.fields:
+                continue
+            try:
+                key = (encode_snowflake(guild_id), self.fields.index(field),
+                       encode_snowflake(value))
+            except ValueError:
+                continue
+            deleted[key] = to_epoch_us(ts)
+        return deleted
+
+    def _is_deleted(self, deleted: dict, record) -> bool:
+        guild = record[self.guild_index]
+        ts = record[self.ts_index]
+        for (g, index, value), deleted_at in deleted.items():
+            if g == guild and record[index] == value and ts <= deleted_at:
+                return True
+        return False
+
+    def _read_segment(self, path: str, consume):
+        """
+        Map one segment and call `consume(columns)` while it is mapped.
+
+        `columns` is a list of strided int64 memoryviews, one per field.
+        They are released before the mapping is closed, so `consume` must
+        not keep references to them.
+        """
+        size = os.path.getsize(path)
+        count = size // self.record_size  # Ignore a torn trailing record
+        if count == 0:
+            return None
+
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0,
+                                              access=mmap.ACCESS_READ) as mm:
+            raw = memoryview(mm)
+            view = raw[:count * self.record_size].cast("q")
+            columns = [view[i::self.width] for i in range(self.width)]
+            try:
+                return consume(columns)
+            finally:
+                for column in columns:
+                    column.release()
+                view.release()
+                raw.release()
+
+    def records(self,
+                guild_id=None,
+                start: datetime | None = None,
+                end: datetime | None = None):
+        """
+        Yield records of one guild (or all) with start <= ts < end, oldest
+        segment first. Filtering happens on the mapped integers.
+        """
+        guild = encode_snowflake(guild_id) if guild_id is not None else None
+        start_us = to_epoch_us(start) if start is not None else None
+        end_us = to_epoch_us(end) if end is not None else None
+        deleted = self._deleted()
+
+        def consume(columns):
+            guilds = columns[self.guild_index]
+            stamps = columns[self.ts_index]
+            # Records are appended in time order, so the window is a slice
+            first = 0 if start_us is None else bisect_left(stamps, start_us)
+            last = len(stamps) if end_us is None else bisect_left(
+                stamps, end_us, first)
+            found = []
+            for i in range(first, last):
+                if guild is not None and guilds[i] != guild:
+                    continue
+                record = tuple(column[i] for column in columns)
+                if deleted and self._is_deleted(deleted, record):
+                    continue
+                found.append(record)
+            return found
+
+        for _day, path in self.segments(start, end):
+            yield from self._read_segment(path, consume) or ()
+
+    # ---------- Writing ----------
+
+    def _write_segment(self, path: str, records):
+        tmp_path = path + ".tmp"
+        flat = array("q")
+        for record in records:
+            flat.extend(record)
+        with open(tmp_path, "wb") as f:
+            f.write(flat.tobytes())
+        os.replace(tmp_path, path)
+
+    def rewrite(self, records):
+        """Replace the whole dataset with `records`."""
+        grouped: dict[str, list] = {}
+        for record in records:
+            path = self.segment_for(record[self.ts_index])
+            grouped.setdefault(path, []).append(record)
+
+        for _day, path in self.segments():
+            if path not in grouped:
+                os.remove(path)
+
+        self.ensure_exists()
+        for path, values in grouped.items():
+            self._write_segment(path, values)
+        if self.tombstones is not None:
+            self.tombstones.clear()
+
+    def compact(self) -> int:
+        """
+        Fold the tombstones into the segment files and clear them.
+
+        Returns:
+            Number of records removed from disk
+        """
+        if self.tombstones is None:
+            return 0
+
+        snapshot = self.tombstones.snapshot()
+        if not snapshot:
+            return 0
+
+        deleted = self._deleted()
+        removed = 0
+
+        def consume(columns):
+            return list(zip(*columns))
+
+        for _day, path in self.segments(end=max(snapshot.values())):
+            records = self._read_segment(path, consume) or []
+            kept = [r for r in records if not self._is_deleted(deleted, r)]
+            if len(kept) == len(records):
+                continue
+
+            removed += len(records) - len(kept)
+            if kept:
+                self._write_segment(path, kept)
+            else:
+                os.remove(path)
+
+        self.tombstones.discard(snapshot)
+        return removed
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """
+        Delete every segment that ends before the day of `cutoff`.
+
+        Returns:
+            Number of segment files removed
+        """
+        cutoff_day = cutoff.astimezone(timezone.utc).date()
+        removed = 0
+        for day, path in self.segments():
+            if day >= cutoff_day:
+                break
+            os.remove(path)
+            removed += 1
+        return removed
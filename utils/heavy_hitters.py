@@ -0,0 +1,84 @@
+from utils.ranked_counter import RankedCounter
+
+
+class SpaceSaving:
+    """
+    Approximate top-k counts in at most `capacity` counters
+    (Space-Saving, Metwally et al.).
+
+    While fewer than `capacity` keys were seen the counts are exact. After
+    that a new key takes over the counter of the current minimum and
+    inherits its count, so counts are upper bounds that exceed the true
+    count by at most `error(key)`. Every key whose true count is above
+    total / capacity is guaranteed to be kept.
+
+    The counters are a RankedCounter, so finding the minimum and
+    `most_common(n)` do not scan all counters.
+    """
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"Capacity must be positive: {capacity}")
+        self.capacity = capacity
+        self._counts = RankedCounter()
+        self._errors: dict = {}
+
+    def __len__(self):
+        return len(self._counts)
+
+    @property
+    def total(self) -> int:
+        return self._counts.total
+
+    def error(self, key) -> int:
+        return self._errors.get(key, 0)
+
+    def add(self, key, n: int = 1):
+        if key in self._counts or len(self._counts) < self.capacity:
+            self._counts.increment(key, n)
+            return
+
+        victim, floor = self._counts.least_common()
+        self._counts.pop(victim)
+        self._errors.pop(victim, None)
+        self._counts.increment(key, floor + n)
+        self._errors[key] = floor
+
+    def floor(self) -> int:
+        """Upper bound for the count of any key that is not kept."""
+        if len(self._counts) < self.capacity:
+            return 0
+        return self._counts.least_common()[1]
+
+    def update(self, other: "SpaceSaving"):
+        """
+        Merge `other` into this summary.
+
+        A key missing from a full summary may have up to that summary's
+        `floor`, which is added to its count and error before the
+        `capacity` largest counts are kept (Agarwal et al.).
+        """
+        mine, theirs = self.floor(), other.floor()
+        merged = []
+        keys = set(self._counts) | set(other._counts)
+        for key in keys:
+            count = ((self._counts[key] if key in self._counts else mine) +
+                     (other._counts[key] if key in other._counts else theirs))
+            error = (self._errors.get(key, 0 if key in self._counts else mine) +
+                     other._errors.get(key,
+                                       0 if key in other._counts else theirs))
+            merged.append((count, error, key))
+        merged.sort(key=lambda x: x[0], reverse=True)
+
+        total = self._counts.total + other._counts.total
+        self._counts = RankedCounter()
+        self._errors = {}
+        for count, error, key in merged[:self.capacity]:
+            self._counts.increment(key, count)
+            if error:
+                self._errors[key] = error
+        self._counts.total = total
+
+    def most_common(self, n: int | None = None) -> list[tuple]:
+        """Return the `n` highest (key, count) pairs, counts are bounds."""
+        return self._counts.most_common(n)
@@ -0,0 +1,238 @@
+import hashlib
+import math
+import os
+import threading
+from datetime import date, datetime, timezone
+
+from utils.segments import guild_path
+
+
+class HyperLogLog:
+    """
+    Mergeable estimate of the number of distinct values.
+
+    Keeps 2**precision one-byte registers; the standard error of `count`
+    is about 1.04 / sqrt(2**precision), e.g. 2.3% with 2 KiB at
+    precision 11. Sketches of the same precision merge losslessly, so
+    per-day sketches can be combined into any range of days.
+    """
+
+    def __init__(self, precision: int = 11, registers: bytes | None = None):
+        if not 4 <= precision <= 16:
+            raise ValueError(f"Precision out of range: {precision}")
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is not None and len(registers) != self.m:
+            raise ValueError("Register count does not match the precision")
+        self.registers = bytearray(registers or self.m)
+
+    @property
+    def error(self) -> float:
+        """Relative standard error of `count`."""
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        h = int.from_bytes(
+            hashlib.blake2b(str(value).encode("utf-8"),
+                            digest_size=8).digest(), "big")
+        bits = 64 - self.precision
+        index = h >> bits
+        rest = h & ((1 << bits) - 1)
+        rank = bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other: "HyperLogLog"):
+        """Merge `other` into this sketch."""
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small range: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def __bytes__(self):
+        return bytes(self.registers)
+
+
+class DailySketches:
+    """
+    HyperLogLog sketches of user IDs per guild, dataset and UTC day.
+
+    Guilds are loaded from `<directory>/<guild_id>/` on first use, one
+    `<dataset>.<YYYY-MM-DD>.hll` file of raw registers per day. A guild
+    without files is built by `warm` with the optional `rebuild(guild_id)`
+    callable, which yields (dataset, user_id, timestamp) tuples; `add`
+    never rebuilds, so it stays cheap on the event loop. `flush` writes
+    the sketches changed since the last flush.
+    """
+
+    def __init__(self, directory: str, precision: int = 11, rebuild=None):
+        self.directory = os.path.abspath(directory)
+        self.precision = precision
+        self.rebuild = rebuild
+        self._guilds: dict[str, dict[tuple[str, date], HyperLogLog]] = {}
+        self._dirty: set[tuple[str, str, date]] = set()
+        self._unbuilt: set[str] = set()
+        self._lock = threading.RLock()
+
+    def _guild_dir(self, guild_id: str) -> str:
+        return guild_path(self.directory, guild_id)
+
+    def _get(self, guild_id) -> dict[tuple[str, date], HyperLogLog]:
+        guild_id = str(guild_id)
+        sketches = self._guilds.get(guild_id)
+        if sketches is not None:
+            return sketches
+
+        sketches = self._guilds[guild_id] = {}
+        directory = self._guild_dir(guild_id)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                stem, ext = os.path.splitext(name)
+                dataset, _, day = stem.partition(".")
+                if ext != ".hll":
+                    continue
+                try:
+                    with open(os.path.join(directory, name), "rb") as f:
+                        sketches[(dataset, date.fromisoformat(day))] = (
+                            HyperLogLog(self.precision, f.read()))
+                except (OSError, ValueError):
+                    continue
+        elif self.rebuild is not None:
+            self._unbuilt.add(guild_id)  # Left to `warm`
+        return sketches
+
+    def warm(self, guild_id) -> bool:
+        """
+        Load a guild, building it with `rebuild` if it has no files.
+
+        A rebuild reads the guild's history, so run this in a thread, e.g.
+        at startup. It runs without the lock; sketches added meanwhile are
+        kept, as merging sketches is lossless.
+
+        Returns:
+            Whether the guild was rebuilt
+        """
+        guild_id = str(guild_id)
+        with self._lock:
+            self._get(guild_id)
+            if guild_id not in self._unbuilt:
+                return False
+
+        built: dict[tuple[str, date], HyperLogLog] = {}
+        for dataset, user_id, ts in self.rebuild(guild_id):
+            key = (dataset, ts.astimezone(timezone.utc).date())
+            sketch = built.get(key)
+            if sketch is None:
+                sketch = built[key] = HyperLogLog(self.precision)
+            sketch.add(user_id)
+
+        with self._lock:
+            if guild_id not in self._unbuilt:
+                return False
+            sketches = self._get(guild_id)
+            for key, sketch in built.items():
+                if key in sketches:
+                    sketches[key].update(sketch)
+                else:
+                    sketches[key] = sketch
+                self._dirty.add((guild_id, *key))
+            self._unbuilt.discard(guild_id)
+        return True
+
+    def _add(self, guild_id, sketches, dataset, user_id, ts: datetime):
+        day = ts.astimezone(timezone.utc).date()
+        sketch = sketches.get((dataset, day))
+        if sketch is None:
+            sketch = sketches[(dataset, day)] = HyperLogLog(self.precision)
+        sketch.add(user_id)
+        self._dirty.add((guild_id, dataset, day))
+
+    def add(self, guild_id, dataset: str, user_id, ts: datetime):
+        with self._lock:
+            guild_id = str(guild_id)
+            self._add(guild_id, self._get(guild_id), dataset, user_id, ts)
+
+    def estimate(self, guild_id, datasets, start: datetime,
+                 end: datetime | None = None) -> int:
+        """
+        Estimated distinct users of `datasets` between the days of
+        `start` and `end` (inclusive, default today).
+        """
+        first = start.astimezone(timezone.utc).date()
+        last = (end or datetime.now(timezone.utc)).astimezone(
+            timezone.utc).date()
+        self.warm(guild_id)
+        merged = HyperLogLog(self.precision)
+        with self._lock:
+            for (dataset, day), sketch in self._get(guild_id).items():
+                if dataset in datasets and first <= day <= last:
+                    merged.update(sketch)
+        return merged.count()
+
+    @property
+    def error(self) -> float:
+        return HyperLogLog(self.precision).error
+
+    def flush(self) -> int:
+        """
+        Write the sketches changed since the last flush.
+
+        Returns:
+            Number of sketch files written
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            written = 0
+            for guild_id, dataset, day in dirty:
+                sketch = self._guilds.get(guild_id, {}).get((dataset, day))
+                if sketch is None:
+                    continue
+                directory = self._guild_dir(guild_id)
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory,
+                                    f"{dataset}.{day.isoformat()}.hll")
+                with open(path + ".tmp", "wb") as f:
+                    f.write(bytes(sketch))
+                os.replace(path + ".tmp", path)
+                written += 1
+            return written
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """
+        Forget the days before the day of `cutoff`.
+
+        Returns:
+            Number of sketches removed
+        """
+        first = cutoff.astimezone(timezone.utc).date()
+        removed = 0
+        with self._lock:
+            for sketches in self._guilds.values():
+                for key in [k for k in sketches if k[1] < first]:
+                    del sketches[key]
+                    removed += 1
+            self._dirty = {d for d in self._dirty if d[2] >= first}
+
+            if os.path.isdir(self.directory):
+                for guild_id in os.listdir(self.directory):
+                    directory = os.path.join(self.directory, guild_id)
+                    if not os.path.isdir(directory):
+                        continue
+                    for name in os.listdir(directory):
+                        stem, _ = os.path.splitext(name)
+                        try:
+                            day = date.fromisoformat(stem.partition(".")[2])
+                        except ValueError:
+                            continue
+                        if day < first:
+                            os.remove(os.path.join(directory, name))
+        return removed
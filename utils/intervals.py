@@ -0,0 +1,119 @@
+try:
+    import numpy as np
+except ImportError:  # Optional, the pure Python path gives the same results
+    np = None
+
+DAY = 86_400
+WEEK = 7 * DAY
+# Shifts the epoch (a Thursday) so weekday bins start on Monday 00:00 UTC
+MONDAY_PHASE = -3 * DAY
+# Sessions per NumPy batch, bounds the (sessions x bins) temporaries
+BATCH = 65_536
+
+
+def _covered(t: int, period: int, width: int, offset: int) -> int:
+    """Seconds of [0, t) that fall into the bin starting at `offset`."""
+    return (t // period) * width + min(max(t % period - offset, 0), width)
+
+
+def periodic_seconds(starts, ends, period: int, width: int,
+                     phase: int = 0) -> list[int]:
+    """
+    Seconds of the intervals [starts[i], ends[i]) in each bin of a
+    repeating cycle, e.g. the 24 hours of a day.
+
+    Closed form per interval: every full cycle adds `width` seconds to
+    each bin, the rest is the clipped head and tail. This costs O(bins)
+    per interval however long it is, and runs batched with NumPy when it
+    is installed.
+
+    Args:
+        starts, ends: Interval bounds in epoch seconds
+        period: Length of the cycle in seconds
+        width: Length of one bin in seconds (divides `period`)
+        phase: Epoch second at which a cycle starts
+
+    Returns:
+        List of seconds per bin
+    """
+    bins = period // width
+    if np is not None:
+        offsets = np.arange(bins, dtype=np.int64) * width
+        totals = np.zeros(bins, dtype=np.int64)
+        starts = np.asarray(starts, dtype=np.int64) - phase
+        ends = np.asarray(ends, dtype=np.int64) - phase
+        for i in range(0, len(starts), BATCH):
+            s = starts[i:i + BATCH, None]
+            e = ends[i:i + BATCH, None]
+            covered = ((e // period - s // period) * width +
+                       np.clip(e % period - offsets, 0, width) -
+                       np.clip(s % period - offsets, 0, width))
+            totals += covered.sum(axis=0)
+        return totals.tolist()
+
+    totals = [0] * bins
+    for start, end in zip(starts, ends):
+        start, end = start - phase, end - phase
+        for b in range(bins):
+            totals[b] += (_covered(end, period, width, b * width) -
+                          _covered(start, period, width, b * width))
+    return totals
+
+
+def hour_seconds(starts, ends) -> list[int]:
+    """Seconds per UTC hour of the day (24 bins)."""
+    return periodic_seconds(starts, ends, DAY, 3600)
+
+
+def weekday_seconds(starts, ends) -> list[int]:
+    """Seconds per UTC weekday, Monday first (7 bins)."""
+    return periodic_seconds(starts, ends, WEEK, DAY, MONDAY_PHASE)
+
+
+def concurrency(starts, ends, start: int, end: int,
+                width: int = 3600) -> list[tuple[int, int]]:
+    """
+    How many intervals overlap, per bin of `width` seconds of the window
+    [start, end).
+
+    Sweep line: the clipped endpoints are sorted once, an end before a
+    start at the same second so back-to-back intervals do not overlap,
+    and walked while tracking the number of open intervals. O(n log n)
+    for n intervals plus O(bins).
+
+    Args:
+        starts, ends: Interval bounds in epoch seconds
+        start, end: Window in epoch seconds
+
+    Returns:
+        List of (peak, covered seconds) per bin; covered seconds divided
+        by the bin width is the average number of open intervals
+    """
+    bins = max(0, -(-(end - start) // width))
+    peaks = [0] * bins
+    seconds = [0] * bins
+
+    events = []
+    for s, e in zip(starts, ends):
+        s, e = max(s, start), min(e, end)
+        if s < e:
+            events.append((s, 1))
+            events.append((e, -1))
+    events.sort()
+
+    open_now = 0
+    t = start
+    for when, delta in events:
+        # Spread the constant count over the bins between the events
+        while t < when:
+            b = (t - start) // width
+            step = min(when, start + (b + 1) * width)
+            seconds[b] += open_now * (step - t)
+            if open_now > peaks[b]:
+                peaks[b] = open_now
+            t = step
+        open_now += delta
+        if delta > 0 and when < end:
+            b = (when - start) // width
+            peaks[b] = max(peaks[b], open_now)
+    return list(zip(peaks, seconds))
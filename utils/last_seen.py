@@ -0,0 +1,146 @@
+import csv
+import os
+import threading
+from datetime import datetime, timezone
+
+from utils.segments import guild_path
+from utils.timeutil import parse_ts
+
+LAST_SEEN_FIELDS = ["user_id", "last_seen"]
+
+
+class LastSeenIndex:
+    """
+    Last activity per guild and user.
+
+    `touch` is a dict update, so it can run on every message. Guilds are
+    loaded from `<directory>/<guild_id>.csv` on first use; a guild without
+    a file is built by `warm` with the optional `rebuild(guild_id)`
+    callable, which yields (user_id, timestamp) pairs. `checkpoint`
+    rewrites the files of the guilds that changed since the last
+    checkpoint.
+    """
+
+    def __init__(self, directory: str, rebuild=None):
+        self.directory = os.path.abspath(directory)
+        self.rebuild = rebuild
+        self._guilds: dict[str, dict[str, datetime]] = {}
+        self._dirty: set[str] = set()
+        self._unbuilt: set[str] = set()
+        self._lock = threading.RLock()
+
+    def _path(self, guild_id: str) -> str:
+        return guild_path(self.directory, guild_id, ".csv")
+
+    def _get(self, guild_id: str) -> dict[str, datetime]:
+        users = self._guilds.get(guild_id)
+        if users is not None:
+            return users
+
+        users = self._guilds[guild_id] = {}
+        path = self._path(guild_id)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        users[row["user_id"]] = parse_ts(row["last_seen"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+        elif self.rebuild is not None:
+            self._unbuilt.add(guild_id)  # Left to `warm`
+        return users
+
+    def warm(self, guild_id) -> bool:
+        """
+        Load a guild, building it with `rebuild` if it has no file.
+
+        A rebuild reads the guild's history, so run this in a thread, e.g.
+        at startup. It runs without the lock; touches made meanwhile are
+        kept, the later timestamp wins.
+
+        Returns:
+            Whether the guild was rebuilt
+        """
+        guild_id = str(guild_id)
+        with self._lock:
+            self._get(guild_id)
+            if guild_id not in self._unbuilt:
+                return False
+
+        built: dict[str, datetime] = {}
+        for user_id, ts in self.rebuild(guild_id):
+            user_id = str(user_id)
+            last = built.get(user_id)
+            if last is None or ts > last:
+                built[user_id] = ts
+
+        with self._lock:
+            if guild_id not in self._unbuilt:
+                return False
+            users = self._get(guild_id)
+            for user_id, ts in built.items():
+                self._touch(guild_id, users, user_id, ts)
+            self._unbuilt.discard(guild_id)
+        return True
+
+    def _touch(self, guild_id, users, user_id, ts: datetime):
+        last = users.get(user_id)
+        if last is None or ts > last:
+            users[user_id] = ts
+            self._dirty.add(guild_id)
+
+    def touch(self, guild_id, user_id, ts: datetime | None = None):
+        """Record activity of a user (default: now)."""
+        ts = ts or datetime.now(timezone.utc)
+        with self._lock:
+            guild_id = str(guild_id)
+            self._touch(guild_id, self._get(guild_id), str(user_id), ts)
+
+    def get(self, guild_id, user_id) -> datetime | None:
+        self.warm(guild_id)
+        with self._lock:
+            return self._get(str(guild_id)).get(str(user_id))
+
+    def inactive(self, guild_id, user_ids, cutoff: datetime) -> list[tuple]:
+        """
+        Users of `user_ids` without activity since `cutoff`.
+
+        Returns:
+            List of tuples, longest inactive first (never seen first):
+            [(user_id, last seen or None), ...]
+        """
+        self.warm(guild_id)
+        with self._lock:
+            users = self._get(str(guild_id))
+            result = []
+            for user_id in user_ids:
+                last = users.get(str(user_id))
+                if last is None or last < cutoff:
+                    result.append((str(user_id), last))
+        result.sort(key=lambda x: (x[1] is not None, x[1] or cutoff))
+        return result
+
+    def checkpoint(self) -> int:
+        """
+        Write the guilds changed since the last checkpoint.
+
+        Returns:
+            Number of guild files written
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            # Copied under the lock, written without blocking `touch`
+            snapshots = {guild_id: list(self._guilds.get(guild_id, {}).items())
+                         for guild_id in dirty}
+
+        os.makedirs(self.directory, exist_ok=True)
+        for guild_id, users in snapshots.items():
+            path = self._path(guild_id)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(LAST_SEEN_FIELDS)
+                writer.writerows([user_id, ts.isoformat()]
+                                 for user_id, ts in users)
+            os.replace(tmp_path, path)
+        return len(snapshots)
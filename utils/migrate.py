@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Offline migration and compaction of the bot's data files.
+
+Runs without Discord (and without PING_COUNT_TOKEN); stop the bot first.
+
+    python -m utils.migrate migrate --to sqlite
+    python -m utils.migrate migrate --from csv --to binary
+    python -m utils.migrate compact --backend csv
+
+Every file is streamed in batches, so memory use does not grow with the
+size of the data. After each dataset the target is re-read and its row
+count and an order-independent checksum are compared with the source.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+
+from utils.reaction_log import REACTION_FIELDS, iter_json_array
+from utils.storage import DATASETS, LOCATION_ARGS, open_storage
+from utils.timeutil import parse_ts
+
+# Single-file CSVs from before the storage backends (same names as main.py)
+LEGACY_FILES = {
+    "pings": "role_pings.csv",
+    "messages": "activity_messages.csv",
+    "voice": "activity_voice.csv",
+}
+REACTION_STATS_DIR = os.path.join("data", "reactions", "stats")
+
+CHECKSUM_MOD = 2**64
+
+
+# ---------- Checksums ----------
+
+
+def row_digest(fields: list[str], ts_fields, row: dict) -> int:
+    """
+    Hash of a row's canonical form.
+
+    Timestamps are compared as instants, so "2026-01-01T10:00:00" and
+    "2026-01-01T10:00:00+00:00" hash the same.
+    """
+    parts = []
+    for field in fields:
+        value = row[field]
+        if field in ts_fields:
+            value = parse_ts(value).isoformat()
+        parts.append(str(value))
+    digest = hashlib.blake2b("\x1f".join(parts).encode("utf-8"),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class Tally:
+    """Row count plus an order-independent checksum (sum of row hashes)."""
+
+    def __init__(self, fields: list[str], ts_fields):
+        self.fields = fields
+        self.ts_fields = ts_fields
+        self.rows = 0
+        self.checksum = 0
+
+    def add(self, row: dict):
+        self.rows += 1
+        self.checksum = (self.checksum + row_digest(
+            self.fields, self.ts_fields, row)) % CHECKSUM_MOD
+
+    def __eq__(self, other):
+        return (self.rows, self.checksum) == (other.rows, other.checksum)
+
+    def combined(self, other: "Tally") -> "Tally":
+        total = Tally(self.fields, self.ts_fields)
+        total.rows = self.rows + other.rows
+        total.checksum = (self.checksum + other.checksum) % CHECKSUM_MOD
+        return total
+
+    @classmethod
+    def of(cls, fields, ts_fields, rows) -> "Tally":
+        tally = cls(fields, ts_fields)
+        for row in rows:
+            tally.add(row)
+        return tally
+
+
+# ---------- Reporting ----------
+
+
+def report(name: str, read: int, skipped: int, seconds: float,
+           size: int | None, ok: bool):
+    rate = read / seconds if seconds > 0 else 0.0
+    line = (f"[Migrate] {name}: {read} rows read, {skipped} skipped, "
+            f"{seconds:.2f}s, {rate:,.0f} rows/s")
+    if size is not None and seconds > 0:
+        line += f", {size / seconds / 1e6:.1f} MB/s"
+    line += ", verified" if ok else ", VERIFICATION FAILED"
+    print(line)
+
+
+# ---------- Datasets ----------
+
+
+def migrate_dataset(target, dataset: str, rows, batch_size: int = 5000):
+    """
+    Stream `rows` into `target` and verify the result.
+
+    Returns:
+        Tuple (rows read, rows skipped, verified)
+    """
+    ds = DATASETS[dataset]
+    before = Tally.of(ds.fields, ds.ts_fields, target.iter_rows(dataset))
+    written = Tally(ds.fields, ds.ts_fields)
+    read = skipped = 0
+    batch = []
+
+    for row in rows:
+        read += 1
+        try:
+            row = {field: row[field] for field in ds.fields}
+            for field in ds.ts_fields:
+                row[field] = parse_ts(row[field]).isoformat()
+            batch.append(target.prepare(dataset, row))
+        except (KeyError, TypeError, ValueError) as e:
+            skipped += 1
+            print(f"[Migrate] Skipping {dataset} row {read}: {e}")
+            continue
+
+        written.add(row)
+        if len(batch) >= batch_size:
+            target.write_batch(batch)
+            batch = []
+
+    if batch:
+        target.write_batch(batch)
+
+    after = Tally.of(ds.fields, ds.ts_fields, target.iter_rows(dataset))
+    return read, skipped, after == before.combined(written)
+
+
+def migrate_legacy_file(target, dataset: str, path: str, batch_size: int,
+                        keep_source: bool) -> bool:
+    if not os.path.exists(path):
+        return True
+
+    size = os.path.getsize(path)
+    started = time.perf_counter()
+    with open(path, "r", encoding="utf-8") as f:
+        read, skipped, ok = migrate_dataset(target, dataset,
+                                            csv.DictReader(f), batch_size)
+    report(path, read, skipped, time.perf_counter() - started, size, ok)
+
+    # The bot imports legacy files on startup, so mark them as done
+    if ok and not keep_source:
+        os.replace(path, path + ".migrated")
+    return ok
+
+
+def migrate_reactions(path: str, keep_source: bool = False) -> bool:
+    """
+    Convert a `<guild>.json` reaction stats file into a `<guild>.jsonl` log.
+
+    An existing JSONL file is replaced, since the JSON file is the one the
+    bot wrote to until the switch.
+    """
+    out_path = os.path.splitext(path)[0] + ".jsonl"
+    tmp_path = out_path + ".tmp"
+    source = Tally(REACTION_FIELDS, ("timestamp", ))
+    read = skipped = 0
+    started = time.perf_counter()
+
+    with open(path, "r", encoding="utf-8") as f, \
+            open(tmp_path, "w", encoding="utf-8") as out:
+        for entry in iter_json_array(f, "reactions"):
+            read += 1
+            try:
+                entry = {field: str(entry[field]) for field in REACTION_FIELDS}
+                entry["timestamp"] = parse_ts(entry["timestamp"]).isoformat()
+            except (KeyError, TypeError, ValueError) as e:
+                skipped += 1
+                print(f"[Migrate] Skipping reaction {read} in {path}: {e}")
+                continue
+            source.add(entry)
+            out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    with open(tmp_path, "r", encoding="utf-8") as f:
+        result = Tally.of(REACTION_FIELDS, ("timestamp", ),
+                          (json.loads(line) for line in f if line.strip()))
+    ok = result == source
+    if ok:
+        os.replace(tmp_path, out_path)
+    else:
+        os.remove(tmp_path)
+
+    report(path, read, skipped, time.perf_counter() - started,
+           os.path.getsize(path), ok)
+
+    # The bot imports a remaining <guild>.json over the log, so mark it done
+    if ok and not keep_source:
+        os.replace(path, path + ".migrated")
+    return ok
+
+
+# ---------- Commands ----------
+
+
+def open_target(kind: str, location: str | None):
+    kwargs = {LOCATION_ARGS[kind]: location} if location else {}
+    return open_storage(kind, **kwargs)
+
+
+def cmd_migrate(args) -> bool:
+    datasets = args.datasets.split(",")
+    target = open_target(args.to, args.target)
+    ok = True
+
+    if args.source_backend == "legacy":
+        for dataset in datasets:
+            if dataset in LEGACY_FILES:
+                path = os.path.join(args.source, LEGACY_FILES[dataset])
+                ok &= migrate_legacy_file(target, dataset, path, args.batch,
+                                          args.keep_sources)
+    else:
+        source = open_target(args.source_backend, args.source_location)
+        if source.location == target.location:
+            print("[Migrate] Source and target are the same")
+            return False
+        for dataset in datasets:
+            if dataset not in DATASETS:
+                continue
+            started = time.perf_counter()
+            read, skipped, verified = migrate_dataset(
+                target, dataset, source.iter_rows(dataset), args.batch)
+            report(f"{args.source_backend}:{dataset}", read, skipped,
+                   time.perf_counter() - started, None, verified)
+            ok &= verified
+
+    if "reactions" in datasets:
+        stats_dir = os.path.join(args.source, REACTION_STATS_DIR)
+        if os.path.isdir(stats_dir):
+            for name in sorted(os.listdir(stats_dir)):
+                if name.endswith(".json"):
+                    ok &= migrate_reactions(os.path.join(stats_dir, name),
+                                            args.keep_sources)
+
+    return ok
+
+
+def cmd_compact(args) -> bool:
+    storage = open_target(args.backend, args.target)
+    started = time.perf_counter()
+    removed = storage.compact()
+    print(f"[Migrate] Compacted {args.backend}: {removed} rows removed "
+          f"in {time.perf_counter() - started:.2f}s")
+    return True
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.migrate",
+        description="Convert or compact the bot's data files offline.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate", help="Copy data into another storage backend")
+    migrate.add_argument("--to",
+                         choices=sorted(LOCATION_ARGS),
+                         required=True,
+                         help="Target storage backend")
+    migrate.add_argument("--target",
+                         help="Target directory (csv, binary) or file (sqlite)")
+    migrate.add_argument("--from", dest="source_backend", default="legacy",
+                         choices=["legacy"] + sorted(LOCATION_ARGS),
+                         help="Read single-file CSVs (default) or a backend")
+    migrate.add_argument("--source-location",
+                         help="Location of the source backend")
+    migrate.add_argument("--source", default=".",
+                         help="Directory with the legacy files")
+    migrate.add_argument("--datasets",
+                         default="pings,messages,voice,reactions",
+                         help="Comma-separated datasets to migrate")
+    migrate.add_argument("--batch", type=int, default=5000,
+                         help="Rows written per batch")
+    migrate.add_argument("--keep-sources", action="store_true",
+                         help="Do not rename legacy files to *.migrated")
+    migrate.set_defaults(func=cmd_migrate)
+
+    compact = commands.add_parser(
+        "compact", help="Fold pending deletions into the data files")
+    compact.add_argument("--backend", choices=sorted(LOCATION_ARGS),
+                         default="csv")
+    compact.add_argument("--target",
+                         help="Directory (csv, binary) or file (sqlite)")
+    compact.set_defaults(func=cmd_compact)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    return 0 if args.func(args) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
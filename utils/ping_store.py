@@ -0,0 +1,261 @@
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timezone, timedelta
+
+from utils.ranked_counter import RankedCounter
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+MAX_SNOWFLAKE = 2**63 - 1
+
+
+def to_epoch_us(ts: datetime) -> int:
+    """Convert a datetime to integer microseconds since the epoch (naive = UTC)."""
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return (ts - EPOCH) // MICROSECOND
+
+
+def from_epoch_us(us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=us)
+
+
+class PingAggregates:
+    """
+    Materialized ping counts, updated in O(1) per ping.
+
+    - by_role:     guild -> role -> RankedCounter(user)
+    - by_user:     guild -> user -> RankedCounter(role)
+    - role_totals: guild -> RankedCounter(role)
+    """
+
+    def __init__(self):
+        self.by_role: dict[int, dict[int, RankedCounter]] = {}
+        self.by_user: dict[int, dict[int, RankedCounter]] = {}
+        self.role_totals: dict[int, RankedCounter] = {}
+
+    def add(self, guild, role, user, n: int = 1):
+        self.by_role.setdefault(guild, {}).setdefault(
+            role, RankedCounter()).increment(user, n)
+        self.by_user.setdefault(guild, {}).setdefault(
+            user, RankedCounter()).increment(role, n)
+        self.role_totals.setdefault(guild, RankedCounter()).increment(role, n)
+
+    def remove(self, guild, role, user, n: int = 1):
+        self._decrement(self.by_role, guild, role, user, n)
+        self._decrement(self.by_user, guild, user, role, n)
+        totals = self.role_totals.get(guild)
+        if totals is not None:
+            totals.decrement(role, n)
+
+    @staticmethod
+    def _decrement(index, guild, outer, inner, n):
+        counters = index.get(guild, {})
+        counter = counters.get(outer)
+        if counter is None:
+            return
+        counter.decrement(inner, n)
+        if not counter:
+            del counters[outer]
+
+    def drop_role(self, guild, role):
+        users = self.by_role.get(guild, {}).pop(role, None)
+        if users is None:
+            return
+        for user, n in list(users.items()):
+            self._decrement(self.by_user, guild, user, role, n)
+        self.role_totals[guild].pop(role)
+
+    def drop_user(self, guild, user):
+        roles = self.by_user.get(guild, {}).pop(user, None)
+        if roles is None:
+            return
+        for role, n in list(roles.items()):
+            self._decrement(self.by_role, guild, role, user, n)
+            self.role_totals[guild].decrement(role, n)
+
+
+class PingStore:
+    """
+    Column-oriented in-memory copy of the role ping data.
+
+    Every column is an `array` of 64-bit integers: Discord snowflakes are
+    stored as-is, timestamps as epoch microseconds. IDs that are not
+    numeric (old test data, hand-edited files) are interned and stored as
+    negative codes so they still round-trip.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.clear()
+
+    def clear(self):
+        self.aggregates = PingAggregates()
+        self.guild_ids = array("q")
+        self.role_ids = array("q")
+        self.user_ids = array("q")
+        self.channel_ids = array("q")
+        self.timestamps = array("q")
+        self.ordered = True  # Timestamps never decrease
+        self._codes: dict[str, int] = {}
+        self._names: list[str] = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    # ---------- ID encoding ----------
+
+    def encode_id(self, value) -> int:
+        text = str(value)
+        if text.isdigit() and int(text) <= MAX_SNOWFLAKE:
+            return int(text)
+
+        code = self._codes.get(text)
+        if code is None:
+            self._names.append(text)
+            code = -len(self._names)
+            self._codes[text] = code
+        return code
+
+    def lookup_id(self, value) -> int | None:
+        """Like `encode_id`, but returns None for unknown non-numeric IDs."""
+        text = str(value)
+        if text.isdigit() and int(text) <= MAX_SNOWFLAKE:
+            return int(text)
+        return self._codes.get(text)
+
+    def decode_id(self, code: int) -> str:
+        return str(code) if code >= 0 else self._names[-code - 1]
+
+    # ---------- Loading / appending ----------
+
+    def load(self, rows, source=None):
+        """
+        Replace the store contents with `rows` (CSV-style dictionaries).
+
+        Args:
+            rows: Iterable of ping rows
+            source: Identifies where the rows came from (kept in `path`)
+        """
+        self.clear()
+        self.path = source
+
+        for row in rows:
+            try:
+                ts = datetime.fromisoformat(row["timestamp"])
+            except (TypeError, ValueError) as e:
+                print(f"[PingStore] Skipping row with bad timestamp: {e}")
+                continue
+            self.append(row["guild_id"], row["role_id"], row["user_id"],
+                        row["channel_id"], ts)
+
+    def append(self, guild_id, role_id, user_id, channel_id, ts: datetime):
+        guild = self.encode_id(guild_id)
+        role = self.encode_id(role_id)
+        user = self.encode_id(user_id)
+        self.guild_ids.append(guild)
+        self.role_ids.append(role)
+        self.user_ids.append(user)
+        self.channel_ids.append(self.encode_id(channel_id))
+        ts_us = to_epoch_us(ts)
+        if self.timestamps and ts_us < self.timestamps[-1]:
+            self.ordered = False
+        self.timestamps.append(ts_us)
+        self.aggregates.add(guild, role, user)
+
+    def rows(self):
+        """Yield the stored pings as CSV-style dictionaries."""
+        decode = self.decode_id
+        for g, r, u, c, ts in zip(self.guild_ids, self.role_ids,
+                                  self.user_ids, self.channel_ids,
+                                  self.timestamps):
+            yield {
+                "guild_id": decode(g),
+                "role_id": decode(r),
+                "user_id": decode(u),
+                "channel_id": decode(c),
+                "timestamp": from_epoch_us(ts).isoformat()
+            }
+
+    # ---------- Queries ----------
+
+    def _decode_counts(self, counter: RankedCounter | None, limit=None):
+        if counter is None:
+            return []
+        return [(self.decode_id(k), n) for k, n in counter.most_common(limit)]
+
+    def top_for_role(self, guild_id, role_id, limit=10):
+        guild = self.lookup_id(guild_id)
+        role = self.lookup_id(role_id)
+        roles = self.aggregates.by_role.get(guild, {})
+        return self._decode_counts(roles.get(role), limit)
+
+    def counts_for_user(self, guild_id, user_id):
+        guild = self.lookup_id(guild_id)
+        user = self.lookup_id(user_id)
+        users = self.aggregates.by_user.get(guild, {})
+        return self._decode_counts(users.get(user))
+
+    def top_roles(self, guild_id, limit=None):
+        """Return [(role_id, total_pings), ...] for one guild."""
+        guild = self.lookup_id(guild_id)
+        return self._decode_counts(self.aggregates.role_totals.get(guild),
+                                   limit)
+
+    # ---------- Deletes ----------
+
+    def _keep(self, mask) -> int:
+        """Keep only rows whose mask entry is true, returns rows removed."""
+        before = len(self)
+        for name in ("guild_ids", "role_ids", "user_ids", "channel_ids",
+                     "timestamps"):
+            column = getattr(self, name)
+            setattr(self, name,
+                    array("q", (v for v, keep in zip(column, mask) if keep)))
+        return before - len(self)
+
+    def remove_role(self, guild_id, role_id) -> int:
+        guild = self.lookup_id(guild_id)
+        role = self.lookup_id(role_id)
+        if role not in self.aggregates.by_role.get(guild, {}):
+            return 0
+
+        self.aggregates.drop_role(guild, role)
+        return self._keep([
+            not (g == guild and r == role)
+            for g, r in zip(self.guild_ids, self.role_ids)
+        ])
+
+    def remove_user(self, guild_id, user_id) -> int:
+        guild = self.lookup_id(guild_id)
+        user = self.lookup_id(user_id)
+        if user not in self.aggregates.by_user.get(guild, {}):
+            return 0
+
+        self.aggregates.drop_user(guild, user)
+        return self._keep([
+            not (g == guild and u == user)
+            for g, u in zip(self.guild_ids, self.user_ids)
+        ])
+
+    def remove_older_than(self, cutoff: datetime) -> int:
+        cutoff_us = to_epoch_us(cutoff)
+        if self.ordered:
+            # Pings are appended in time order, so old ones are a prefix
+            n = bisect_left(self.timestamps, cutoff_us)
+            for g, r, u in zip(self.guild_ids[:n], self.role_ids[:n],
+                               self.user_ids[:n]):
+                self.aggregates.remove(g, r, u)
+            for name in ("guild_ids", "role_ids", "user_ids", "channel_ids",
+                         "timestamps"):
+                del getattr(self, name)[:n]
+            return n
+
+        mask = [ts >= cutoff_us for ts in self.timestamps]
+
+        for keep, g, r, u in zip(mask, self.guild_ids, self.role_ids,
+                                 self.user_ids):
+            if not keep:
+                self.aggregates.remove(g, r, u)
+
+        return self._keep(mask)
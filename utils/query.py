@@ -0,0 +1,379 @@
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timezone
+
+from utils.intervals import DAY, concurrency, hour_seconds, weekday_seconds
+from utils.rollups import ROLLUP_KEYS, TOP_FIELDS
+from utils.storage import DATASETS, TIME_KEYS
+from utils.timeutil import parse_ts
+
+# Time keys of queries: the storage ones plus "weekday" (0 = Monday)
+QUERY_TIME_KEYS = TIME_KEYS + ("weekday", )
+# Overlap keys split by utils.intervals
+PERIODIC_KEYS = {"hour": hour_seconds, "weekday": weekday_seconds}
+
+
+class Aggregation(ABC):
+    """
+    One result computed by a Query.
+
+    Args:
+        name: Key of the result in the dictionary returned by `execute`
+        key: Field, "hour", "day", "weekday" or a tuple of those to group
+             by; None
+             for a single total
+        since: Only rows whose `since_field` is at or after this count
+        since_field: Timestamp column for `since` (default: the dataset's
+                     window column)
+    """
+
+    def __init__(self,
+                 name: str,
+                 key=None,
+                 since: datetime | None = None,
+                 since_field: str | None = None):
+        self.name = name
+        self.key = key
+        self.since = since
+        self.since_field = since_field
+
+    def empty(self):
+        return Counter() if self.key is not None else 0
+
+    def group(self, row: dict, times: dict, ts_field: str):
+        keys = self.key if isinstance(self.key, tuple) else (self.key, )
+        values = []
+        for k in keys:
+            if k == "hour":
+                values.append(times[ts_field].hour)
+            elif k == "day":
+                values.append(times[ts_field].date())
+            elif k == "weekday":
+                values.append(times[ts_field].weekday())
+            else:
+                values.append(row[k])
+        return tuple(values) if len(keys) > 1 else values[0]
+
+    @abstractmethod
+    def add(self, result, row: dict, times: dict, query: "Query"):
+        """Fold one row into `result` and return the new result."""
+
+    def finish(self, result):
+        return result
+
+
+class Count(Aggregation):
+    """Number of rows."""
+
+    def add(self, result, row, times, query):
+        if self.key is None:
+            return result + 1
+        result[self.group(row, times, query.ts_field)] += 1
+        return result
+
+
+class Sum(Aggregation):
+    """Sum of an integer column."""
+
+    def __init__(self, name: str, field: str, key=None, since=None,
+                 since_field=None):
+        super().__init__(name, key, since, since_field)
+        self.field = field
+
+    def add(self, result, row, times, query):
+        value = int(row[self.field])
+        if self.key is None:
+            return result + value
+        result[self.group(row, times, query.ts_field)] += value
+        return result
+
+
+class Distinct(Aggregation):
+    """Number of different values of a column."""
+
+    def __init__(self, name: str, field: str, since=None, since_field=None):
+        super().__init__(name, None, since, since_field)
+        self.field = field
+
+    def empty(self):
+        return set()
+
+    def add(self, result, row, times, query):
+        result.add(row[self.field])
+        return result
+
+    def finish(self, result):
+        return len(result)
+
+
+class Top(Aggregation):
+    """
+    The `n` most frequent values of a column as [(value, count), ...].
+
+    Answered from the rollup's daily Space-Saving summaries for messages,
+    where counts of large guilds are upper bounds.
+    """
+
+    def __init__(self, name: str, field: str, n: int, since=None,
+                 since_field=None):
+        super().__init__(name, field, since, since_field)
+        self.n = n
+
+    def add(self, result, row, times, query):
+        result[row[self.key]] += 1
+        return result
+
+    def finish(self, result):
+        return result.most_common(self.n)
+
+
+class Overlap(Aggregation):
+    """
+    Seconds of voice sessions inside the query window.
+
+    Sessions are clipped to [start, end) of the query. With key "hour"
+    or "weekday", optionally after a field as in ("channel_id", "hour"),
+    the clipped sessions are collected as epoch seconds and split across
+    the UTC hours/weekdays they cover in one batch by utils.intervals.
+    """
+
+    def _periodic(self) -> str | None:
+        keys = self.key if isinstance(self.key, tuple) else (self.key, )
+        return keys[-1] if keys[-1] in PERIODIC_KEYS else None
+
+    def empty(self):
+        if self._periodic() is None:
+            return super().empty()
+        return {}  # group -> ([starts], [ends])
+
+    def add(self, result, row, times, query):
+        start = times["joined_at"]
+        end = times["left_at"]
+        if query.start is not None:
+            start = max(start, query.start)
+        if query.end is not None:
+            end = min(end, query.end)
+        if end <= start:
+            return result
+
+        if self._periodic() is None:
+            seconds = int((end - start).total_seconds())
+            if self.key is None:
+                return result + seconds
+            if seconds > 0:
+                result[self.group(row, times, query.ts_field)] += seconds
+            return result
+
+        group = row[self.key[0]] if isinstance(self.key, tuple) else None
+        starts, ends = result.setdefault(group, ([], []))
+        starts.append(int(start.timestamp()))
+        ends.append(int(end.timestamp()))
+        return result
+
+    def finish(self, result):
+        split = PERIODIC_KEYS.get(self._periodic())
+        if split is None:
+            return result
+        totals = Counter()
+        for group, (starts, ends) in result.items():
+            for b, seconds in enumerate(split(starts, ends)):
+                if seconds:
+                    totals[b if group is None else (group, b)] += seconds
+        return totals
+
+
+class Concurrency(Aggregation):
+    """
+    Concurrent voice sessions per UTC day and hour of [start, end).
+
+    The sessions are collected per group and fed to the sweep line of
+    utils.intervals.concurrency. The window is given here rather than
+    taken from the query, whose window is on left_at; query with
+    start=`start` to read every session that overlaps it.
+
+    Result: {group: {day: [(peak, seconds) per hour]}}, group is None
+    without a key. Seconds / 3600 is the average number of sessions.
+    """
+
+    def __init__(self, name: str, start: datetime, end: datetime,
+                 key=None):
+        super().__init__(name, key)
+        self.start = start
+        self.end = end
+
+    def empty(self):
+        return {}  # group -> ([starts], [ends])
+
+    def add(self, result, row, times, query):
+        group = None if self.key is None else row[self.key]
+        starts, ends = result.setdefault(group, ([], []))
+        starts.append(int(times["joined_at"].timestamp()))
+        ends.append(int(times["left_at"].timestamp()))
+        return result
+
+    def finish(self, result):
+        # Whole UTC days, so every day has its 24 hours
+        first = int(self.start.timestamp()) // DAY * DAY
+        last = -(-int(self.end.timestamp()) // DAY) * DAY
+        profiles = {}
+        for group, (starts, ends) in result.items():
+            hours = concurrency(starts, ends, first, last)
+            days = profiles[group] = {}
+            for i in range((last - first) // DAY):
+                day = datetime.fromtimestamp(first + i * DAY,
+                                             timezone.utc).date()
+                days[day] = hours[i * 24:i * 24 + 24]
+        return profiles
+
+
+class Query:
+    """
+    Aggregations over one dataset of one guild.
+
+    Rows are read from the window [start, end) of the dataset's window
+    column, optionally restricted to rows whose fields equal `filters`.
+    """
+
+    def __init__(self,
+                 dataset: str,
+                 guild_id,
+                 aggregations: list[Aggregation],
+                 start: datetime | None = None,
+                 end: datetime | None = None,
+                 filters: dict | None = None):
+        self.dataset = dataset
+        self.guild_id = str(guild_id)
+        self.aggregations = list(aggregations)
+        self.start = start
+        self.end = end
+        self.filters = dict(filters or {})
+
+    @property
+    def ts_field(self) -> str:
+        return DATASETS[self.dataset].ts_field
+
+
+def _rollup_can_answer(query: Query) -> bool:
+    if query.dataset != "messages" or query.filters:
+        return False
+    for agg in query.aggregations:
+        keys = agg.key if isinstance(agg.key, tuple) else (agg.key, )
+        if agg.since_field not in (None, query.ts_field):
+            return False
+        if type(agg) is Distinct:
+            if agg.field not in ("channel_id", "user_id"):
+                return False
+        elif type(agg) is Top:
+            if agg.key not in TOP_FIELDS:
+                return False
+        elif type(agg) is not Count:
+            return False
+        if agg.key is not None and not all(k in ROLLUP_KEYS for k in keys):
+            return False
+    return True
+
+
+def _start(query: Query, agg: Aggregation) -> datetime | None:
+    if agg.since is None:
+        return query.start
+    return agg.since if query.start is None else max(query.start, agg.since)
+
+
+def _from_rollup(query: Query, rollup) -> dict:
+    results = {}
+    for agg in query.aggregations:
+        start = _start(query, agg)
+        if type(agg) is Distinct:
+            results[agg.name] = len(
+                rollup.count_by(query.guild_id, agg.field, start, query.end))
+        elif type(agg) is Top:
+            results[agg.name] = rollup.top(query.guild_id, agg.key, agg.n,
+                                           start, query.end)
+        elif agg.key is None:
+            results[agg.name] = rollup.count(query.guild_id, start, query.end)
+        else:
+            results[agg.name] = rollup.count_by(query.guild_id, agg.key,
+                                                start, query.end)
+    return results
+
+
+def _storage_can_count(query: Query, agg: Aggregation, storage) -> bool:
+    if not storage.native_counts or query.filters:
+        return False
+    if agg.since_field not in (None, query.ts_field):
+        return False
+    fields = DATASETS[query.dataset].fields
+    if type(agg) is Distinct:
+        return agg.field in fields
+    if type(agg) is not Count:
+        return False
+    keys = agg.key if isinstance(agg.key, tuple) else (agg.key, )
+    return agg.key is None or all(k in TIME_KEYS or k in fields
+                                  for k in keys)
+
+
+def _from_storage(query: Query, agg: Aggregation, storage):
+    start = _start(query, agg)
+    if type(agg) is Distinct:
+        return len(storage.count_by(query.dataset, query.guild_id,
+                                    agg.field, start, query.end))
+    if agg.key is None:
+        return storage.count(query.dataset, query.guild_id, start, query.end)
+    return storage.count_by(query.dataset, query.guild_id, agg.key, start,
+                            query.end)
+
+
+def execute(query: Query, storage, rollup=None) -> dict:
+    """
+    Compute all aggregations of `query`.
+
+    Message counts are answered from the hourly `rollup` when it can
+    serve every aggregation. Otherwise counts and distinct counts go to
+    the backend's own `count`/`count_by` if it has them (`native_counts`),
+    and the rows for the remaining aggregations are streamed from
+    `storage` once, parsing each timestamp column once per row.
+
+    Returns:
+        Dictionary: {aggregation name: result}
+    """
+    if rollup is not None and _rollup_can_answer(query):
+        return _from_rollup(query, rollup)
+
+    ds = DATASETS[query.dataset]
+    for agg in query.aggregations:
+        keys = agg.key if isinstance(agg.key, tuple) else (agg.key, )
+        for k in keys:
+            if (k is not None and k not in QUERY_TIME_KEYS
+                    and k not in ds.fields):
+                raise ValueError(f"Unknown key {k!r} for {query.dataset}")
+
+    counted = {
+        agg.name: _from_storage(query, agg, storage)
+        for agg in query.aggregations
+        if _storage_can_count(query, agg, storage)
+    }
+    streamed = [agg for agg in query.aggregations if agg.name not in counted]
+
+    results = {agg.name: agg.empty() for agg in streamed}
+    filters = query.filters.items()
+    rows = storage.iter_rows(query.dataset, query.guild_id, query.start,
+                             query.end) if streamed else ()
+    for row in rows:
+        if any(row[field] != str(value) for field, value in filters):
+            continue
+        try:
+            times = {field: parse_ts(row[field]) for field in ds.ts_fields}
+        except (TypeError, ValueError):
+            continue
+
+        for agg in streamed:
+            if agg.since is not None and times[agg.since_field
+                                               or ds.ts_field] < agg.since:
+                continue
+            results[agg.name] = agg.add(results[agg.name], row, times, query)
+
+    return {
+        agg.name: (counted[agg.name] if agg.name in counted else
+                   agg.finish(results[agg.name]))
+        for agg in query.aggregations
+    }
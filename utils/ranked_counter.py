@@ -0,0 +1,142 @@
+class _Bucket:
+    __slots__ = ("count", "keys", "higher", "lower")
+
+    def __init__(self, count: int):
+        self.count = count
+        self.keys: dict = {}  # used as an insertion-ordered set
+        self.higher: "_Bucket | None" = None
+        self.lower: "_Bucket | None" = None
+
+
+class RankedCounter:
+    """
+    Counter that keeps its keys ordered by count at all times.
+
+    Keys live in buckets (one per distinct count) that form a doubly
+    linked list from the highest to the lowest count. Changing a count by
+    one moves the key to a neighbouring bucket in O(1), and `most_common(n)`
+    walks the list from the top, so it costs O(n) instead of O(keys).
+    """
+
+    def __init__(self):
+        self._counts: dict = {}
+        self._buckets: dict[int, _Bucket] = {}
+        self._top: _Bucket | None = None
+        self._bottom: _Bucket | None = None
+        self.total = 0
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, key):
+        return key in self._counts
+
+    def __getitem__(self, key) -> int:
+        return self._counts.get(key, 0)
+
+    def __iter__(self):
+        return iter(self._counts)
+
+    def items(self):
+        return self._counts.items()
+
+    # ---------- Bucket list ----------
+
+    def _bucket_for(self, count: int, hint: _Bucket | None) -> _Bucket:
+        """Return the bucket for `count`, creating it next to `hint`."""
+        bucket = self._buckets.get(count)
+        if bucket is not None:
+            return bucket
+
+        if hint is None:
+            lower, higher = None, self._bottom
+        elif hint.count < count:
+            lower, higher = hint, hint.higher
+        else:
+            lower, higher = hint.lower, hint
+
+        while higher is not None and higher.count < count:
+            lower, higher = higher, higher.higher
+        while lower is not None and lower.count > count:
+            lower, higher = lower.lower, lower
+
+        bucket = _Bucket(count)
+        bucket.lower, bucket.higher = lower, higher
+        if lower is None:
+            self._bottom = bucket
+        else:
+            lower.higher = bucket
+        if higher is None:
+            self._top = bucket
+        else:
+            higher.lower = bucket
+
+        self._buckets[count] = bucket
+        return bucket
+
+    def _unlink(self, bucket: _Bucket):
+        if bucket.higher is None:
+            self._top = bucket.lower
+        else:
+            bucket.higher.lower = bucket.lower
+        if bucket.lower is None:
+            self._bottom = bucket.higher
+        else:
+            bucket.lower.higher = bucket.higher
+        del self._buckets[bucket.count]
+
+    def _set(self, key, old: int, new: int):
+        old_bucket = self._buckets.get(old) if old > 0 else None
+
+        if new > 0:
+            self._bucket_for(new, old_bucket).keys[key] = None
+            self._counts[key] = new
+        else:
+            self._counts.pop(key, None)
+
+        if old_bucket is not None:
+            del old_bucket.keys[key]
+            if not old_bucket.keys:
+                self._unlink(old_bucket)
+
+    # ---------- Public API ----------
+
+    def increment(self, key, n: int = 1):
+        old = self._counts.get(key, 0)
+        self._set(key, old, old + n)
+        self.total += n
+
+    def decrement(self, key, n: int = 1):
+        """Lower the count of `key`, removing it once it reaches zero."""
+        old = self._counts.get(key, 0)
+        if old == 0:
+            return
+        new = max(old - n, 0)
+        self._set(key, old, new)
+        self.total -= old - new
+
+    def pop(self, key) -> int:
+        """Remove `key` completely and return its former count."""
+        old = self._counts.get(key, 0)
+        if old:
+            self._set(key, old, 0)
+            self.total -= old
+        return old
+
+    def least_common(self) -> tuple | None:
+        """Return one (key, count) with the lowest count, or None if empty."""
+        if self._bottom is None:
+            return None
+        return next(iter(self._bottom.keys)), self._bottom.count
+
+    def most_common(self, n: int | None = None) -> list[tuple]:
+        """Return the `n` highest counts as [(key, count), ...]."""
+        result = []
+        bucket = self._top
+        while bucket is not None:
+            for key in bucket.keys:
+                if n is not None and len(result) >= n:
+                    return result
+                result.append((key, bucket.count))
+            bucket = bucket.lower
+        return result
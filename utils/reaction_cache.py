@@ -0,0 +1,266 @@
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+from utils.ping_store import MAX_SNOWFLAKE, from_epoch_us, to_epoch_us
+from utils.reaction_log import ReactionLogs
+from utils.timeutil import parse_ts
+from utils.write_queue import WriteBehindQueue
+
+
+class GuildReactions:
+    """
+    The reactions of one guild as parallel int64 columns.
+
+    Snowflakes are stored as-is and timestamps as epoch microseconds.
+    Emoji and IDs that are not numeric are interned and stored as
+    negative codes, like in PingStore.
+    """
+
+    def __init__(self):
+        self.message_ids = array("q")
+        self.user_ids = array("q")
+        self.emojis = array("q")
+        self.timestamps = array("q")
+        self.ordered = True  # Timestamps never decrease
+        self._codes: dict[str, int] = {}
+        self._names: list[str] = []
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _encode(self, value, numeric: bool = True) -> int:
+        text = str(value)
+        if numeric and text.isdigit() and int(text) <= MAX_SNOWFLAKE:
+            return int(text)
+
+        code = self._codes.get(text)
+        if code is None:
+            self._names.append(text)
+            code = -len(self._names)
+            self._codes[text] = code
+        return code
+
+    def _lookup(self, value, numeric: bool = True) -> int | None:
+        """Like `_encode`, but returns None for unknown names."""
+        text = str(value)
+        if numeric and text.isdigit() and int(text) <= MAX_SNOWFLAKE:
+            return int(text)
+        return self._codes.get(text)
+
+    def _decode(self, code: int) -> str:
+        return str(code) if code >= 0 else self._names[-code - 1]
+
+    def add(self, entry: dict):
+        self.message_ids.append(self._encode(entry["message_id"]))
+        self.user_ids.append(self._encode(entry["user_id"]))
+        self.emojis.append(self._encode(entry["emoji"], numeric=False))
+        ts = to_epoch_us(parse_ts(entry["timestamp"]))
+        if self.timestamps and ts < self.timestamps[-1]:
+            self.ordered = False
+        self.timestamps.append(ts)
+
+    def entries(self) -> list[dict]:
+        decode = self._decode
+        return [{
+            "message_id": decode(m),
+            "user_id": decode(u),
+            "emoji": decode(e),
+            "timestamp": from_epoch_us(ts).isoformat()
+        } for m, u, e, ts in zip(self.message_ids, self.user_ids,
+                                 self.emojis, self.timestamps)]
+
+    def user_counts(self) -> Counter:
+        """Number of reactions per user ID."""
+        return Counter({
+            self._decode(user): n
+            for user, n in Counter(self.user_ids).items()
+        })
+
+    def remove(self, message_id, user_id, emoji) -> bool:
+        """Drop the latest reaction matching all three, if any."""
+        message = self._lookup(message_id)
+        user = self._lookup(user_id)
+        emoji_code = self._lookup(emoji, numeric=False)
+        if message is None or user is None or emoji_code is None:
+            return False
+
+        for i in range(len(self) - 1, -1, -1):
+            if (self.message_ids[i] == message and self.user_ids[i] == user
+                    and self.emojis[i] == emoji_code):
+                for column in (self.message_ids, self.user_ids, self.emojis,
+                               self.timestamps):
+                    del column[i]
+                return True
+        return False
+
+    def prune_before(self, cutoff: datetime) -> int:
+        cutoff_us = to_epoch_us(cutoff)
+        columns = ("message_ids", "user_ids", "emojis", "timestamps")
+        if self.ordered:
+            # Reactions are appended in time order, old ones are a prefix
+            n = bisect_left(self.timestamps, cutoff_us)
+            for name in columns:
+                del getattr(self, name)[:n]
+            return n
+
+        keep = [ts >= cutoff_us for ts in self.timestamps]
+        for name in columns:
+            column = getattr(self, name)
+            setattr(self, name,
+                    array("q", (v for v, k in zip(column, keep) if k)))
+        return len(keep) - len(self)
+
+    def nbytes(self) -> int:
+        """Approximate memory used by the columns and interned names."""
+        columns = 4 * len(self) * self.timestamps.itemsize
+        return columns + sum(len(name) + 100 for name in self._names)
+
+
+class ReactionCache:
+    """
+    In-memory reactions per guild in front of the JSONL logs.
+
+    Guilds are loaded from their log on first use and kept in LRU order;
+    idle guilds are evicted once the cached columns exceed `max_bytes`.
+    New reactions update the cache right away and are queued in a
+    WriteBehindQueue keyed by guild, so they reach the log in batches.
+    """
+
+    def __init__(self,
+                 logs: ReactionLogs,
+                 max_bytes: int = 32 * 1024 * 1024,
+                 flush_interval: float = 5.0):
+        self.logs = logs
+        self.max_bytes = max_bytes
+        self.write_queue = WriteBehindQueue(flush_interval=flush_interval,
+                                            writer=self._write)
+        self._guilds: OrderedDict[str, GuildReactions] = OrderedDict()
+        self._lock = threading.RLock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _write(self, guild_id: str, _header, entries: list):
+        self.logs.get(guild_id).append_many(entries)
+
+    # ---------- Cache management ----------
+
+    def _get(self, guild_id) -> GuildReactions:
+        key = str(guild_id)
+        with self._lock:
+            cached = self._guilds.get(key)
+            if cached is not None:
+                self._guilds.move_to_end(key)
+                self.hits += 1
+                return cached
+
+            # Queued reactions must be on disk before the log is read
+            self.write_queue.flush()
+            cached = GuildReactions()
+            for entry in self.logs.get(key).entries():
+                try:
+                    cached.add(entry)
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"[ReactionCache] Skipping bad entry: {e}")
+
+            self._guilds[key] = cached
+            self.misses += 1
+            self._evict()
+            return cached
+
+    def _evict(self):
+        total = sum(g.nbytes() for g in self._guilds.values())
+        while total > self.max_bytes and len(self._guilds) > 1:
+            _key, evicted = self._guilds.popitem(last=False)
+            total -= evicted.nbytes()
+            self.evictions += 1
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(g.nbytes() for g in self._guilds.values())
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self._guilds),
+            "bytes": self.nbytes(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "pending": self.write_queue.depth,
+        }
+
+    # ---------- Lifecycle ----------
+
+    def start(self):
+        """Start timed flushing on the running event loop."""
+        self.write_queue.start()
+
+    async def stop(self):
+        await self.write_queue.stop()
+
+    def flush(self) -> int:
+        return self.write_queue.flush()
+
+    # ---------- Reactions ----------
+
+    def append(self, guild_id, entry: dict):
+        with self._lock:
+            self._get(guild_id).add(entry)
+            self.write_queue.enqueue(str(guild_id), None, entry)
+
+    def remove(self, guild_id, message_id, user_id, emoji) -> bool:
+        """
+        Forget a reaction that was taken back.
+
+        Returns:
+            True if a matching reaction was recorded
+        """
+        with self._lock:
+            if not self._get(guild_id).remove(message_id, user_id, emoji):
+                return False
+            self.write_queue.enqueue(
+                str(guild_id), None, {
+                    "op": "remove",
+                    "message_id": str(message_id),
+                    "user_id": str(user_id),
+                    "emoji": str(emoji)
+                })
+            return True
+
+    def entries(self, guild_id) -> list[dict]:
+        with self._lock:
+            return self._get(guild_id).entries()
+
+    def user_counts(self, guild_id) -> Counter:
+        with self._lock:
+            return self._get(guild_id).user_counts()
+
+    def prune_before(self, guild_id, cutoff: datetime) -> tuple[int, int]:
+        """
+        Drop reactions older than `cutoff`.
+
+        Returns:
+            Tuple (removed, remaining)
+        """
+        with self._lock:
+            cached = self._get(guild_id)
+            removed = cached.prune_before(cutoff)
+            if removed:
+                with self.write_queue.paused():
+                    self.logs.get(guild_id).mark_pruned(cutoff)
+            return removed, len(cached)
+
+    def rewrite(self, guild_id, entries: list[dict]):
+        with self._lock, self.write_queue.paused():
+            self._guilds.pop(str(guild_id), None)
+            self.logs.get(guild_id).rewrite(entries)
+
+    def clear(self, guild_id):
+        with self._lock, self.write_queue.paused():
+            self._guilds.pop(str(guild_id), None)
+            self.logs.get(guild_id).clear()
@@ -0,0 +1,319 @@
+import json
+import os
+import threading
+from bisect import bisect_left
+from datetime import datetime
+
+from utils.timeutil import parse_ts
+
+REACTION_FIELDS = ["message_id", "user_id", "emoji", "timestamp"]
+
+
+def iter_json_array(f, key: str, chunk_size: int = 1 << 16):
+    """
+    Yield the items of the array stored under `key` in a JSON object.
+
+    Only one chunk plus the current item is held in memory, so a
+    100k-entry `{"reactions": [...]}` file is read in constant space.
+    """
+    decoder = json.JSONDecoder()
+    buf = ""
+    eof = False
+
+    def fill():
+        nonlocal buf, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+
+    # Find the opening bracket of the array
+    marker = json.dumps(key)
+    while True:
+        i = buf.find(marker)
+        j = buf.find("[", i + len(marker)) if i >= 0 else -1
+        if j >= 0:
+            buf = buf[j + 1:]
+            break
+        if eof:
+            return
+        fill()
+
+    pos = 0
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError(f"Unterminated array {key!r}")
+            buf, pos = "", 0
+            fill()
+            continue
+        if buf[pos] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            buf, pos = buf[pos:], 0
+            fill()
+            continue
+
+        yield item
+        pos = end
+        if pos >= chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def _prune_index(entries: list[dict], cutoff: datetime) -> int:
+    """
+    Number of leading entries older than `cutoff`.
+
+    Reactions are appended in time order, so this is a binary search that
+    parses O(log n) timestamps.
+    """
+    return bisect_left(entries, cutoff,
+                       key=lambda e: parse_ts(e["timestamp"]))
+
+
+def _line(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ReactionLog:
+    """
+    Append-only JSONL reaction log of one guild.
+
+    Every reaction is one line, so recording it costs O(1) instead of
+    rewriting the whole history. Deletions are appended as operation
+    lines that readers replay in order:
+
+    - `{"op": "prune", "before": ts}` drops everything older than `ts`
+    - `{"op": "remove", "message_id", "user_id", "emoji"}` drops the
+      latest matching reaction
+
+    `compact()` rewrites the file without them.
+
+    A `<guild>.json` file in the old format is imported on first use and
+    renamed to `<guild>.json.migrated`.
+    """
+
+    def __init__(self, path: str, legacy_path: str | None = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.pending_ops = 0  # Operation lines not yet compacted
+        self._generation = 0  # Bumped whenever the file is replaced
+        self._lock = threading.RLock()
+
+    # ---------- Legacy import ----------
+
+    def _import_legacy(self):
+        if self.legacy_path is None or not os.path.exists(self.legacy_path):
+            return
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        imported = 0
+        with open(self.legacy_path, "r", encoding="utf-8") as f, \
+                open(tmp_path, "wb") as out:
+            for entry in iter_json_array(f, "reactions"):
+                out.write(_line(entry))
+                imported += 1
+
+        # The JSON file was the one being written, so it wins over any
+        # JSONL file converted from it earlier
+        os.replace(tmp_path, self.path)
+        os.replace(self.legacy_path, self.legacy_path + ".migrated")
+        self.pending_ops = 0
+        self._generation += 1
+        print(f"[ReactionLog] Imported {imported} reactions from "
+              f"{self.legacy_path}")
+
+    def ensure_exists(self):
+        with self._lock:
+            self._import_legacy()
+            if not os.path.exists(self.path):
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                open(self.path, "ab").close()
+
+    # ---------- Reading ----------
+
+    def _read(self,
+              limit: int | None = None) -> tuple[list[dict], int, int]:
+        """
+        Replay the first `limit` bytes of the log (all if None).
+
+        Returns:
+            Tuple (entries, number of operation lines, number of lines)
+        """
+        if not os.path.exists(self.path):
+            return [], 0, 0
+
+        with open(self.path, "rb") as f:
+            data = f.read() if limit is None else f.read(limit)
+
+        entries = []
+        ops = lines = 0
+        for raw in data.splitlines():
+            if not raw.strip():
+                continue
+            lines += 1
+            try:
+                obj = json.loads(raw)
+            except ValueError:
+                # Torn line from an interrupted write
+                print(f"[ReactionLog] Skipping bad line in {self.path}")
+                continue
+
+            op = obj.get("op")
+            if op is None:
+                entries.append(obj)
+            elif op == "prune":
+                ops += 1
+                entries = entries[_prune_index(entries,
+                                               parse_ts(obj["before"])):]
+            elif op == "remove":
+                ops += 1
+                key = (obj["message_id"], obj["user_id"], obj["emoji"])
+                for i in range(len(entries) - 1, -1, -1):
+                    e = entries[i]
+                    if (e["message_id"], e["user_id"], e["emoji"]) == key:
+                        del entries[i]
+                        break
+        return entries, ops, lines
+
+    def entries(self) -> list[dict]:
+        """All live reactions, oldest first."""
+        with self._lock:
+            self._import_legacy()
+            entries, ops, _lines = self._read()
+            self.pending_ops = ops
+            return entries
+
+    # ---------- Writing ----------
+
+    def _append(self, obj: dict):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(_line(obj))
+
+    def append(self, entry: dict):
+        self.append_many([entry])
+
+    def append_many(self, entries: list[dict]):
+        """Append reactions (and operation lines) with a single write."""
+        with self._lock:
+            self._import_legacy()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(b"".join(_line(entry) for entry in entries))
+            self.pending_ops += sum(1 for entry in entries if "op" in entry)
+
+    def prune_before(self, cutoff: datetime) -> tuple[int, int]:
+        """
+        Hide every reaction older than `cutoff`.
+
+        Returns:
+            Tuple (removed, remaining)
+        """
+        with self._lock:
+            entries = self.entries()
+            removed = _prune_index(entries, cutoff)
+            remaining = len(entries) - removed
+            if removed:
+                self.mark_pruned(cutoff)
+            return removed, remaining
+
+    def mark_pruned(self, cutoff: datetime):
+        """Append a prune marker without reading the log."""
+        with self._lock:
+            self._append({"op": "prune", "before": cutoff.isoformat()})
+            self.pending_ops += 1
+
+    def rewrite(self, entries):
+        """Replace the log with `entries`."""
+        with self._lock:
+            self._import_legacy()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                for entry in entries:
+                    f.write(_line(entry))
+            os.replace(tmp_path, self.path)
+            self.pending_ops = 0
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            for path in (self.path, self.legacy_path):
+                if path is not None and os.path.exists(path):
+                    os.remove(path)
+            self.pending_ops = 0
+            self._generation += 1
+
+    # ---------- Compaction ----------
+
+    def needs_compaction(self) -> bool:
+        return self.pending_ops > 0
+
+    def compact(self) -> int:
+        """
+        Rewrite the log without operation lines or the entries they hide.
+
+        The existing part of the log is read without holding the lock;
+        lines appended meanwhile are copied over before the swap.
+
+        Returns:
+            Number of lines dropped
+        """
+        with self._lock:
+            if not os.path.exists(self.path):
+                return 0
+            end = os.path.getsize(self.path)
+            generation = self._generation
+
+        entries, ops, lines = self._read(end)
+        tmp_path = self.path + ".compact"
+        with open(tmp_path, "wb") as f:
+            for entry in entries:
+                f.write(_line(entry))
+
+        with self._lock:
+            if generation != self._generation:
+                # Rewritten or cleared meanwhile, this copy is stale
+                os.remove(tmp_path)
+                return 0
+            with open(self.path, "rb") as src, open(tmp_path, "ab") as out:
+                src.seek(end)
+                out.write(src.read())
+            os.replace(tmp_path, self.path)
+            self.pending_ops = max(0, self.pending_ops - ops)
+            self._generation += 1
+
+        return lines - len(entries)
+
+
+class ReactionLogs:
+    """The reaction logs of all guilds, `<directory>/<guild>.jsonl`."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._logs: dict[str, ReactionLog] = {}
+
+    def get(self, guild_id) -> ReactionLog:
+        key = str(guild_id)
+        log = self._logs.get(key)
+        if log is None:
+            log = ReactionLog(os.path.join(self.directory, f"{key}.jsonl"),
+                              os.path.join(self.directory, f"{key}.json"))
+            self._logs[key] = log
+        return log
+
+    def needs_compaction(self) -> bool:
+        return any(log.needs_compaction() for log in self._logs.values())
+
+    def compact(self) -> int:
+        """Compact every log with pending operations, returns lines dropped."""
+        return sum(log.compact() for log in list(self._logs.values())
+                   if log.needs_compaction())
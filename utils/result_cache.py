@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    LRU cache of analytics results keyed by (command, guild, parameters).
+
+    Every result is stored with the append watermark of the datasets it
+    was computed from. Writers call `bump` when a dataset changes. A
+    cached result is served while it is younger than `ttl` seconds, or
+    while its datasets are unchanged and it is younger than `max_age`
+    (windows relative to "now" drift, so results never live forever).
+
+    Cached results are shared between callers and must not be modified.
+    """
+
+    def __init__(self,
+                 max_entries: int = 256,
+                 ttl: float = 60.0,
+                 max_age: float = 900.0,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_age = max_age
+        self._clock = clock
+        self._entries: OrderedDict = OrderedDict()
+        self._epochs: dict[str, int] = {}  # Bumped for every guild
+        self._guilds: dict[tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def watermark(self, datasets, guild_id) -> tuple:
+        guild_id = str(guild_id)
+        with self._lock:
+            return tuple((self._epochs.get(dataset, 0),
+                          self._guilds.get((dataset, guild_id), 0))
+                         for dataset in datasets)
+
+    def bump(self, dataset: str, guild_id=None):
+        """Record new or removed data, for one guild or (None) for all."""
+        with self._lock:
+            if guild_id is None:
+                self._epochs[dataset] = self._epochs.get(dataset, 0) + 1
+            else:
+                key = (dataset, str(guild_id))
+                self._guilds[key] = self._guilds.get(key, 0) + 1
+
+    def _lookup(self, key, now: float, watermark: tuple):
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                stored_at, stored_mark, result = cached
+                age = now - stored_at
+                if age < self.ttl or (stored_mark == watermark
+                                      and age < self.max_age):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+            self.misses += 1
+            return False, None
+
+    def _store(self, key, now: float, watermark: tuple, result):
+        with self._lock:
+            self._entries[key] = (now, watermark, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, command: str, guild_id, params: tuple,
+                       datasets, compute):
+        """
+        Return the cached result for the key or store `compute()`.
+
+        Args:
+            command: Name of the command (part of the key)
+            guild_id: Guild the result belongs to
+            params: Hashable command parameters
+            datasets: Dataset names the result is computed from
+            compute: Callable producing the result on a miss
+        """
+        key = (command, str(guild_id), params)
+        now = self._clock()
+        watermark = self.watermark(datasets, guild_id)
+        found, result = self._lookup(key, now, watermark)
+        if not found:
+            # Computed outside the lock, concurrent misses may both compute
+            result = compute()
+            self._store(key, now, watermark, result)
+        return result
+
+    async def get_or_compute_async(self, command: str, guild_id,
+                                   params: tuple, datasets, compute):
+        """Like `get_or_compute` for a coroutine function `compute`."""
+        key = (command, str(guild_id), params)
+        now = self._clock()
+        watermark = self.watermark(datasets, guild_id)
+        found, result = self._lookup(key, now, watermark)
+        if not found:
+            result = await compute()
+            self._store(key, now, watermark, result)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
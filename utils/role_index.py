@@ -0,0 +1,94 @@
+from collections import Counter
+
+
+class RoleIndex:
+    """
+    Per-guild index of role ID -> set of member IDs.
+
+    A guild is indexed from `guild.members` the first time it is queried
+    and then kept current by the member and role events, so role totals
+    are set lookups instead of scanning `member.roles` for every user.
+    """
+
+    def __init__(self):
+        self._guilds: dict[int, dict[int, set[int]]] = {}
+
+    def _roles(self, guild) -> dict[int, set[int]]:
+        roles = self._guilds.get(guild.id)
+        if roles is None:
+            roles = {}
+            for member in guild.members:
+                for role in member.roles:
+                    roles.setdefault(role.id, set()).add(member.id)
+            self._guilds[guild.id] = roles
+        return roles
+
+    def members(self, guild, role_id) -> set[int]:
+        """IDs of the members that have `role_id`."""
+        return self._roles(guild).get(int(role_id), set())
+
+    def forget(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    # ---------- Event updates ----------
+
+    def member_joined(self, member):
+        roles = self._guilds.get(member.guild.id)
+        if roles is None:
+            return
+        for role in member.roles:
+            roles.setdefault(role.id, set()).add(member.id)
+
+    def member_removed(self, member):
+        roles = self._guilds.get(member.guild.id)
+        if roles is None:
+            return
+        for role in member.roles:
+            roles.get(role.id, set()).discard(member.id)
+
+    def member_updated(self, before, after):
+        roles = self._guilds.get(after.guild.id)
+        if roles is None:
+            return
+        old = {role.id for role in before.roles}
+        new = {role.id for role in after.roles}
+        for role_id in old - new:
+            roles.get(role_id, set()).discard(after.id)
+        for role_id in new - old:
+            roles.setdefault(role_id, set()).add(after.id)
+
+    def role_deleted(self, role):
+        roles = self._guilds.get(role.guild.id)
+        if roles is not None:
+            roles.pop(role.id, None)
+
+    # ---------- Queries ----------
+
+    def totals(self, guild, role_ids, user_counts: Counter) -> dict:
+        """
+        Sum per-user counts over the members of each role.
+
+        Args:
+            guild: The guild the roles belong to
+            role_ids: Role IDs to total (strings or ints)
+            user_counts: {user_id: count}, user IDs as strings or ints
+
+        Returns:
+            Dictionary: {role_id: total} keyed like `role_ids`
+        """
+        counts = {}
+        for user_id, n in user_counts.items():
+            text = str(user_id)
+            if text.isdigit():
+                counts[int(text)] = n
+
+        totals = {}
+        for role_id in role_ids:
+            members = self.members(guild, role_id)
+            # Iterate over whichever side is smaller
+            if len(members) < len(counts):
+                totals[role_id] = sum(counts.get(m, 0) for m in members)
+            else:
+                totals[role_id] = sum(n for user, n in counts.items()
+                                      if user in members)
+        return totals
@@ -0,0 +1,345 @@
+import csv
+import os
+import threading
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from utils.heavy_hitters import SpaceSaving
+from utils.ping_store import EPOCH, to_epoch_us
+from utils.timeutil import parse_ts
+
+HOUR_US = 3_600_000_000
+ROLLUP_FIELDS = ["guild_id", "hour", "channel_id", "user_id", "count"]
+ROLLUP_KEYS = ("hour", "day", "channel_id", "user_id")
+TOP_FIELDS = ("channel_id", "user_id")
+
+
+def hour_bucket(ts: datetime) -> int:
+    """Whole hours since the epoch."""
+    return to_epoch_us(ts) // HOUR_US
+
+
+def bucket_day(bucket: int) -> date:
+    return (EPOCH + timedelta(hours=bucket)).date()
+
+
+class HourlyRollup:
+    """
+    Message counts per guild, hour bucket, channel and user.
+
+    Updated by `add` as messages are recorded, so queries sum at most one
+    Counter per hour of the window instead of reading raw messages. The
+    rollup is persisted as one CSV per UTC day below `directory`; `flush`
+    rewrites only the days that changed since the last flush, then the
+    `watermark` file with the newest message time it includes. `load`
+    replays the raw messages after the watermark, e.g. those of the last
+    minute before a crash.
+
+    Query windows are whole hours: every bucket that overlaps
+    [start, end) is counted in full.
+
+    Next to the hourly counts every guild keeps a Space-Saving summary of
+    at most `top_capacity` channels and users per UTC day, so `top` merges
+    a fixed number of counters per day however many users post.
+    """
+
+    def __init__(self, directory: str, top_capacity: int = 256):
+        self.directory = os.path.abspath(directory)
+        self.top_capacity = top_capacity
+        self.location = None
+        self._guilds: dict[str, dict[int, Counter]] = {}
+        # guild -> (field, day number) -> summary
+        self._top: dict[str, dict[tuple[str, int], SpaceSaving]] = {}
+        self._dirty: set[date] = set()
+        self._latest: datetime | None = None  # Newest message added
+        self._lock = threading.RLock()
+        # Taken before `_lock` by whatever writes the day files
+        self._flush_lock = threading.RLock()
+
+    def _path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.csv")
+
+    @property
+    def _watermark_path(self) -> str:
+        return os.path.join(self.directory, "watermark")
+
+    def _days(self) -> list[date]:
+        days = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext != ".csv":
+                continue
+            try:
+                days.append(date.fromisoformat(stem))
+            except ValueError:
+                continue
+        return sorted(days)
+
+    # ---------- Loading ----------
+
+    def load(self, rebuild):
+        """
+        Read the rollup from `directory`.
+
+        Args:
+            rebuild: Callable `rebuild(start)` returning the message rows
+                     at or after `start` (None: all); used to build the
+                     rollup when `directory` does not exist yet and to
+                     replay the messages after the watermark
+        """
+        with self._flush_lock, self._lock:
+            self._guilds = {}
+            self._top = {}
+            self._dirty = set()
+            self._latest = None
+            if os.path.isdir(self.directory):
+                for day in self._days():
+                    self._read_day(day)
+                self._latest = self._read_watermark()
+                if self._latest is not None:
+                    self._replay(rebuild(self._latest), self._latest)
+            else:
+                self._replay(rebuild(None))
+                os.makedirs(self.directory, exist_ok=True)
+            self.flush()
+            self.location = self.directory
+
+    def _replay(self, rows, after: datetime | None = None):
+        for row in rows:
+            try:
+                ts = parse_ts(row["timestamp"])
+                if after is None or ts > after:
+                    self.add(row["guild_id"], row["channel_id"],
+                             row["user_id"], ts)
+            except (KeyError, TypeError, ValueError):
+                continue
+
+    def _read_watermark(self) -> datetime | None:
+        try:
+            with open(self._watermark_path, "r", encoding="utf-8") as f:
+                return parse_ts(f.read().strip())
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def _read_day(self, day: date):
+        with open(self._path(day), "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    bucket, n = int(row["hour"]), int(row["count"])
+                    buckets = self._guilds.setdefault(row["guild_id"], {})
+                    counts = buckets.setdefault(bucket, Counter())
+                    counts[(row["channel_id"], row["user_id"])] += n
+                    self._add_top(row["guild_id"], row["channel_id"],
+                                  row["user_id"], bucket, n)
+                except (KeyError, TypeError, ValueError):
+                    continue
+
+    def flush(self) -> int:
+        """
+        Write the days changed since the last flush.
+
+        Returns:
+            Number of day files written
+        """
+        # Flushes run one at a time, so a snapshot is never written over
+        # by an older one; `add` only waits for the snapshot, not the disk
+        with self._flush_lock:
+            with self._lock:
+                days, self._dirty = self._dirty, set()
+                latest = self._latest
+                if not days:
+                    return 0
+
+                rows = {day: [] for day in days}
+                for guild_id, buckets in self._guilds.items():
+                    for bucket, counts in buckets.items():
+                        day = bucket_day(bucket)
+                        if day in rows:
+                            rows[day].extend(
+                                [guild_id, bucket, channel, user, n]
+                                for (channel, user), n in counts.items())
+
+            os.makedirs(self.directory, exist_ok=True)
+            for day, day_rows in rows.items():
+                path = self._path(day)
+                if not day_rows:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(ROLLUP_FIELDS)
+                    writer.writerows(day_rows)
+                os.replace(tmp_path, path)
+
+            # Last, so a crash before it replays messages rather than
+            # losing them
+            if latest is not None:
+                tmp_path = self._watermark_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(latest.isoformat())
+                os.replace(tmp_path, self._watermark_path)
+        return len(days)
+
+    # ---------- Updates ----------
+
+    def add(self, guild_id, channel_id, user_id, ts: datetime, n: int = 1):
+        bucket = hour_bucket(ts)
+        with self._lock:
+            buckets = self._guilds.setdefault(str(guild_id), {})
+            counts = buckets.setdefault(bucket, Counter())
+            counts[(str(channel_id), str(user_id))] += n
+            self._add_top(str(guild_id), str(channel_id), str(user_id),
+                          bucket, n)
+            self._dirty.add(bucket_day(bucket))
+            if self._latest is None or ts > self._latest:
+                self._latest = ts
+
+    def _add_top(self, guild_id: str, channel_id: str, user_id: str,
+                 bucket: int, n: int):
+        summaries = self._top.setdefault(guild_id, {})
+        for field, value in (("channel_id", channel_id), ("user_id", user_id)):
+            summary = summaries.get((field, bucket // 24))
+            if summary is None:
+                summary = summaries[(field, bucket // 24)] = SpaceSaving(
+                    self.top_capacity)
+            summary.add(value, n)
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """
+        Drop the days before the day containing `cutoff`.
+
+        Returns:
+            Number of hour buckets removed
+        """
+        first = hour_bucket(cutoff) // 24 * 24
+        removed = 0
+        with self._flush_lock, self._lock:
+            for buckets in self._guilds.values():
+                old = [bucket for bucket in buckets if bucket < first]
+                for bucket in old:
+                    del buckets[bucket]
+                removed += len(old)
+            for summaries in self._top.values():
+                for key in [k for k in summaries if k[1] < first // 24]:
+                    del summaries[key]
+            self._dirty = {day for day in self._dirty
+                           if day >= bucket_day(first)}
+            if os.path.isdir(self.directory):
+                for day in self._days():
+                    if day < bucket_day(first):
+                        os.remove(self._path(day))
+        return removed
+
+    def forget(self, guild_id):
+        """Drop a guild, e.g. after its messages were deleted."""
+        with self._lock:
+            buckets = self._guilds.pop(str(guild_id), {})
+            self._top.pop(str(guild_id), None)
+            self._dirty.update(bucket_day(bucket) for bucket in buckets)
+
+    # ---------- Queries ----------
+
+    def _buckets(self, guild_id, start, end):
+        buckets = self._guilds.get(str(guild_id), {})
+        if start is None and end is None:
+            return list(buckets.items())
+
+        lo = hour_bucket(start) if start is not None else None
+        hi = -(-to_epoch_us(end) // HOUR_US) if end is not None else None
+        if lo is not None and hi is not None and hi - lo < len(buckets):
+            # Look up each hour of the window
+            return [(b, buckets[b]) for b in range(lo, hi) if b in buckets]
+        return [(b, counts) for b, counts in buckets.items()
+                if (lo is None or b >= lo) and (hi is None or b < hi)]
+
+    def count(self, guild_id, start: datetime | None = None,
+              end: datetime | None = None) -> int:
+        with self._lock:
+            return sum(counts.total()
+                       for _b, counts in self._buckets(guild_id, start, end))
+
+    def count_by(self,
+                 guild_id,
+                 key,
+                 start: datetime | None = None,
+                 end: datetime | None = None) -> Counter:
+        """
+        Count messages grouped like `StorageBackend.count_by`.
+
+        Args:
+            key: "hour" (UTC hour of day), "day", "channel_id", "user_id"
+                 or a tuple of those
+        """
+        keys = key if isinstance(key, tuple) else (key, )
+        for k in keys:
+            if k not in ROLLUP_KEYS:
+                raise ValueError(f"Unknown key {k!r} for the message rollup")
+
+        result = Counter()
+        with self._lock:
+            for bucket, counts in self._buckets(guild_id, start, end):
+                if all(k in ("hour", "day") for k in keys):
+                    # Only time keys: the whole bucket shares one group
+                    values = [bucket % 24 if k == "hour" else
+                              bucket_day(bucket) for k in keys]
+                    group = tuple(values) if len(keys) > 1 else values[0]
+                    result[group] += counts.total()
+                    continue
+
+                for (channel, user), n in counts.items():
+                    values = []
+                    for k in keys:
+                        if k == "hour":
+                            values.append(bucket % 24)
+                        elif k == "day":
+                            values.append(bucket_day(bucket))
+                        else:
+                            values.append(channel if k == "channel_id"
+                                          else user)
+                    result[tuple(values) if len(keys) > 1 else values[0]] += n
+        return result
+
+    def top(self,
+            guild_id,
+            field: str,
+            n: int,
+            start: datetime | None = None,
+            end: datetime | None = None) -> list[tuple]:
+        """
+        The `n` channels or users with the most messages.
+
+        Days inside the window are merged from the daily summaries, the
+        hours of a partly covered first or last day are added from the
+        hourly counts. Counts are exact while a guild has at most
+        `top_capacity` channels/users per day, upper bounds otherwise.
+
+        Args:
+            field: "channel_id" or "user_id"
+
+        Returns:
+            List of tuples: [(id, count), ...]
+        """
+        if field not in TOP_FIELDS:
+            raise ValueError(f"Unknown field {field!r} for top counts")
+        index = TOP_FIELDS.index(field)
+        lo = hour_bucket(start) if start is not None else None
+        hi = -(-to_epoch_us(end) // HOUR_US) if end is not None else None
+
+        merged = SpaceSaving(self.top_capacity)
+        with self._lock:
+            buckets = self._guilds.get(str(guild_id), {})
+            for (f, day), summary in self._top.get(str(guild_id), {}).items():
+                first, last = day * 24, day * 24 + 24
+                if f != field or (lo is not None and last <= lo) or (
+                        hi is not None and first >= hi):
+                    continue
+                if (lo is None or lo <= first) and (hi is None or last <= hi):
+                    merged.update(summary)
+                    continue
+                for bucket in range(first if lo is None else max(first, lo),
+                                    last if hi is None else min(last, hi)):
+                    for key, count in buckets.get(bucket, {}).items():
+                        merged.add(key[index], count)
+        return merged.most_common(n)
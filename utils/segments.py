@@ -0,0 +1,600 @@
+import csv
+import heapq
+import os
+import shutil
+import tempfile
+from datetime import date, datetime, timezone
+
+from utils.timeutil import parse_ts
+from utils.tombstones import is_deleted
+from utils.write_queue import append_csv_rows
+
+
+def index_path(segment_path: str) -> str:
+    """Path of the hour index next to a segment (`<day>.idx`)."""
+    return os.path.splitext(segment_path)[0] + ".idx"
+
+
+def remove_segment(path: str):
+    """Delete a segment and its hour index."""
+    os.remove(path)
+    if os.path.exists(index_path(path)):
+        os.remove(index_path(path))
+
+
+def _row_ts(line: bytes, ts_index: int) -> datetime:
+    row = next(csv.reader([line.decode("utf-8")]))
+    return parse_ts(row[ts_index])
+
+
+def _load_index(path: str) -> tuple[int, dict[int, int]]:
+    covered, hours = 0, {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            covered = int(f.readline().split()[1])
+            for line in f:
+                hour, offset = line.split()
+                hours[int(hour)] = int(offset)
+    except (OSError, IndexError, ValueError):
+        return 0, {}
+    return covered, hours
+
+
+def hour_index(path: str, ts_field: str,
+               save: bool = False) -> dict[int, int]:
+    """
+    Byte offset of the first row of each UTC hour in a day segment.
+
+    The index is kept in a sidecar file that records how many bytes of
+    the segment it covers. Rows appended since then are indexed by
+    reading only the new bytes; a missing or unreadable sidecar, or a
+    segment that shrank, is rebuilt from the whole file. Hours without
+    rows have no entry.
+
+    Readers only read the sidecar and index the uncovered tail in memory;
+    the writer of the segment passes `save` to store the extended index.
+    """
+    sidecar = index_path(path)
+    covered, hours = _load_index(sidecar)
+
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        if covered == size:
+            return hours
+        if covered > size:
+            covered, hours = 0, {}
+
+        f.seek(0)
+        header = next(csv.reader([f.readline().decode("utf-8")]))
+        ts_index = header.index(ts_field)
+        pos = max(covered, f.tell())
+        f.seek(pos)
+
+        last = max(hours) if hours else -1
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # Torn tail of an interrupted append
+            try:
+                hour = _row_ts(line, ts_index).hour
+            except (IndexError, TypeError, ValueError):
+                hour = last
+            if hour > last:
+                hours[hour] = pos
+                last = hour
+            pos += len(line)
+
+    if save:
+        # Unique temporary name, concurrent writers never share a file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(sidecar) or ".",
+                                        suffix=".idx.tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"size {pos}\n")
+            for hour, offset in sorted(hours.items()):
+                f.write(f"{hour} {offset}\n")
+        os.replace(tmp_path, sidecar)
+    return hours
+
+
+def append_indexed(path: str, header: list, rows: list, ts_field: str):
+    """Append rows to a segment and extend its hour index."""
+    append_csv_rows(path, header, rows)
+    hour_index(path, ts_field, save=True)
+
+
+class SegmentedCsv:
+    """
+    A CSV dataset split into one file per UTC day.
+
+    Rows are stored in `<directory>/<YYYY-MM-DD>.csv`, each segment with
+    its own header. The day of a row is taken from `ts_field`, so windowed
+    reads only open the segments that overlap the window and retention
+    deletes whole files instead of rewriting the data.
+
+    An optional TombstoneLog hides deleted rows from every reader until
+    `compact()` folds the deletions into the segment files.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 fields: list[str],
+                 ts_field: str,
+                 tombstones=None):
+        self.directory = directory
+        self.fields = fields
+        self.ts_field = ts_field
+        self.tombstones = tombstones
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.directory)
+
+    def ensure_exists(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    # ---------- Paths ----------
+
+    def segment_path(self, day: date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.csv")
+
+    def segment_for(self, ts: datetime) -> str:
+        """Path of the segment a row with timestamp `ts` belongs to."""
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc)
+        return self.segment_path(ts.date())
+
+    def segments(self,
+                 start: datetime | None = None,
+                 end: datetime | None = None) -> list[tuple[date, str]]:
+        """
+        List segments overlapping [start, end], oldest first.
+
+        Returns:
+            List of tuples: [(day, path), ...]
+        """
+        if not self.exists():
+            return []
+
+        first = start.astimezone(timezone.utc).date() if start else None
+        last = end.astimezone(timezone.utc).date() if end else None
+
+        found = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext != ".csv":
+                continue
+            try:
+                day = date.fromisoformat(stem)
+            except ValueError:
+                continue
+            if first and day < first:
+                continue
+            if last and day > last:
+                continue
+            found.append((day, os.path.join(self.directory, name)))
+
+        found.sort()
+        return found
+
+    # ---------- Reading ----------
+
+    def _bound_offset(self, f, lo: int, hi: int, ts_index: int,
+                      bound: datetime) -> int:
+        """
+        Byte offset of the first row in [lo, hi) with timestamp >= bound.
+
+        Rows are appended in time order, so this is a binary search over
+        byte offsets that parses O(log n) rows. `lo` and `hi` must be line
+        starts (or the end of the file); returns `hi` if every row in
+        between is older than `bound`.
+        """
+
+        def next_line(pos: int) -> int:
+            # Start of the first line at or after `pos`
+            if pos == lo:
+                return lo
+            f.seek(pos - 1)
+            f.readline()
+            return min(f.tell(), hi)
+
+        a, b = lo, hi
+        while a < b:
+            mid = (a + b) // 2
+            line_start = next_line(mid)
+            if line_start < hi:
+                f.seek(line_start)
+                if _row_ts(f.readline(), ts_index) < bound:
+                    a = line_start + 1
+                    continue
+            b = mid
+        return next_line(a)
+
+    def _hour_range(self, path: str, data_start: int, size: int,
+                    bound: datetime) -> tuple[int, int]:
+        """
+        Byte range that must contain the first row >= `bound`.
+
+        Rows before the first row of `bound`'s hour are older than it and
+        rows from the first row of the next hour on are not, so only this
+        stretch needs a binary search.
+        """
+        hours = hour_index(path, self.ts_field)
+        bound = bound.astimezone(timezone.utc)
+        lo = max((offset for hour, offset in hours.items()
+                  if hour <= bound.hour),
+                 default=data_start)
+        hi = min((offset for hour, offset in hours.items()
+                  if hour > bound.hour),
+                 default=size)
+        # Rows appended since `size` was taken are not read
+        return min(lo, size), min(hi, size)
+
+    def _read_window(self, path: str, start, end):
+        """Rows of one segment with start <= ts < end (bounds optional)."""
+        with open(path, "rb") as f:
+            header_line = f.readline()
+            fields = next(csv.reader([header_line.decode("utf-8")]))
+            ts_index = fields.index(self.ts_field)
+            data_start = f.tell()
+            size = f.seek(0, os.SEEK_END)
+
+            lo, hi = data_start, size
+            if start is not None:
+                lo = self._bound_offset(f, *self._hour_range(
+                    path, data_start, size, start), ts_index, start)
+            if end is not None:
+                a, b = self._hour_range(path, data_start, size, end)
+                hi = self._bound_offset(f, max(a, lo), max(b, lo), ts_index,
+                                        end)
+            if lo >= hi:
+                return []
+
+            f.seek(lo)
+            data = f.read(hi - lo).decode("utf-8")
+        return csv.DictReader(data.splitlines(), fieldnames=fields)
+
+    def iter_rows(self,
+                  start: datetime | None = None,
+                  end: datetime | None = None):
+        """
+        Yield rows (as dicts) with start <= timestamp < end.
+
+        Segments outside the window are skipped and segments fully inside
+        it are read without parsing timestamps. In the boundary segments
+        the window is located by binary search over byte offsets, which
+        relies on rows being appended in time order.
+        Rows hidden by tombstones are skipped.
+        """
+        deleted = self.tombstones.snapshot() if self.tombstones else {}
+        first = start.astimezone(timezone.utc).date() if start else None
+        last = end.astimezone(timezone.utc).date() if end else None
+
+        for day, path in self.segments(start, end):
+            if day == first or day == last:
+                rows = self._read_window(path,
+                                         start if day == first else None,
+                                         end if day == last else None)
+                yield from self._visible(rows, deleted)
+                continue
+
+            with open(path, "r", encoding="utf-8") as f:
+                yield from self._visible(csv.DictReader(f), deleted)
+
+    def _visible(self, rows, deleted: dict):
+        if not deleted:
+            return rows
+        return (row for row in rows
+                if not is_deleted(deleted, row, self.ts_field))
+
+    # ---------- Writing ----------
+
+    def append_rows(self, rows):
+        """Append dict rows, each into the segment of its timestamp."""
+        grouped: dict[str, list] = {}
+        for row in rows:
+            try:
+                path = self.segment_for(parse_ts(row[self.ts_field]))
+            except (TypeError, ValueError) as e:
+                print(f"[Segments] Skipping row with bad timestamp: {e}")
+                continue
+            grouped.setdefault(path, []).append(
+                [row.get(field, "") for field in self.fields])
+
+        for path, values in grouped.items():
+            append_indexed(path, self.fields, values, self.ts_field)
+        return sum(len(v) for v in grouped.values())
+
+    def rewrite(self, rows):
+        """Replace the whole dataset with `rows`."""
+        grouped: dict[str, list] = {}
+        for row in rows:
+            path = self.segment_for(parse_ts(row[self.ts_field]))
+            grouped.setdefault(path, []).append(row)
+
+        for _day, path in self.segments():
+            if path not in grouped:
+                remove_segment(path)
+
+        self.ensure_exists()
+        for path, values in grouped.items():
+            self._write_segment(path, values)
+        if self.tombstones is not None:
+            self.tombstones.clear()
+
+    def _write_segment(self, path: str, rows):
+        if os.path.exists(index_path(path)):
+            os.remove(index_path(path))  # Offsets change with the rows
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            writer.writerows(rows)
+        os.replace(tmp_path, path)
+        hour_index(path, self.ts_field, save=True)
+
+    def compact(self) -> int:
+        """
+        Fold the tombstones into the segment files and clear them.
+
+        Only segments up to the day of the newest tombstone can contain
+        deleted rows, and only segments that actually change are rewritten.
+
+        Returns:
+            Number of rows removed from disk
+        """
+        if self.tombstones is None:
+            return 0
+
+        deleted = self.tombstones.snapshot()
+        if not deleted:
+            return 0
+
+        removed = self.fold(deleted)
+        self.tombstones.discard(deleted)
+        return removed
+
+    def fold(self, deleted: dict) -> int:
+        """
+        Remove the rows hidden by `deleted` from the segment files.
+
+        Returns:
+            Number of rows removed from disk
+        """
+        removed = 0
+        for _day, path in self.segments(end=max(deleted.values())):
+            with open(path, "r", encoding="utf-8") as f:
+                rows = list(csv.DictReader(f))
+            kept = [
+                row for row in rows
+                if not is_deleted(deleted, row, self.ts_field)
+            ]
+            if len(kept) == len(rows):
+                continue
+
+            removed += len(rows) - len(kept)
+            if kept:
+                self._write_segment(path, kept)
+            else:
+                remove_segment(path)
+        return removed
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """
+        Delete every segment that ends before the day of `cutoff`.
+
+        Returns:
+            Number of segment files removed
+        """
+        cutoff_day = cutoff.astimezone(timezone.utc).date()
+        removed = 0
+        for day, path in self.segments():
+            if day >= cutoff_day:
+                break
+            remove_segment(path)
+            removed += 1
+        return removed
+
+    def import_legacy(self, legacy_path: str) -> int:
+        """
+        Split a single-file CSV from before day partitioning into segments.
+
+        The legacy file is renamed to `<legacy_path>.migrated` afterwards.
+
+        Returns:
+            Number of rows imported
+        """
+        if not os.path.exists(legacy_path):
+            return 0
+
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            imported = self.append_rows(csv.DictReader(f))
+
+        os.replace(legacy_path, legacy_path + ".migrated")
+        print(f"[Segments] Imported {imported} rows from {legacy_path} "
+              f"into {self.directory}/")
+        return imported
+
+
+def guild_path(directory: str, guild_id, suffix: str = "") -> str:
+    """
+    Path of a guild's file or directory below `directory`.
+
+    Raises ValueError for guild IDs that are empty, hidden or contain a
+    path separator, so no ID can point outside `directory`.
+    """
+    name = str(guild_id)
+    if (not name or name.startswith(".") or os.sep in name
+            or (os.altsep and os.altsep in name)):
+        raise ValueError(f"Invalid guild ID: {name!r}")
+    return os.path.join(directory, name + suffix)
+
+
+class GuildShards:
+    """
+    A dataset sharded per guild, one SegmentedCsv per guild.
+
+    Rows of a guild are stored in `<directory>/<guild_id>/<YYYY-MM-DD>.csv`,
+    so a guild's queries only open its own files. Shards are created by
+    the first row written to them and dropping a guild deletes a single
+    directory. The TombstoneLog is shared by all shards.
+    """
+
+    def __init__(self,
+                 directory: str,
+                 fields: list[str],
+                 ts_field: str,
+                 tombstones=None):
+        self.directory = directory
+        self.fields = fields
+        self.ts_field = ts_field
+        self.tombstones = tombstones
+        self._shards: dict[str, SegmentedCsv] = {}
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.directory)
+
+    def ensure_exists(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def shard(self, guild_id) -> SegmentedCsv:
+        name = str(guild_id)
+        shard = self._shards.get(name)
+        if shard is None:
+            shard = SegmentedCsv(guild_path(self.directory, name),
+                                 self.fields, self.ts_field, self.tombstones)
+            self._shards[name] = shard
+        return shard
+
+    def guilds(self) -> list[str]:
+        """IDs of the guilds that have a shard."""
+        if not self.exists():
+            return []
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, name)))
+
+    def segment_for(self, guild_id, ts: datetime) -> str:
+        return self.shard(guild_id).segment_for(ts)
+
+    # ---------- Reading ----------
+
+    def iter_rows(self,
+                  guild_id=None,
+                  start: datetime | None = None,
+                  end: datetime | None = None):
+        """
+        Yield rows with start <= timestamp < end.
+
+        With `guild_id` only that guild's shard is read. Without it the
+        shards are merged back into time order.
+        """
+        if guild_id is not None:
+            return self.shard(guild_id).iter_rows(start, end)
+
+        streams = [self.shard(g).iter_rows(start, end) for g in self.guilds()]
+        return heapq.merge(*streams,
+                           key=lambda row: parse_ts(row[self.ts_field]))
+
+    # ---------- Writing ----------
+
+    def _group(self, rows) -> dict[str, list]:
+        grouped: dict[str, list] = {}
+        for row in rows:
+            grouped.setdefault(str(row.get("guild_id") or ""), []).append(row)
+        return grouped
+
+    def append_rows(self, rows) -> int:
+        written = 0
+        for guild_id, guild_rows in self._group(rows).items():
+            try:
+                shard = self.shard(guild_id)
+            except ValueError as e:
+                print(f"[Segments] Skipping {len(guild_rows)} rows: {e}")
+                continue
+            written += shard.append_rows(guild_rows)
+        return written
+
+    def rewrite(self, rows):
+        """Replace the whole dataset with `rows`."""
+        grouped = self._group(rows)
+        for guild_id in self.guilds():
+            if guild_id not in grouped:
+                self.drop_guild(guild_id)
+
+        self.ensure_exists()
+        for guild_id, guild_rows in grouped.items():
+            self.shard(guild_id).rewrite(guild_rows)
+        if self.tombstones is not None:
+            self.tombstones.clear()
+
+    def compact(self) -> int:
+        """
+        Fold the tombstones into the shards of the guilds they name.
+
+        Returns:
+            Number of rows removed from disk
+        """
+        if self.tombstones is None:
+            return 0
+
+        deleted = self.tombstones.snapshot()
+        if not deleted:
+            return 0
+
+        guilds = set(self.guilds())
+        removed = sum(
+            self.shard(guild_id).fold(deleted)
+            for guild_id in {key[0] for key in deleted} if guild_id in guilds)
+        self.tombstones.discard(deleted)
+        return removed
+
+    def drop_before(self, cutoff: datetime) -> int:
+        """
+        Delete every segment that ends before the day of `cutoff`.
+
+        Returns:
+            Number of segment files removed
+        """
+        return sum(
+            self.shard(guild_id).drop_before(cutoff)
+            for guild_id in self.guilds())
+
+    def drop_guild(self, guild_id) -> bool:
+        """
+        Delete all rows of a guild.
+
+        Returns:
+            True if the guild had a shard
+        """
+        shard = self.shard(guild_id)
+        self._shards.pop(str(guild_id), None)
+        if not shard.exists():
+            return False
+        shutil.rmtree(shard.directory)
+        return True
+
+    def import_legacy(self, legacy_path: str) -> int:
+        """
+        Move rows from before sharding into the guild shards.
+
+        Day segments directly in `directory` are split up and deleted, and
+        a single-file CSV at `legacy_path` is imported and renamed to
+        `<legacy_path>.migrated`.
+
+        Returns:
+            Number of rows imported
+        """
+        imported = 0
+        unsharded = SegmentedCsv(self.directory, self.fields, self.ts_field)
+        for _day, path in unsharded.segments():
+            with open(path, "r", encoding="utf-8") as f:
+                imported += self.append_rows(csv.DictReader(f))
+            remove_segment(path)
+
+        if os.path.exists(legacy_path):
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                imported += self.append_rows(csv.DictReader(f))
+            os.replace(legacy_path, legacy_path + ".migrated")
+
+        if imported:
+            print(f"[Segments] Imported {imported} rows into guild shards "
+                  f"below {self.directory}/")
+        return imported
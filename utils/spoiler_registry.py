@@ -0,0 +1,127 @@
+import csv
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from utils.write_queue import WriteBehindQueue
+
+DISCORD_EPOCH_MS = 1420070400000
+REGISTRY_FIELDS = ["guild_id", "message_id"]
+
+
+def snowflake_time(snowflake: int) -> datetime:
+    """Creation time encoded in a Discord snowflake."""
+    ms = (snowflake >> 22) + DISCORD_EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
+
+
+class SpoilerRegistry:
+    """
+    Bounded set of spoiler message IDs, persisted as an append-only CSV.
+
+    Message IDs are kept in insertion order; the oldest are dropped once
+    there are more than `max_entries` or their snowflake is older than
+    `max_age`. Membership checks are a dict lookup. New IDs are queued in
+    a WriteBehindQueue and reach the file in batches. The file is
+    rewritten with only the kept IDs on load and once it holds more than
+    `compact_lines` and twice as many lines as kept IDs.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 100_000,
+                 max_age: timedelta = timedelta(days=30),
+                 flush_interval: float = 5.0,
+                 compact_lines: int = 1000):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.compact_lines = compact_lines
+        self.write_queue = WriteBehindQueue(flush_interval=flush_interval)
+        self._messages: OrderedDict[int, int] = OrderedDict()
+        self._lines = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _expired(self, message_id: int, now: datetime) -> bool:
+        return snowflake_time(message_id) < now - self.max_age
+
+    def _trim(self):
+        now = datetime.now(timezone.utc)
+        while self._messages:
+            oldest = next(iter(self._messages))
+            if (len(self._messages) <= self.max_entries
+                    and not self._expired(oldest, now)):
+                break
+            self._messages.popitem(last=False)
+
+    def _load(self):
+        if self._loaded:
+            return
+
+        self._messages = OrderedDict()
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    lines += 1
+                    try:
+                        self._messages[int(row["message_id"])] = int(
+                            row["guild_id"])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+        self._loaded = True
+        self._lines = lines
+        self._trim()
+
+        if lines > 2 * len(self._messages):
+            self._rewrite()
+
+    def _rewrite(self):
+        # Queued IDs are written first, none is appended to the old file
+        with self.write_queue.paused():
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(REGISTRY_FIELDS)
+                for message_id, guild_id in self._messages.items():
+                    writer.writerow([guild_id, message_id])
+            os.replace(tmp_path, self.path)
+        self._lines = len(self._messages)
+
+    def start(self):
+        """Start timed flushing on the running event loop."""
+        self.write_queue.start()
+
+    async def stop(self):
+        await self.write_queue.stop()
+
+    def flush(self) -> int:
+        return self.write_queue.flush()
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._messages)
+
+    def __contains__(self, message_id) -> bool:
+        with self._lock:
+            self._load()
+            return int(message_id) in self._messages
+
+    def add(self, guild_id, message_id):
+        """Remember a spoiler message."""
+        with self._lock:
+            self._load()
+            message_id = int(message_id)
+            if message_id in self._messages:
+                return
+            self._messages[message_id] = int(guild_id)
+            self.write_queue.enqueue(self.path, REGISTRY_FIELDS,
+                                     [guild_id, message_id])
+            self._lines += 1
+            self._trim()
+            if self._lines > max(self.compact_lines,
+                                 2 * len(self._messages)):
+                self._rewrite()
@@ -0,0 +1,650 @@
+import csv
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from utils.binary_segments import (DAY_US, BinarySegments, append_records,
+                                   encode_snowflake)
+from utils.ping_store import EPOCH, from_epoch_us, to_epoch_us
+from utils.segments import GuildShards, append_indexed
+from utils.timeutil import day_start, parse_ts
+from utils.tombstones import TombstoneLog
+from utils.write_queue import WriteBehindQueue
+
+PING_FIELDS = ["guild_id", "role_id", "user_id", "channel_id", "timestamp"]
+MESSAGE_FIELDS = ["guild_id", "user_id", "channel_id", "timestamp"]
+VOICE_FIELDS = [
+    "guild_id", "user_id", "channel_id", "joined_at", "left_at",
+    "duration_seconds"
+]
+
+
+class Dataset:
+    """Schema of one append-only dataset."""
+
+    def __init__(self, name: str, fields: list[str], ts_field: str,
+                 ts_fields: tuple[str, ...], directory: str):
+        self.name = name
+        self.fields = fields
+        self.ts_field = ts_field  # Column used for windows and retention
+        self.ts_fields = ts_fields  # All timestamp columns
+        self.directory = directory  # Directory name of the CSV segments
+
+
+DATASETS = {
+    "pings":
+    Dataset("pings", PING_FIELDS, "timestamp", ("timestamp", ),
+            "role_pings"),
+    "messages":
+    Dataset("messages", MESSAGE_FIELDS, "timestamp", ("timestamp", ),
+            "activity_messages"),
+    # Voice sessions are written when they end, so they are keyed by left_at
+    "voice":
+    Dataset("voice", VOICE_FIELDS, "left_at", ("joined_at", "left_at"),
+            "activity_voice"),
+}
+
+# Pseudo-fields accepted by count_by() besides the dataset fields
+TIME_KEYS = ("hour", "day")
+
+# Keyword that points each backend at its files (see open_storage)
+LOCATION_ARGS = {"csv": "base_dir", "sqlite": "path", "binary": "base_dir"}
+
+
+def _keys(key) -> tuple:
+    return key if isinstance(key, tuple) else (key, )
+
+
+class StorageBackend(ABC):
+    """
+    Interface for persisting the bot's activity datasets.
+
+    Datasets are named "pings", "messages" and "voice" (see DATASETS).
+    Rows are CSV-style dictionaries with string values; windows are
+    half-open [start, end) on the dataset's `ts_field`.
+    """
+
+    kind = None  # Name accepted by open_storage
+    location = None
+    # Whether count/count_by are answered without decoding rows, so a
+    # Query hands its counts to them (see utils.query.execute)
+    native_counts = False
+
+    def __init__(self, write_queue: WriteBehindQueue):
+        self.write_queue = write_queue
+
+    # ---------- Lifecycle ----------
+
+    def start(self):
+        """Start background flushing on the running event loop."""
+        self.write_queue.start()
+
+    async def stop(self):
+        await self.write_queue.stop()
+
+    def flush(self):
+        self.write_queue.flush()
+
+    @abstractmethod
+    def import_legacy(self, dataset: str, path: str) -> int:
+        """Import a single-file CSV in the old format, then rename it."""
+
+    # ---------- Writes ----------
+
+    @abstractmethod
+    def prepare(self, dataset: str, row: dict) -> tuple:
+        """
+        Turn a row into a write-queue entry.
+
+        Returns:
+            Tuple (target, header, values); raises KeyError, TypeError or
+            ValueError for rows the backend cannot store
+        """
+
+    def append(self, dataset: str, row: dict):
+        self.write_queue.enqueue(*self.prepare(dataset, row))
+
+    def write_batch(self, entries: list) -> int:
+        """Write prepared entries right away, bypassing the queue."""
+        grouped: dict[str, tuple[list | None, list]] = {}
+        for target, header, values in entries:
+            grouped.setdefault(target, (header, []))[1].append(values)
+
+        with self.write_queue.paused():
+            for target, (header, rows) in grouped.items():
+                self.write_queue.writer(target, header, rows)
+        return len(entries)
+
+    @abstractmethod
+    def delete(self, dataset: str, guild_id, field: str, value) -> None:
+        """Delete every row of a guild where `field` equals `value`."""
+
+    @abstractmethod
+    def rewrite(self, dataset: str, rows) -> None:
+        """Replace the whole dataset with `rows`."""
+
+    @abstractmethod
+    def drop_before(self, dataset: str, cutoff: datetime) -> int:
+        """Apply retention, returns the number of files or rows removed."""
+
+    def retention_boundary(self, cutoff: datetime) -> datetime:
+        """Oldest timestamp that survives `drop_before(cutoff)`."""
+        return cutoff
+
+    def needs_compaction(self) -> bool:
+        return False
+
+    def compact(self) -> int:
+        return 0
+
+    # ---------- Queries ----------
+
+    @abstractmethod
+    def iter_rows(self,
+                  dataset: str,
+                  guild_id=None,
+                  start: datetime | None = None,
+                  end: datetime | None = None):
+        """Rows of a dataset in [start, end) as CSV-style dictionaries."""
+
+    def count(self, dataset, guild_id, start=None, end=None) -> int:
+        return sum(1 for _ in self.iter_rows(dataset, guild_id, start, end))
+
+    def count_by(self,
+                 dataset: str,
+                 guild_id,
+                 key,
+                 start: datetime | None = None,
+                 end: datetime | None = None) -> Counter:
+        """
+        Count rows grouped by a field, "hour" (UTC hour of day) or "day".
+
+        Args:
+            key: Field name or tuple of field names
+        """
+        ts_field = DATASETS[dataset].ts_field
+        keys = _keys(key)
+        counts = Counter()
+
+        for row in self.iter_rows(dataset, guild_id, start, end):
+            ts = None
+            values = []
+            for k in keys:
+                if k in TIME_KEYS:
+                    ts = ts or parse_ts(row[ts_field])
+                    values.append(ts.hour if k == "hour" else ts.date())
+                else:
+                    values.append(row[k])
+            counts[tuple(values) if len(keys) > 1 else values[0]] += 1
+
+        return counts
+
+
+class CsvBackend(StorageBackend):
+    """
+    CSV segments per guild and day below `base_dir` (the default backend).
+    """
+
+    kind = "csv"
+
+    def __init__(self,
+                 base_dir: str = ".",
+                 max_batch: int = 500,
+                 flush_interval: float = 2.0):
+        super().__init__(
+            WriteBehindQueue(max_batch, flush_interval, writer=self._append))
+        self.location = os.path.abspath(base_dir)
+        self.segments: dict[str, GuildShards] = {}
+        # Window column per header, for indexing appended segments
+        self._ts_fields = {
+            tuple(ds.fields): ds.ts_field
+            for ds in DATASETS.values()
+        }
+
+        for name, ds in DATASETS.items():
+            directory = os.path.join(base_dir, ds.directory)
+            tombstones = TombstoneLog(os.path.join(directory,
+                                                   "tombstones.csv"))
+            self.segments[name] = GuildShards(directory, ds.fields,
+                                              ds.ts_field, tombstones)
+
+    def _append(self, path: str, header: list, rows: list):
+        append_indexed(path, header, rows, self._ts_fields[tuple(header)])
+
+    def import_legacy(self, dataset: str, path: str) -> int:
+        segments = self.segments[dataset]
+        segments.ensure_exists()
+        return segments.import_legacy(path)
+
+    def prepare(self, dataset: str, row: dict) -> tuple:
+        segments = self.segments[dataset]
+        ts = parse_ts(row[segments.ts_field])
+        return (segments.segment_for(row["guild_id"], ts), segments.fields,
+                [row[field] for field in segments.fields])
+
+    def delete(self, dataset: str, guild_id, field: str, value):
+        # Recorded as a tombstone, rows are rewritten by compact()
+        self.segments[dataset].tombstones.add(guild_id, field, value,
+                                              datetime.now(timezone.utc))
+
+    def rewrite(self, dataset: str, rows):
+        with self.write_queue.paused():
+            self.segments[dataset].rewrite(rows)
+
+    def drop_before(self, dataset: str, cutoff: datetime) -> int:
+        self.flush()
+        return self.segments[dataset].drop_before(cutoff)
+
+    def retention_boundary(self, cutoff: datetime) -> datetime:
+        return day_start(cutoff.astimezone(timezone.utc).date())
+
+    def needs_compaction(self) -> bool:
+        return any(
+            s.tombstones.needs_compaction() for s in self.segments.values())
+
+    def compact(self) -> int:
+        with self.write_queue.paused():
+            return sum(s.compact() for s in self.segments.values())
+
+    def iter_rows(self, dataset, guild_id=None, start=None, end=None):
+        # The guild shards and day segments already cut the window exactly
+        yield from self.segments[dataset].iter_rows(guild_id, start, end)
+
+    def drop_guild(self, guild_id) -> bool:
+        """Delete every row of a guild (one directory per dataset)."""
+        with self.write_queue.paused():
+            dropped = [s.drop_guild(guild_id) for s in self.segments.values()]
+        return any(dropped)
+
+
+class SqliteBackend(StorageBackend):
+    """
+    Embedded SQLite database in WAL mode.
+
+    Timestamps are stored as epoch microseconds and every table is indexed
+    on (guild_id, user_id, ts) and (guild_id, channel_id, ts), pings also
+    on (guild_id, role_id), so windowed queries are index range scans.
+    """
+
+    kind = "sqlite"
+    native_counts = True
+    fetch_rows = 5000  # Rows read per batch by iter_rows
+
+    def __init__(self,
+                 path: str = "data/activity.sqlite3",
+                 max_batch: int = 500,
+                 flush_interval: float = 2.0):
+        super().__init__(
+            WriteBehindQueue(max_batch, flush_interval, writer=self._insert))
+        self.location = os.path.abspath(path)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+
+    def _create_schema(self):
+        with self._lock, self._conn:
+            for name, ds in DATASETS.items():
+                columns = ", ".join(
+                    f"{field} INTEGER NOT NULL" for field in ds.fields)
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} ({columns})")
+
+                ts = ds.ts_field
+                indexes = [("user_ts", f"guild_id, user_id, {ts}"),
+                           ("channel_ts", f"guild_id, channel_id, {ts}"),
+                           ("ts", f"guild_id, {ts}"), ("retention", ts)]
+                if "role_id" in ds.fields:
+                    indexes.append(("role", "guild_id, role_id"))
+
+                for suffix, cols in indexes:
+                    self._conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS idx_{name}_{suffix} "
+                        f"ON {name} ({cols})")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
+
+    # ---------- Encoding ----------
+
+    @staticmethod
+    def _encode(ds: Dataset, row: dict) -> list:
+        values = []
+        for field in ds.fields:
+            value = row[field]
+            if field in ds.ts_fields:
+                if not isinstance(value, datetime):
+                    value = parse_ts(value)
+                value = to_epoch_us(value)
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _decode(ds: Dataset, values) -> dict:
+        row = {}
+        for field, value in zip(ds.fields, values):
+            if field in ds.ts_fields:
+                row[field] = from_epoch_us(value).isoformat()
+            else:
+                row[field] = str(value)
+        return row
+
+    # ---------- Writes ----------
+
+    def _insert(self, dataset: str, _header, rows: list):
+        ds = DATASETS[dataset]
+        placeholders = ", ".join("?" for _ in ds.fields)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                f"INSERT INTO {dataset} VALUES ({placeholders})", rows)
+
+    def prepare(self, dataset: str, row: dict) -> tuple:
+        return dataset, None, self._encode(DATASETS[dataset], row)
+
+    def import_legacy(self, dataset: str, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+
+        ds = DATASETS[dataset]
+        imported = 0
+        batch = []
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    batch.append(self._encode(ds, row))
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"[SQLite] Skipping bad row in {path}: {e}")
+                    continue
+                if len(batch) >= 5000:
+                    self._insert(dataset, None, batch)
+                    imported += len(batch)
+                    batch = []
+        if batch:
+            self._insert(dataset, None, batch)
+            imported += len(batch)
+
+        os.replace(path, path + ".migrated")
+        print(f"[SQLite] Imported {imported} rows from {path}")
+        return imported
+
+    def delete(self, dataset: str, guild_id, field: str, value):
+        if field not in DATASETS[dataset].fields:
+            raise ValueError(f"Unknown field {field!r} for {dataset}")
+        self.flush()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM {dataset} WHERE guild_id = ? AND {field} = ?",
+                (str(guild_id), str(value)))
+
+    def rewrite(self, dataset: str, rows):
+        ds = DATASETS[dataset]
+        self.flush()
+        values = [self._encode(ds, row) for row in rows]
+        placeholders = ", ".join("?" for _ in ds.fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM {dataset}")
+            self._conn.executemany(
+                f"INSERT INTO {dataset} VALUES ({placeholders})", values)
+
+    def drop_before(self, dataset: str, cutoff: datetime) -> int:
+        ts = DATASETS[dataset].ts_field
+        self.flush()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"DELETE FROM {dataset} WHERE {ts} < ?",
+                (to_epoch_us(cutoff), ))
+            return cursor.rowcount
+
+    # ---------- Queries ----------
+
+    def _where(self, ds: Dataset, guild_id, start, end):
+        clauses, params = [], []
+        if guild_id is not None:
+            clauses.append("guild_id = ?")
+            params.append(str(guild_id))
+        if start is not None:
+            clauses.append(f"{ds.ts_field} >= ?")
+            params.append(to_epoch_us(start))
+        if end is not None:
+            clauses.append(f"{ds.ts_field} < ?")
+            params.append(to_epoch_us(end))
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def iter_rows(self, dataset, guild_id=None, start=None, end=None):
+        ds = DATASETS[dataset]
+        where, params = self._where(ds, guild_id, start, end)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"SELECT {', '.join(ds.fields)} FROM {dataset}{where} "
+                f"ORDER BY {ds.ts_field}", params)
+        try:
+            # In batches, releasing the lock in between for writes
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(self.fetch_rows)
+                if not rows:
+                    break
+                for values in rows:
+                    yield self._decode(ds, values)
+        finally:
+            with self._lock:
+                cursor.close()
+
+    def count(self, dataset, guild_id, start=None, end=None) -> int:
+        ds = DATASETS[dataset]
+        where, params = self._where(ds, guild_id, start, end)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COUNT(*) FROM {dataset}{where}", params).fetchone()[0]
+
+    def count_by(self, dataset, guild_id, key, start=None, end=None):
+        ds = DATASETS[dataset]
+        keys = _keys(key)
+        exprs = []
+        for k in keys:
+            if k == "hour":
+                exprs.append(f"(({ds.ts_field} / 3600000000) % 24)")
+            elif k == "day":
+                exprs.append(f"({ds.ts_field} / 86400000000)")
+            elif k in ds.fields:
+                exprs.append(k)
+            else:
+                raise ValueError(f"Unknown key {k!r} for {dataset}")
+
+        where, params = self._where(ds, guild_id, start, end)
+        group = ", ".join(exprs)
+        with self._lock:
+            result = self._conn.execute(
+                f"SELECT {group}, COUNT(*) FROM {dataset}{where} "
+                f"GROUP BY {group}", params).fetchall()
+
+        counts = Counter()
+        for *values, n in result:
+            converted = []
+            for k, value in zip(keys, values):
+                if k == "hour":
+                    converted.append(value)
+                elif k == "day":
+                    converted.append((EPOCH + timedelta(days=value)).date())
+                else:
+                    converted.append(str(value))
+            counts[tuple(converted) if len(keys) > 1 else converted[0]] = n
+        return counts
+
+
+class BinaryBackend(StorageBackend):
+    """
+    Day segments of fixed-width int64 records, scanned through `mmap`.
+
+    Counting queries group the mapped integers directly and only
+    `iter_rows` turns records back into CSV-style rows. Only numeric
+    Discord IDs can be stored; other rows are skipped with a message.
+    """
+
+    kind = "binary"
+    native_counts = True
+
+    def __init__(self,
+                 base_dir: str = "data/binary",
+                 max_batch: int = 500,
+                 flush_interval: float = 2.0):
+        super().__init__(
+            WriteBehindQueue(max_batch, flush_interval, writer=append_records))
+        self.location = os.path.abspath(base_dir)
+        self.segments: dict[str, BinarySegments] = {}
+
+        for name, ds in DATASETS.items():
+            directory = os.path.join(base_dir, ds.directory)
+            tombstones = TombstoneLog(os.path.join(directory,
+                                                   "tombstones.csv"))
+            self.segments[name] = BinarySegments(directory, ds.fields,
+                                                 ds.ts_field, ds.ts_fields,
+                                                 tombstones)
+
+    def import_legacy(self, dataset: str, path: str) -> int:
+        if not os.path.exists(path):
+            return 0
+
+        segments = self.segments[dataset]
+        segments.ensure_exists()
+        grouped: dict[str, list] = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    record = segments.encode(row)
+                except (KeyError, TypeError, ValueError) as e:
+                    print(f"[Binary] Skipping bad row in {path}: {e}")
+                    continue
+                grouped.setdefault(
+                    segments.segment_for(record[segments.ts_index]),
+                    []).append(record)
+
+        for segment, records in grouped.items():
+            append_records(segment, None, records)
+
+        os.replace(path, path + ".migrated")
+        imported = sum(len(r) for r in grouped.values())
+        print(f"[Binary] Imported {imported} rows from {path}")
+        return imported
+
+    def prepare(self, dataset: str, row: dict) -> tuple:
+        segments = self.segments[dataset]
+        record = segments.encode(row)
+        return segments.segment_for(record[segments.ts_index]), None, record
+
+    def append(self, dataset: str, row: dict):
+        try:
+            entry = self.prepare(dataset, row)
+        except ValueError as e:
+            print(f"[Binary] Skipping {dataset} row: {e}")
+            return
+        self.write_queue.enqueue(*entry)
+
+    def delete(self, dataset: str, guild_id, field: str, value):
+        # Recorded as a tombstone, records are rewritten by compact()
+        self.segments[dataset].tombstones.add(guild_id, field, value,
+                                              datetime.now(timezone.utc))
+
+    def rewrite(self, dataset: str, rows):
+        segments = self.segments[dataset]
+        records = []
+        for row in rows:
+            try:
+                records.append(segments.encode(row))
+            except ValueError as e:
+                print(f"[Binary] Skipping {dataset} row: {e}")
+        with self.write_queue.paused():
+            segments.rewrite(records)
+
+    def drop_before(self, dataset: str, cutoff: datetime) -> int:
+        self.flush()
+        return self.segments[dataset].drop_before(cutoff)
+
+    def retention_boundary(self, cutoff: datetime) -> datetime:
+        return day_start(cutoff.astimezone(timezone.utc).date())
+
+    def needs_compaction(self) -> bool:
+        return any(
+            s.tombstones.needs_compaction() for s in self.segments.values())
+
+    def compact(self) -> int:
+        with self.write_queue.paused():
+            return sum(s.compact() for s in self.segments.values())
+
+    def _records(self, dataset, guild_id, start, end):
+        if guild_id is not None:
+            try:
+                encode_snowflake(guild_id)
+            except ValueError:
+                # Not a snowflake, so nothing of that guild can be stored
+                return iter(())
+        return self.segments[dataset].records(guild_id, start, end)
+
+    def iter_rows(self, dataset, guild_id=None, start=None, end=None):
+        decode = self.segments[dataset].decode
+        for record in self._records(dataset, guild_id, start, end):
+            yield decode(record)
+
+    def count(self, dataset, guild_id, start=None, end=None) -> int:
+        return sum(1 for _ in self._records(dataset, guild_id, start, end))
+
+    def count_by(self, dataset, guild_id, key, start=None, end=None):
+        segments = self.segments[dataset]
+        keys = _keys(key)
+        indexes = []
+        for k in keys:
+            if k in TIME_KEYS:
+                indexes.append(segments.ts_index)
+            elif k in segments.fields:
+                indexes.append(segments.fields.index(k))
+            else:
+                raise ValueError(f"Unknown key {k!r} for {dataset}")
+
+        raw = Counter()
+        for record in self._records(dataset, guild_id, start, end):
+            values = []
+            for k, i in zip(keys, indexes):
+                if k == "hour":
+                    values.append(record[i] // 3_600_000_000 % 24)
+                elif k == "day":
+                    values.append(record[i] // DAY_US)
+                else:
+                    values.append(record[i])
+            raw[tuple(values)] += 1
+
+        counts = Counter()
+        for values, n in raw.items():
+            converted = []
+            for k, value in zip(keys, values):
+                if k == "hour":
+                    converted.append(value)
+                elif k == "day":
+                    converted.append((EPOCH + timedelta(days=value)).date())
+                else:
+                    converted.append(str(value))
+            counts[tuple(converted) if len(keys) > 1 else converted[0]] = n
+        return counts
+
+
+def open_storage(kind: str = "csv", **kwargs) -> StorageBackend:
+    """Create the storage backend named `kind` ("csv", "sqlite" or "binary")."""
+    backends = {
+        "csv": CsvBackend,
+        "sqlite": SqliteBackend,
+        "binary": BinaryBackend
+    }
+    if kind not in backends:
+        raise ValueError(f"Unknown storage backend: {kind}")
+    return backends[kind](**kwargs)
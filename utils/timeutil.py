@@ -0,0 +1,14 @@
+from datetime import date, datetime, time, timezone
+
+
+def parse_ts(ts: str) -> datetime:
+    """Parse an ISO-8601 timestamp, treating naive values as UTC."""
+    dt = datetime.fromisoformat(ts)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def day_start(day: date) -> datetime:
+    """Midnight UTC at the start of `day`."""
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
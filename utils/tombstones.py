@@ -0,0 +1,129 @@
+import csv
+import os
+import threading
+from datetime import datetime
+
+from utils.timeutil import parse_ts
+from utils.write_queue import append_csv_rows
+
+TOMBSTONE_FIELDS = ["guild_id", "field", "value", "timestamp"]
+
+
+def is_deleted(tombstones: dict, row: dict, ts_field: str) -> bool:
+    """Check a row against a {(guild_id, field, value): timestamp} mapping."""
+    if not tombstones:
+        return False
+
+    guild_id = row.get("guild_id")
+    for field in ("role_id", "user_id", "channel_id"):
+        deleted_at = tombstones.get((guild_id, field, row.get(field)))
+        if deleted_at is not None and parse_ts(row[ts_field]) <= deleted_at:
+            return True
+    return False
+
+
+class TombstoneLog:
+    """
+    Small append-only log of deletions for a segmented dataset.
+
+    A tombstone (guild_id, field, value, timestamp) hides every row of that
+    guild whose `field` equals `value` and that is not newer than the
+    tombstone. Readers apply the log as a filter; `SegmentedCsv.compact()`
+    folds it into the data files once it grows past a threshold.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_entries: int = 50,
+                 max_bytes: int = 64 * 1024):
+        self.path = os.path.abspath(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._latest: dict[tuple[str, str, str], datetime] = {}
+        self._loaded_stat = False  # None once loaded while there is no file
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Reloaded when the file changes, e.g. written by the bot while
+        # this copy lives in an analytics worker process
+        try:
+            stat = os.stat(self.path)
+            loaded_stat = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            loaded_stat = None
+        if self._loaded_stat == loaded_stat:
+            return
+
+        latest = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        ts = parse_ts(row["timestamp"])
+                    except (TypeError, ValueError):
+                        continue
+                    key = (row["guild_id"], row["field"], row["value"])
+                    if key not in latest or ts > latest[key]:
+                        latest[key] = ts
+
+        self._latest = latest
+        self._loaded_stat = loaded_stat
+
+    def __len__(self):
+        self._load()
+        return len(self._latest)
+
+    def add(self, guild_id, field: str, value, ts: datetime):
+        """Record that rows matching (guild_id, field == value) up to `ts` are gone."""
+        with self._lock:
+            self._load()
+            key = (str(guild_id), field, str(value))
+            if key not in self._latest or ts > self._latest[key]:
+                self._latest[key] = ts
+            append_csv_rows(self.path, TOMBSTONE_FIELDS,
+                            [[key[0], key[1], key[2],
+                              ts.isoformat()]])
+
+    def is_deleted(self, row: dict, ts_field: str) -> bool:
+        self._load()
+        return is_deleted(self._latest, row, ts_field)
+
+    def snapshot(self) -> dict:
+        """Copy of the current tombstones, safe to use from another thread."""
+        with self._lock:
+            self._load()
+            return dict(self._latest)
+
+    def needs_compaction(self) -> bool:
+        if len(self) >= self.max_entries:
+            return True
+        return (os.path.exists(self.path)
+                and os.path.getsize(self.path) >= self.max_bytes)
+
+    def discard(self, applied: dict):
+        """
+        Forget tombstones that have been folded into the data files.
+
+        Tombstones added or extended after `applied` was taken are kept.
+        """
+        with self._lock:
+            self._load()
+            for key, ts in applied.items():
+                if self._latest.get(key) == ts:
+                    del self._latest[key]
+
+            if not self._latest:
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                return
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(TOMBSTONE_FIELDS)
+                for (guild_id, field, value), ts in self._latest.items():
+                    writer.writerow([guild_id, field, value, ts.isoformat()])
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.discard(self.snapshot())
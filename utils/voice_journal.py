@@ -0,0 +1,200 @@
+import csv
+import os
+import threading
+from datetime import datetime, timezone
+
+from utils.timeutil import parse_ts
+from utils.write_queue import append_csv_rows
+
+JOURNAL_FIELDS = ["event", "guild_id", "user_id", "channel_id", "timestamp"]
+
+
+class VoiceJournal:
+    """
+    Open voice sessions, journaled to an append-only CSV.
+
+    `open` (join or move) and `close` append one line before changing the
+    in-memory sessions, so a restart or crash loses no open session. The
+    journal is rewritten with only the open sessions when it is loaded and
+    once it holds more than `compact_lines` and twice as many lines as
+    open sessions, so replaying it stays O(open sessions).
+
+    Sessions are keyed by (guild_id, user_id) and hold "channel_id" and
+    "joined_at".
+    """
+
+    def __init__(self, path: str, compact_lines: int = 1000):
+        self.path = os.path.abspath(path)
+        self.compact_lines = compact_lines
+        self._sessions: dict[tuple[str, str], dict] = {}
+        self._lines = 0
+        # Last journal write or heartbeat, of the previous run until this
+        # one writes
+        self._alive: datetime | None = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+
+        self._sessions = {}
+        self._alive = None
+        if os.path.exists(self.path):
+            self._alive = datetime.fromtimestamp(
+                os.path.getmtime(self.path), tz=timezone.utc)
+            with open(self.path, "r", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    try:
+                        key = (row["guild_id"], row["user_id"])
+                        if row["event"] == "open":
+                            self._sessions[key] = {
+                                "channel_id": row["channel_id"],
+                                "joined_at": parse_ts(row["timestamp"])
+                            }
+                        elif row["event"] == "close":
+                            self._sessions.pop(key, None)
+                    except (KeyError, TypeError, ValueError):
+                        continue  # Torn last line after a crash
+        self._loaded = True
+        self._rewrite()
+
+    def _rewrite(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(JOURNAL_FIELDS)
+            for (guild_id, user_id), session in self._sessions.items():
+                writer.writerow(["open", guild_id, user_id,
+                                 session["channel_id"],
+                                 session["joined_at"].isoformat()])
+        os.replace(tmp_path, self.path)
+        self._lines = len(self._sessions)
+
+    def _append(self, event: str, key: tuple, channel_id: str,
+                ts: datetime):
+        append_csv_rows(self.path, JOURNAL_FIELDS,
+                        [[event, key[0], key[1], channel_id, ts.isoformat()]])
+        self._lines += 1
+        self._alive = datetime.now(timezone.utc)
+        if self._lines > max(self.compact_lines, 2 * len(self._sessions)):
+            self._rewrite()
+
+    def __len__(self):
+        with self._lock:
+            self._load()
+            return len(self._sessions)
+
+    def get(self, guild_id, user_id) -> dict | None:
+        with self._lock:
+            self._load()
+            return self._sessions.get((str(guild_id), str(user_id)))
+
+    def oldest_open(self, guild_id) -> datetime | None:
+        """Join time of the oldest open session of a guild."""
+        guild_id = str(guild_id)
+        with self._lock:
+            self._load()
+            return min((session["joined_at"]
+                        for key, session in self._sessions.items()
+                        if key[0] == guild_id), default=None)
+
+    def open(self, guild_id, user_id, channel_id, ts: datetime) -> dict | None:
+        """
+        Start a session in `channel_id` (join or move).
+
+        Returns:
+            The session that was open before (a move), or None
+        """
+        key = (str(guild_id), str(user_id))
+        with self._lock:
+            self._load()
+            self._append("open", key, str(channel_id), ts)
+            previous = self._sessions.get(key)
+            self._sessions[key] = {"channel_id": str(channel_id),
+                                   "joined_at": ts}
+            return previous
+
+    def close(self, guild_id, user_id, ts: datetime) -> dict | None:
+        """End a session. Returns it, or None if none was open."""
+        key = (str(guild_id), str(user_id))
+        with self._lock:
+            self._load()
+            session = self._sessions.get(key)
+            if session is None:
+                return None
+            self._append("close", key, session["channel_id"], ts)
+            return self._sessions.pop(key)
+
+    def heartbeat(self):
+        """Mark the bot as alive, see `reconcile`."""
+        with self._lock:
+            self._load()
+            os.utime(self.path)
+            self._alive = datetime.now(timezone.utc)
+
+    def reconcile(self, guild_id, in_voice: dict,
+                  now: datetime) -> list[tuple]:
+        """
+        Match the journaled sessions of a guild against who is in voice.
+
+        Sessions of users still in the same channel are resumed. Sessions
+        of users who left or moved while the bot was offline are closed at
+        the last journal write or heartbeat (of the previous run after a
+        restart, of this one after a reconnect), users in voice without a
+        session get one starting `now`.
+
+        Args:
+            in_voice: {user_id: channel_id} of the members in voice now
+
+        Returns:
+            List of tuples of the closed sessions:
+            [(user_id, channel_id, joined_at, left_at), ...]
+        """
+        guild_id = str(guild_id)
+        in_voice = {str(u): str(c) for u, c in in_voice.items()}
+        closed = []
+        with self._lock:
+            self._load()
+            ended = min(self._alive or now, now)
+            for key, session in list(self._sessions.items()):
+                if key[0] != guild_id:
+                    continue
+                if in_voice.get(key[1]) == session["channel_id"]:
+                    continue
+                left = max(ended, session["joined_at"])
+                self._append("close", key, session["channel_id"], left)
+                del self._sessions[key]
+                closed.append((key[1], session["channel_id"],
+                               session["joined_at"], left))
+
+            for user_id, channel_id in in_voice.items():
+                key = (guild_id, user_id)
+                if key not in self._sessions:
+                    self._append("open", key, channel_id, now)
+                    self._sessions[key] = {"channel_id": channel_id,
+                                           "joined_at": now}
+        return closed
+
+    def sweep(self, cutoff: datetime, active) -> int:
+        """
+        Drop sessions opened before `cutoff` whose (guild_id, user_id) is
+        not in `active`, e.g. after a missed leave event or a removed
+        guild. Their time is not recorded.
+
+        Returns:
+            Number of sessions dropped
+        """
+        active = {(str(g), str(u)) for g, u in active}
+        with self._lock:
+            self._load()
+            stale = [key for key, session in self._sessions.items()
+                     if session["joined_at"] < cutoff and key not in active]
+            for key in stale:
+                del self._sessions[key]
+            if stale:
+                self._rewrite()
+            return len(stale)
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.query import Query, execute
+from utils.storage import LOCATION_ARGS, open_storage
+
+# Backends opened by a worker process, keyed by (kind, location)
+_worker_storage = {}
+
+
+def execute_in_worker(kind: str, location: str, query: Query) -> dict:
+    """Run `query` in a worker process against its own storage handle."""
+    storage = _worker_storage.get((kind, location))
+    if storage is None:
+        storage = open_storage(kind, **{LOCATION_ARGS[kind]: location})
+        _worker_storage[(kind, location)] = storage
+    return execute(query, storage)
+
+
+class AnalyticsPool:
+    """
+    Runs analytics off the event loop.
+
+    With kind "thread" queries run in a ThreadPoolExecutor against the
+    live storage and rollup. With kind "process" only the picklable Query
+    is sent to a ProcessPoolExecutor; each worker opens the storage
+    backend itself and reads raw rows (the rollup lives in the bot
+    process). At most `max_jobs` jobs run at once, further callers wait.
+    """
+
+    def __init__(self, kind: str = "thread", workers: int = 2,
+                 max_jobs: int = 2):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self._slots = asyncio.Semaphore(max_jobs)
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            executor = (ThreadPoolExecutor if self.kind == "thread" else
+                        ProcessPoolExecutor)
+            self._executor = executor(max_workers=self.workers)
+        return self._executor
+
+    async def run(self, fn, *args):
+        """Run `fn(*args)` in the pool (must be picklable for processes)."""
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn,
+                                              *args)
+
+    async def execute(self, query: Query, storage, rollup=None) -> dict:
+        """Compute `query` in the pool, see utils.query.execute."""
+        if self.kind == "thread":
+            return await self.run(execute, query, storage, rollup)
+
+        # Buffered rows must be on disk before another process reads
+        await asyncio.to_thread(storage.flush)
+        return await self.run(execute_in_worker, storage.kind,
+                              storage.location, query)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
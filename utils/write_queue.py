@@ -0,0 +1,179 @@
+import asyncio
+import csv
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def append_csv_rows(path: str, header: list | None, rows: list):
+    """Append rows to a CSV file, writing `header` first if the file is new."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    needs_header = header is not None and (not os.path.exists(path)
+                                           or os.path.getsize(path) == 0)
+
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if needs_header:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+class WriteBehindQueue:
+    """
+    Buffers rows in memory and writes them to disk in batches.
+
+    Rows are grouped by target so every flush opens each file once. The
+    `writer(target, header, rows)` callable does the actual writing and
+    defaults to appending to CSV files.
+    While the background task is running, flushes happen when `max_batch`
+    rows are pending or every `flush_interval` seconds. Without a running
+    task (tests, CLI scripts) rows are written through immediately.
+    """
+
+    def __init__(self,
+                 max_batch: int = 500,
+                 flush_interval: float = 2.0,
+                 writer=append_csv_rows):
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.writer = writer
+
+        self._pending: list[tuple[str, list | None, list]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wakeup: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+
+        # Counters
+        self.enqueued = 0
+        self.written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        """Number of rows waiting to be written."""
+        return len(self._pending)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def enqueue(self, path: str, header: list | None, row: list):
+        """
+        Queue a row for `path`.
+
+        Args:
+            path: CSV file the row belongs to
+            header: Header row written if the file is new or empty
+            row: The row itself
+        """
+        with self._pending_lock:
+            self._pending.append((path, header, row))
+            self.enqueued += 1
+            depth = len(self._pending)
+
+        if not self.running:
+            self.flush()
+        elif depth >= self.max_batch:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Write all pending rows to disk (blocking).
+
+        Returns:
+            Number of rows written
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+
+            grouped: dict[str, tuple[list | None, list]] = {}
+            for path, header, row in batch:
+                grouped.setdefault(path, (header, []))[1].append(row)
+
+            written = 0
+            for path, (header, rows) in grouped.items():
+                try:
+                    self.writer(path, header, rows)
+                    written += len(rows)
+                except Exception as e:
+                    self.errors += 1
+                    print(f"[WriteQueue] Error writing {path}: {e}")
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.written += written
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            return written
+
+    @contextmanager
+    def paused(self):
+        """
+        Flush, then block further flushes until the block exits.
+
+        Used while data files are rewritten so no batch is appended to a
+        file that is about to be replaced.
+        """
+        with self._flush_lock:
+            self.flush()
+            yield
+
+    def start(self):
+        """Start the background flush task on the running event loop."""
+        if self.running:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and drain everything still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            if self._pending:
+                await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        """Queue depth and flush latency counters."""
+        return {
+            "depth": self.depth,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 2)
+            if self.flushes else 0.0,
+        }